@@ -1,19 +1,44 @@
 import streamlit as st
-import pyodbc
-import csv
 import os
-from google.cloud import storage
-from google.cloud import bigquery
+import tempfile
+import time
 import datetime  # Import datetime module for date and time operations
+from migration.engine import MigrationConfig, MigrationWorker
+from migration.export import DEFAULT_EXPORT_WORKERS
+from migration.formats import DEFAULT_FORMAT
+from migration.loading import DEFAULT_MAX_IN_FLIGHT, DEFAULT_WRITE_MODE
+from migration.partition import DEFAULT_MAX_SHARDS, DEFAULT_SHARD_ROWS
+from migration.progress import ProgressState, drain_events
+from migration.resources import ResourceCache
+from migration.streaming import DEFAULT_BATCH_SIZE
 
 # Global variables
 JSON_AUTH_FILE_PATH = ""
-stop_transfer = False
+FETCH_BATCH_SIZE = DEFAULT_BATCH_SIZE  # Rows fetched from SQL Server per round trip
+EXPORT_WORKERS = DEFAULT_EXPORT_WORKERS  # Tables exported in parallel
+SHARD_ROWS = DEFAULT_SHARD_ROWS  # Tables above this row count are split by key range
+MAX_SHARDS_PER_TABLE = DEFAULT_MAX_SHARDS
+LOAD_JOBS = DEFAULT_MAX_IN_FLIGHT  # BigQuery load jobs run at the same time
+INCLUDE_TABLES = ()  # Table globs to migrate, e.g. ("sales.*",); empty means all
+EXCLUDE_TABLES = ()  # Table globs to skip
+OUTPUT_FORMAT = DEFAULT_FORMAT  # Staging format: "csv", "parquet" or "avro"
+COMPRESSION = None  # "gzip" for CSV; "snappy"/"zstd" for Parquet and Avro
+SYNC_MODE = "full"  # "incremental" exports only rows changed since the last run
+WRITE_MODE = DEFAULT_WRITE_MODE  # "truncate", "append", "merge" or "skip"
+POLL_INTERVAL = 0.5  # Seconds between progress refreshes while a migration runs
+
+
+# Define the append_to_console function to add messages to the console output.
+# Messages are kept in the session so they survive the reruns of the script.
+def append_to_console(message):
+    st.session_state.setdefault("console_lines", []).append(message)
 
 
-# Define the append_to_console function to add messages to the console output
-def append_to_console(message):
-    st.text(message)
+# Clients and SQL Server connections shared by every session and rerun of
+# the app, so a migration does not authenticate and connect from scratch
+@st.cache_resource
+def shared_resources():
+    return ResourceCache()
 
 
 # Define the get_current_datetime function to get the current date and time
@@ -22,136 +47,26 @@ def get_current_datetime():
     return now.strftime("%Y-%m-%d_%H-%M-%S")
 
 
-# Define export_to_gcs to accept UI elements as arguments
-def export_to_gcs(sql_server_details, bucket_name):
-    global stop_transfer
-    try:
-        # Connect to SQL Server
-        conn = pyodbc.connect(
-            f"DRIVER={{SQL Server}};"
-            f"SERVER={sql_server_details['server']};"
-            f"DATABASE={sql_server_details['database']};"
-            f"UID={sql_server_details['username']};"
-            f"PWD={sql_server_details['password']};"
-        )
-
-        # Create a cursor from the connection
-        cursor = conn.cursor()
-
-        # Query to get all tables in the database
-        query_tables = "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE = 'BASE TABLE'"
-        cursor.execute(query_tables)
-        tables = cursor.fetchall()
-
-        total_rows_transferred = 0  # Counter for total rows transferred
-
-        # Initialize the Google Cloud Storage client
-        storage_client = storage.Client()
-
-        # Iterate over each table
-        for table in tables:
-            if stop_transfer:
-                append_to_console("Transfer stopped by user.")
-                break
-
-            table_name = table[0]
-            append_to_console(f"Exporting data from table: {table_name}")
-
-            # Query to select all data from the current table
-            query_data = f"SELECT * FROM {table_name}"
-            cursor.execute(query_data)
-
-            # Specify the name of the object in the bucket
-            blob_name = f"{table_name}.csv"
-
-            # Get the bucket
-            bucket = storage_client.bucket(bucket_name)
-
-            # Create a blob object in the bucket
-            blob = bucket.blob(blob_name)
-
-            # Write data directly to the blob
-            with blob.open("w", encoding="utf-8", newline="") as file:
-                csv_writer = csv.writer(file)
-
-                # Write the header
-                header = [column[0] for column in cursor.description]
-                csv_writer.writerow(header)
-
-                # Write data rows and track progress
-                for row in cursor.fetchall():
-                    if stop_transfer:
-                        append_to_console("Transfer stopped by user.")
-                        break
-                    csv_writer.writerow(row)
-                    total_rows_transferred += 1
-
-            append_to_console(
-                f"Data from table '{table_name}' has been uploaded to GCS bucket: gs://{bucket_name}/{blob_name}"
-            )
-        # Transfer data from GCS to BigQuery
-        transfer_to_bigquery()
-
-    except Exception as e:
-        append_to_console(f"An error occurred: {str(e)}")
-
-    finally:
-        # Close the cursor and connection
-        if "cursor" in locals() and cursor:
-            cursor.close()
-        if "conn" in locals() and conn:
-            conn.close()
-
-
-# Define transfer_to_bigquery to accept UI elements as arguments
-def transfer_to_bigquery():
-    global JSON_AUTH_FILE_PATH
-
-    if not JSON_AUTH_FILE_PATH:
-        append_to_console("Please select the JSON authentication file.")
-        return
-
-    PROJECT_ID = st.session_state.project_id
-    DATASET_NAME = st.session_state.dataset_name
-    BUCKET_NAME = st.session_state.bucket_name
-
-    bigquery_client = bigquery.Client(project=PROJECT_ID)
-    storage_client = storage.Client(project=PROJECT_ID)
-
-    bucket = storage_client.get_bucket(BUCKET_NAME)
-    blobs = bucket.list_blobs()
-
-    for blob in blobs:
-        if blob.name.endswith(".csv"):
-            table_name = os.path.splitext(os.path.basename(blob.name))[0]
-            dataset_ref = bigquery_client.dataset(DATASET_NAME)
-            table_ref = dataset_ref.table(table_name)
-
-            try:
-                bigquery_client.get_table(table_ref)
-                append_to_console(
-                    f"Table {table_name} already exists. Skipping load for {blob.name}"
-                )
-            except Exception as e:
-                try:
-                    job_config = bigquery.LoadJobConfig(
-                        autodetect=True,
-                        skip_leading_rows=1,
-                        source_format=bigquery.SourceFormat.CSV,
-                        max_bad_records=1000,  # Adjust this value as needed
-                    )
-                    uri = f"gs://{BUCKET_NAME}/{blob.name}"
-                    load_job = bigquery_client.load_table_from_uri(
-                        uri, table_ref, job_config=job_config
-                    )
-                    load_job.result()  # Waits for the job to complete.
-                    append_to_console(
-                        f"Data from {blob.name} has been loaded into {table_name}"
-                    )
-                except Exception as load_error:
-                    append_to_console(
-                        f"Error loading data from {blob.name}: {load_error}"
-                    )
+# Build the engine configuration from the UI fields and the settings above
+def build_migration_config(sql_server_details, bucket_name, dataset_name, project_id):
+    return MigrationConfig(
+        bucket_name=bucket_name,
+        dataset_name=dataset_name,
+        project_id=project_id,
+        credentials_file=JSON_AUTH_FILE_PATH or None,
+        output_format=OUTPUT_FORMAT,
+        compression=COMPRESSION,
+        sync_mode=SYNC_MODE,
+        write_mode=WRITE_MODE,
+        export_workers=EXPORT_WORKERS,
+        batch_size=FETCH_BATCH_SIZE,
+        shard_rows=SHARD_ROWS,
+        max_shards=MAX_SHARDS_PER_TABLE,
+        load_jobs=LOAD_JOBS,
+        include_tables=INCLUDE_TABLES,
+        exclude_tables=EXCLUDE_TABLES,
+        **sql_server_details,
+    )
 
 
 def validate_ui_fields():
@@ -172,8 +87,10 @@ def validate_ui_fields():
 
 # Modify export_and_transfer_button_click function to accept UI elements as arguments
 def export_and_transfer_button_click():
-    global stop_transfer
-    stop_transfer = False
+    worker = st.session_state.get("migration_worker")
+    if worker is not None and worker.is_alive():
+        append_to_console("A migration is already running.")
+        return
     if not validate_ui_fields():
         append_to_console("Please fill in all fields before initiating the migration.")
         return
@@ -186,8 +103,19 @@ def export_and_transfer_button_click():
     }
     bucket_name = st.session_state.bucket_name
 
-    # Export data from SQL Server to GCS
-    export_to_gcs(sql_server_details, bucket_name)
+    # Export data from SQL Server to GCS and transfer it to BigQuery on a
+    # background thread. The worker lives in the session because every
+    # button click reruns this script.
+    config = build_migration_config(
+        sql_server_details,
+        bucket_name,
+        st.session_state.dataset_name,
+        st.session_state.project_id,
+    )
+    worker = MigrationWorker(config, resources=shared_resources())
+    worker.start()
+    st.session_state.migration_worker = worker
+    st.session_state.migration_progress = ProgressState()
 
     # Save UI data
     save_ui_data(sql_server_details, JSON_AUTH_FILE_PATH)
@@ -195,13 +123,45 @@ def export_and_transfer_button_click():
 
 def select_json_file(uploaded_file):
     global JSON_AUTH_FILE_PATH
-    JSON_AUTH_FILE_PATH = uploaded_file
-    st.session_state.json_file_path = JSON_AUTH_FILE_PATH
+    # The engine authenticates from a file path, so keep the upload on disk.
+    # Reruns reuse the copy written for the same upload.
+    upload_key = (uploaded_file.name, uploaded_file.size)
+    if st.session_state.get("json_upload_key") != upload_key:
+        with tempfile.NamedTemporaryFile("wb", suffix=".json", delete=False) as file:
+            file.write(uploaded_file.getvalue())
+        st.session_state.json_upload_key = upload_key
+        st.session_state.json_file_path = file.name
+    JSON_AUTH_FILE_PATH = st.session_state.json_file_path
 
 
 def stop_button_click():
-    global stop_transfer
-    stop_transfer = True
+    worker = st.session_state.get("migration_worker")
+    if worker is not None:
+        worker.stop()
+
+
+# Show the console and, while a migration runs, refresh its progress until
+# it finishes. A click on Cancel reruns the script, which lands back here.
+def follow_migration(console):
+    worker = st.session_state.get("migration_worker")
+    if worker is None:
+        console.text("\n".join(st.session_state.get("console_lines", [])))
+        return
+    progress_state = st.session_state.migration_progress
+    progress_bar = st.progress(progress_state.fraction)
+    status = st.empty()
+    while True:
+        for event in drain_events(worker.events):
+            progress_state.apply(event)
+            if event.kind == "message":
+                append_to_console(event.value)
+        progress_bar.progress(progress_state.fraction)
+        status.text(progress_state.summary())
+        console.text("\n".join(st.session_state.get("console_lines", [])))
+        if progress_state.finished:
+            del st.session_state.migration_worker
+            return
+        time.sleep(POLL_INTERVAL)
 
 
 # Define save_ui_data function to accept UI elements as arguments
@@ -270,5 +230,6 @@ if st.button("Cancel"):
     stop_button_click()
 
 # Console Output
-st.text_area("Console Output", height=10, disabled=True)
+st.subheader("Console Output")
+follow_migration(st.empty())
 
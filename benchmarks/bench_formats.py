@@ -0,0 +1,116 @@
+# Compare bytes written and encode time of the staging formats on synthetic
+# rows shaped like a typical fact table.
+#
+#   python benchmarks/bench_formats.py --rows 500000
+#   python benchmarks/bench_formats.py --formats csv csv:gzip parquet:zstd avro:deflate
+import argparse
+import datetime
+import io
+import os
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migration.formats import FORMATS, get_format  # noqa: E402
+
+# (name, type_code, display_size, internal_size, precision, scale, null_ok)
+DESCRIPTION = [
+    ("id", int, None, 10, 10, 0, False),
+    ("customer_code", str, None, 10, 10, 0, True),
+    ("amount", Decimal, None, 20, 38, 10, True),
+    ("quantity", int, None, 10, 10, 0, True),
+    ("ratio", float, None, 53, 53, 0, True),
+    ("created_at", datetime.datetime, None, 27, 27, 7, True),
+    ("order_date", datetime.date, None, 10, 10, 0, True),
+    ("is_active", bool, None, 1, 1, 0, True),
+    ("checksum", bytes, None, 16, 16, 0, True),
+]
+
+
+class SyntheticCursor:
+    description = DESCRIPTION
+
+    def __init__(self, row_count):
+        self.row_count = row_count
+        self.position = 0
+        self.arraysize = 1
+        self.base_time = datetime.datetime(2023, 1, 1)
+
+    def fetchmany(self, size):
+        end = min(self.position + size, self.row_count)
+        rows = [self.make_row(index) for index in range(self.position, end)]
+        self.position = end
+        return rows
+
+    def make_row(self, index):
+        return (
+            index,
+            f"{index % 100000:010d}",
+            Decimal(index % 1000003) / Decimal(1000),
+            index % 97,
+            (index % 1013) / 1013.0,
+            self.base_time + datetime.timedelta(seconds=index),
+            (self.base_time + datetime.timedelta(hours=index)).date(),
+            index % 2 == 0,
+            index.to_bytes(16, "little"),
+        )
+
+
+# Discards everything written while counting bytes
+class CountingSink(io.RawIOBase):
+    def __init__(self):
+        self.bytes_written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.bytes_written
+
+
+def run(format_spec, row_count, batch_size):
+    format_name, _, compression = format_spec.partition(":")
+    output_format = get_format(format_name, compression or None)
+    sink = CountingSink()
+    if output_format.binary:
+        file = sink
+    else:
+        file = io.TextIOWrapper(io.BufferedWriter(sink), encoding="utf-8", newline="")
+
+    started = time.perf_counter()
+    rows_written = output_format.write(
+        SyntheticCursor(row_count), file, batch_size=batch_size
+    )
+    file.flush()
+    elapsed = time.perf_counter() - started
+    return rows_written, sink.bytes_written, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare staging formats")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS))
+    args = parser.parse_args()
+
+    print(f"{'format':<16}{'rows':>10}{'MB':>10}{'seconds':>10}{'rows/s':>12}")
+    for format_spec in args.formats:
+        try:
+            rows, size, elapsed = run(format_spec, args.rows, args.batch_size)
+        except ImportError as e:
+            print(f"{format_spec:<16}skipped ({e})")
+            continue
+        print(
+            f"{format_spec:<16}{rows:>10}{size / 1e6:>10.2f}"
+            f"{elapsed:>10.2f}{rows / elapsed:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
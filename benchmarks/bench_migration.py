@@ -0,0 +1,310 @@
+# End-to-end throughput of run_migration against local stand-ins: a fake
+# SQL Server computing synthetic tables as they are read, in-memory GCS (or
+# a GCS emulator such as fake-gcs-server) and a BigQuery stub that loads
+# from it. Each scenario runs in a fresh process so its peak RSS is its own.
+# Reports rows/s and MB/s of the export stage, time per stage and peak RSS,
+# and saves them as JSON to compare runs.
+#
+#   python benchmarks/bench_migration.py --rows 200000
+#   python benchmarks/bench_migration.py --scenarios wide lob --format parquet
+#   python benchmarks/bench_migration.py --upload-mode composite --upload-chunk-mb 1
+#   STORAGE_EMULATOR_HOST=http://localhost:4443 \
+#       python benchmarks/bench_migration.py --gcs emulator
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migration.engine import MigrationConfig, run_migration  # noqa: E402
+from migration.progress import ProgressReporter  # noqa: E402
+from migration.resources import ResourceCache  # noqa: E402
+from migration.schema import ColumnInfo  # noqa: E402
+from migration.upload import UPLOAD_MODES  # noqa: E402
+from tests.fakes import (  # noqa: E402
+    FakeBigQueryClient,
+    FakeSqlServer,
+    FakeStorageClient,
+    FakeTable,
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+BASE_TIME = datetime.datetime(2023, 1, 1)
+
+# Text the LOB columns are sliced from, so rows cost little to make
+LOB_TEXT = "".join(chr(0x41 + index % 26) for index in range(20000))
+LOB_BYTES = bytes(index % 256 for index in range(10000))
+
+
+def key_column(data_type="bigint"):
+    return ColumnInfo("id", data_type, None, 19, 0, False)
+
+
+def narrow_table(row_count, name="narrow", key=None):
+    columns = [
+        key_column(),
+        ColumnInfo("code", "varchar", 20, None, None, True),
+        ColumnInfo("amount", "decimal", None, 18, 2, True),
+        ColumnInfo("created_at", "datetime2", None, 27, 7, True),
+    ]
+    key = key or (lambda index: index)
+
+    def make_row(index):
+        return (
+            key(index),
+            f"C{index % 100000:08d}",
+            Decimal(index % 1000003) / 100,
+            BASE_TIME + datetime.timedelta(seconds=index),
+        )
+
+    return FakeTable(name, columns, row_count, make_row, key)
+
+
+# (type, max_length, precision, scale, value of row index) of the wide
+# table's columns, in turn
+WIDE_TYPES = [
+    ("int", None, 10, 0, lambda index: index % 1000),
+    ("varchar", 50, None, None, lambda index: f"value {index % 5000}"),
+    ("float", None, 53, None, lambda index: index / 7.0),
+    ("decimal", None, 18, 4, lambda index: Decimal(index % 100003) / 10000),
+    ("datetime2", None, 27, 7, lambda index: BASE_TIME + datetime.timedelta(index)),
+    ("bit", None, None, None, lambda index: index % 2 == 0),
+    ("date", None, 10, 0, lambda index: (BASE_TIME + datetime.timedelta(index)).date()),
+]
+
+
+def wide_table(row_count, width=100):
+    kinds = [WIDE_TYPES[position % len(WIDE_TYPES)] for position in range(width - 1)]
+    columns = [key_column()] + [
+        ColumnInfo(f"c{position:03d}", data_type, max_length, precision, scale, True)
+        for position, (data_type, max_length, precision, scale, _) in enumerate(kinds)
+    ]
+    values = [kind[4] for kind in kinds]
+
+    def make_row(index):
+        return (index,) + tuple(value(index) for value in values)
+
+    return FakeTable("wide", columns, row_count, make_row)
+
+
+# Rows of a few KB each in nvarchar(max) and varbinary(max) columns
+def lob_table(row_count):
+    columns = [
+        key_column(),
+        ColumnInfo("title", "nvarchar", 200, None, None, True),
+        ColumnInfo("body", "nvarchar", -1, None, None, True),
+        ColumnInfo("attachment", "varbinary", -1, None, None, True),
+    ]
+
+    def make_row(index):
+        offset = index % 1000
+        return (
+            index,
+            f"Document {index}",
+            LOB_TEXT[offset : offset + 4000 + index % 4000],
+            LOB_BYTES[offset : offset + 2000 + index % 6000] if index % 5 else None,
+        )
+
+    return FakeTable("lob", columns, row_count, make_row)
+
+
+# Keys spread quadratically: equal key ranges hold very different numbers
+# of rows, the first shards most of them
+def skewed_table(row_count):
+    return narrow_table(row_count, "skewed", key=lambda index: index * index)
+
+
+# Tables of each scenario for a --rows budget. LOB rows are far bigger, so
+# the scenario reads fewer of them.
+SCENARIOS = {
+    "narrow": lambda rows: [narrow_table(rows)],
+    "wide": lambda rows: [wide_table(max(1, rows // 10))],
+    "lob": lambda rows: [lob_table(max(1, rows // 20))],
+    "skewed": lambda rows: [skewed_table(rows)],
+}
+
+
+# Highest resident set size of this process in bytes, or None when the
+# platform reports neither
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, "peak_wset", None)
+
+
+def storage_for(gcs, project_id, bucket_name):
+    if gcs == "memory":
+        return FakeStorageClient()
+    from google.cloud import storage
+
+    if not os.environ.get("STORAGE_EMULATOR_HOST"):
+        raise SystemExit("--gcs emulator needs STORAGE_EMULATOR_HOST")
+    storage_client = storage.Client(project=project_id)
+    if storage_client.lookup_bucket(bucket_name) is None:
+        storage_client.create_bucket(bucket_name)
+    return storage_client
+
+
+# Migrate one scenario's tables and measure it. Runs in its own process.
+def run_scenario(name, args):
+    tables = SCENARIOS[name](args.rows)
+    project_id, bucket_name = "bench", f"bench-{name}"
+    storage_client = storage_for(args.gcs, project_id, bucket_name)
+    bigquery_client = FakeBigQueryClient(project_id, storage_client=storage_client)
+    resources = ResourceCache(
+        client_factory=lambda config: (storage_client, bigquery_client),
+        connect=FakeSqlServer(tables).connect,
+    )
+    progress = ProgressReporter()
+    with tempfile.TemporaryDirectory() as directory:
+        config = MigrationConfig(
+            "bench",
+            name,
+            "bench",
+            "bench",
+            bucket_name,
+            name,
+            project_id,
+            output_format=args.format,
+            compression=args.compression,
+            export_workers=args.workers,
+            batch_size=args.batch_size,
+            shard_rows=args.shard_rows,
+            direct_max_bytes=args.direct_max_mb * 1024 * 1024,
+            upload_mode=args.upload_mode,
+            upload_chunk_size=args.upload_chunk_mb * 1024 * 1024,
+            manifest_path=os.path.join(directory, "manifest.db"),
+            state_path=os.path.join(directory, "state.json"),
+            metrics_path=None,
+            report_dir=None,
+        )
+        started = time.perf_counter()
+        result = run_migration(
+            config, log=lambda message: None, progress=progress, resources=resources
+        )
+        wall = time.perf_counter() - started
+    resources.close()
+
+    report = progress.metrics.report(result.run_id, result)
+    export_wall = report["stage_seconds"]["export"]
+    return {
+        "scenario": name,
+        "tables": len(tables),
+        "columns": sum(len(table.columns) for table in tables),
+        "completed": report["completed"],
+        "rows": report["rows"],
+        "objects": sum(table["objects"] for table in report["tables"].values()),
+        "bytes_uploaded": report["bytes_uploaded"],
+        "wall_seconds": round(wall, 3),
+        "rows_per_second": report["rows_per_second"],
+        "mb_per_second": (
+            round(report["bytes_uploaded"] / export_wall / 1e6, 2)
+            if export_wall
+            else None
+        ),
+        "stage_seconds": report["stage_seconds"],
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark a migration against local stand-ins"
+    )
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--format", default="csv")
+    parser.add_argument("--compression", default=None)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--shard-rows", type=int, default=25000)
+    # Small tables skip GCS when above 0, as in production runs
+    parser.add_argument("--direct-max-mb", type=int, default=0)
+    parser.add_argument("--gcs", choices=("memory", "emulator"), default="memory")
+    parser.add_argument("--upload-mode", choices=UPLOAD_MODES, default="resumable")
+    parser.add_argument("--upload-chunk-mb", type=int, default=32)
+    parser.add_argument(
+        "--output", help="JSON results file (default: benchmarks/results/...)"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'scenario':<10}{'rows':>10}{'objects':>9}{'MB':>9}{'rows/s':>10}"
+        f"{'MB/s':>8}{'fetch':>8}{'encode':>8}{'upload':>8}{'load':>7}"
+        f"{'RSS MB':>8}"
+    )
+    results = []
+    for name in args.scenarios:
+        # A fresh process per scenario keeps peak RSS separate
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(run_scenario, name, args).result()
+        results.append(result)
+        stages = result["stage_seconds"]
+        rss = result["peak_rss_bytes"]
+        print(
+            f"{name:<10}{result['rows']:>10}{result['objects']:>9}"
+            f"{result['bytes_uploaded'] / 1e6:>9.1f}"
+            f"{result['rows_per_second'] or 0:>10.0f}"
+            f"{result['mb_per_second'] or 0:>8.1f}"
+            f"{stages['fetch']:>8.2f}{stages['encode']:>8.2f}"
+            f"{stages['upload']:>8.2f}{stages['load']:>7.2f}"
+            f"{rss / 1e6 if rss else 0:>8.0f}"
+        )
+
+    started = datetime.datetime.now()
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench_migration-{started:%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "started_at": started.isoformat(timespec="seconds"),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "arguments": vars(args),
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+        file.write("\n")
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Rows per second per core of the CSV batch encoders on synthetic rows shaped
+# like a typical fact table (see bench_formats.py). Batches are fetched up
+# front, so only the conversion to CSV text is timed, on one thread.
+#
+#   python benchmarks/bench_serialize.py --rows 500000
+#   python benchmarks/bench_serialize.py --encoders csv
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_formats import DESCRIPTION, SyntheticCursor  # noqa: E402
+from migration.formats import arrow_csv_encoder  # noqa: E402
+from migration.streaming import csv_encoder  # noqa: E402
+
+# csv: the csv module, with binary columns converted column-wise
+# arrow: pyarrow's CSV writer over typed column arrays
+ENCODERS = {"csv": csv_encoder, "arrow": arrow_csv_encoder}
+
+
+def run(encoder_name, batches):
+    encode = ENCODERS[encoder_name](DESCRIPTION)
+    if encode is None:
+        raise ImportError("pyarrow is not installed")
+    size = 0
+    started, cpu_started = time.perf_counter(), time.process_time()
+    for rows in batches:
+        size += len(encode(rows))
+    return size, time.perf_counter() - started, time.process_time() - cpu_started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CSV batch encoders")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--encoders", nargs="+", default=list(ENCODERS))
+    args = parser.parse_args()
+
+    cursor = SyntheticCursor(args.rows)
+    batches = []
+    while True:
+        rows = cursor.fetchmany(args.batch_size)
+        if not rows:
+            break
+        batches.append(rows)
+
+    print(f"{'encoder':<10}{'rows':>10}{'MB':>10}{'seconds':>10}{'rows/s/core':>14}")
+    for encoder_name in args.encoders:
+        try:
+            size, elapsed, cpu = run(encoder_name, batches)
+        except ImportError as e:
+            print(f"{encoder_name:<10}skipped ({e})")
+            continue
+        print(
+            f"{encoder_name:<10}{args.rows:>10}{size / 1e6:>10.2f}"
+            f"{elapsed:>10.2f}{args.rows / cpu:>14.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+from collections import namedtuple
+
+from google.api_core import exceptions as api_exceptions
+
+from migration.partition import choose_split_column
+from migration.schema import ColumnInfo
+from migration.selection import DEFAULT_SCHEMA, quote_identifier, target_names
+
+# name is the collision-free name of the table's objects and BigQuery
+# table; source_schema and source_name identify it in SQL Server
+TableInfo = namedtuple(
+    "TableInfo",
+    ["name", "row_count", "size_bytes", "source_schema", "source_name"],
+    defaults=(DEFAULT_SCHEMA, None),
+)
+
+# Where a table comes from in SQL Server and its primary key columns, kept
+# with the run's plan for loads that merge on the key
+TableTarget = namedtuple("TableTarget", ["source_schema", "source_name", "key_columns"])
+
+# Row counts and reserved size of every user table, biggest first
+QUERY_TABLE_SIZES = """
+SELECT SCHEMA_NAME(t.schema_id), t.name, SUM(ps.row_count),
+    SUM(ps.used_page_count) * 8192
+FROM sys.tables AS t
+JOIN sys.dm_db_partition_stats AS ps
+    ON ps.object_id = t.object_id AND ps.index_id IN (0, 1)
+WHERE t.is_ms_shipped = 0
+GROUP BY t.schema_id, t.name
+ORDER BY SUM(ps.used_page_count) DESC, SUM(ps.row_count) DESC
+"""
+
+QUERY_TABLE_NAMES = (
+    "SELECT TABLE_SCHEMA, TABLE_NAME FROM INFORMATION_SCHEMA.TABLES "
+    "WHERE TABLE_TYPE = 'BASE TABLE'"
+)
+
+# Columns of every base table, in table order
+QUERY_COLUMNS = """
+SELECT c.TABLE_SCHEMA, c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE,
+    c.CHARACTER_MAXIMUM_LENGTH, c.NUMERIC_PRECISION, c.NUMERIC_SCALE, c.IS_NULLABLE
+FROM INFORMATION_SCHEMA.COLUMNS AS c
+JOIN INFORMATION_SCHEMA.TABLES AS t
+    ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+WHERE t.TABLE_TYPE = 'BASE TABLE'
+ORDER BY c.TABLE_SCHEMA, c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+# Primary key columns of every table, in key order
+QUERY_PRIMARY_KEYS = """
+SELECT tc.TABLE_SCHEMA, tc.TABLE_NAME, kcu.COLUMN_NAME
+FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS AS tc
+JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE AS kcu
+    ON kcu.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
+    AND kcu.TABLE_SCHEMA = tc.TABLE_SCHEMA
+    AND kcu.TABLE_NAME = tc.TABLE_NAME
+WHERE tc.CONSTRAINT_TYPE = 'PRIMARY KEY'
+ORDER BY tc.TABLE_SCHEMA, tc.TABLE_NAME, kcu.ORDINAL_POSITION
+"""
+
+# Leading key column of the clustered index and of the primary key of every
+# user table, clustered index first
+QUERY_CLUSTERED_KEYS = """
+SELECT OBJECT_SCHEMA_NAME(i.object_id), OBJECT_NAME(i.object_id), c.name, ty.name
+FROM sys.indexes AS i
+JOIN sys.index_columns AS ic
+    ON ic.object_id = i.object_id AND ic.index_id = i.index_id AND ic.key_ordinal = 1
+JOIN sys.columns AS c
+    ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+JOIN sys.types AS ty
+    ON ty.user_type_id = c.system_type_id
+WHERE (i.type = 1 OR i.is_primary_key = 1)
+    AND OBJECTPROPERTY(i.object_id, 'IsUserTable') = 1
+ORDER BY i.object_id, i.type, i.is_primary_key DESC
+"""
+
+# (current version, min valid version) of every table with Change Tracking
+QUERY_CHANGE_TRACKING = """
+SELECT OBJECT_SCHEMA_NAME(t.object_id), OBJECT_NAME(t.object_id),
+    CHANGE_TRACKING_CURRENT_VERSION(), CHANGE_TRACKING_MIN_VALID_VERSION(t.object_id)
+FROM sys.change_tracking_tables AS t
+"""
+
+
+# Bracket-quoted, schema-qualified name of a table for SQL
+def source_identifier(table):
+    return quote_identifier(table.source_schema, table.source_name or table.name)
+
+
+# List the base tables of the database, largest first so that the long
+# exports start early and the small ones fill in the gaps at the end
+def list_tables_by_size(cursor):
+    try:
+        cursor.execute(QUERY_TABLE_SIZES)
+        rows = [
+            (row[0], row[1], int(row[2] or 0), int(row[3] or 0))
+            for row in cursor.fetchall()
+        ]
+    except Exception:
+        # sys.dm_db_partition_stats needs VIEW DATABASE STATE; fall back to
+        # the plain table list in catalog order
+        cursor.execute(QUERY_TABLE_NAMES)
+        rows = [(row[0], row[1], 0, 0) for row in cursor.fetchall()]
+    names = target_names([(row[0], row[1]) for row in rows])
+    return [
+        TableInfo(names[(schema, table)], row_count, size_bytes, schema, table)
+        for schema, table, row_count, size_bytes in rows
+    ]
+
+
+# Run a bulk metadata query and group its rows by their first two columns
+# (schema and table name)
+def _rows_by_table(cursor, query):
+    grouped = {}
+    cursor.execute(query)
+    for row in cursor.fetchall():
+        grouped.setdefault((row[0], row[1]), []).append(tuple(row[2:]))
+    return grouped
+
+
+# What the planners need to know about the source database, read in a few
+# bulk queries up front instead of a round trip per table or shard. Every
+# lookup is by the table's target name (TableInfo.name); columns are
+# already narrowed to the table's projection.
+class SourceCatalog:
+    def __init__(
+        self,
+        tables,
+        columns=None,
+        primary_keys=None,
+        clustered_keys=None,
+        change_tracking=None,
+        predicates=None,
+    ):
+        self.tables = list(tables)
+        self._tables = {table.name: table for table in self.tables}
+        self._columns = columns or {}
+        self._primary_keys = primary_keys or {}
+        self._clustered_keys = clustered_keys or {}
+        self._change_tracking = change_tracking or {}
+        self._predicates = predicates or {}
+
+    def table(self, table_name):
+        return self._tables.get(table_name)
+
+    def source(self, table_name):
+        table = self.table(table_name)
+        if table is None:
+            return quote_identifier(table_name)
+        return source_identifier(table)
+
+    def columns(self, table_name):
+        return self._columns.get(table_name, [])
+
+    # (column, data_type) pairs, lower-case types
+    def column_types(self, table_name):
+        return [(column.name, column.data_type) for column in self.columns(table_name)]
+
+    def primary_key(self, table_name):
+        return self._primary_keys.get(table_name, [])
+
+    # Column to split the table's shards on, see choose_split_column
+    def split_column(self, table_name):
+        return choose_split_column(
+            self._clustered_keys.get(table_name, []), self.column_types(table_name)
+        )
+
+    # (current version, min valid version) when Change Tracking is enabled
+    # on the table, otherwise None
+    def change_tracking_versions(self, table_name):
+        return self._change_tracking.get(table_name)
+
+    # SQL Server predicate the table's rows must satisfy, or None
+    def predicate(self, table_name):
+        return self._predicates.get(table_name)
+
+    # TableTarget of every table in table_names, keyed by table name
+    def targets(self, table_names):
+        targets = {}
+        for table_name in set(table_names):
+            table = self.table(table_name)
+            if table is not None:
+                targets[table_name] = TableTarget(
+                    table.source_schema,
+                    table.source_name or table.name,
+                    self.primary_key(table_name),
+                )
+        return targets
+
+    # Query reading the table's exported columns
+    def select_query(self, table_name):
+        columns = self.columns(table_name)
+        select = (
+            ", ".join(quote_identifier(column.name) for column in columns)
+            if columns
+            else "*"
+        )
+        return f"SELECT {select} FROM {self.source(table_name)}"
+
+    @property
+    def total_rows(self):
+        return sum(table.row_count for table in self.tables)
+
+    @property
+    def total_bytes(self):
+        return sum(table.size_bytes for table in self.tables)
+
+    def summary(self):
+        return (
+            f"{len(self.tables)} tables, about {self.total_rows:,} rows and "
+            f"{self.total_bytes / (1024 * 1024):.1f} MB"
+        )
+
+
+# Read the catalog of the database the cursor is connected to, keeping the
+# tables and columns the TableFilter selects
+def read_catalog(cursor, table_filter=None):
+    tables = list_tables_by_size(cursor)
+    if table_filter is not None:
+        tables = [
+            table
+            for table in tables
+            if table_filter.selects(table.source_schema, table.source_name)
+        ]
+    # Bulk query rows are keyed by (schema, table); planners use the
+    # target name
+    names = {(table.source_schema, table.source_name): table.name for table in tables}
+
+    def by_name(query, convert):
+        return {
+            names[key]: convert(rows)
+            for key, rows in _rows_by_table(cursor, query).items()
+            if key in names
+        }
+
+    columns = by_name(
+        QUERY_COLUMNS,
+        lambda rows: [
+            ColumnInfo(row[0], row[1].lower(), row[2], row[3], row[4], row[5] == "YES")
+            for row in rows
+        ],
+    )
+    primary_keys = by_name(QUERY_PRIMARY_KEYS, lambda rows: [row[0] for row in rows])
+    clustered_keys = by_name(
+        QUERY_CLUSTERED_KEYS, lambda rows: [(row[0], row[1].lower()) for row in rows]
+    )
+    try:
+        change_tracking = by_name(QUERY_CHANGE_TRACKING, lambda rows: tuple(rows[0]))
+    except Exception:
+        # Change Tracking metadata needs VIEW CHANGE TRACKING permission;
+        # without it every table is treated as untracked
+        change_tracking = {}
+
+    predicates = {}
+    if table_filter is not None:
+        for table in tables:
+            schema, source_name = table.source_schema, table.source_name
+            table_columns = columns.get(table.name, [])
+            # Incremental syncs merge on the key and track rowversion columns
+            keep = primary_keys.get(table.name, []) + [
+                column.name
+                for column in table_columns
+                if column.data_type in ("timestamp", "rowversion")
+            ]
+            columns[table.name] = table_filter.project(
+                schema, source_name, table_columns, keep
+            )
+            predicate = table_filter.predicate(schema, source_name)
+            if predicate:
+                predicates[table.name] = predicate
+    return SourceCatalog(
+        tables, columns, primary_keys, clustered_keys, change_tracking, predicates
+    )
+
+
+# Names of the tables already in the target dataset, from one list_tables
+# call. A dataset that does not exist yet has none.
+def list_dataset_tables(bigquery_client, dataset_ref):
+    try:
+        return {table.table_id for table in bigquery_client.list_tables(dataset_ref)}
+    except api_exceptions.NotFound:
+        return set()
@@ -0,0 +1,368 @@
+import argparse
+import os
+import signal
+import sys
+import threading
+
+from migration.engine import MigrationConfig, run_migration
+from migration.export import DEFAULT_EXPORT_WORKERS
+from migration.formats import DEFAULT_FORMAT, FORMATS
+from migration.incremental import DEFAULT_STATE_PATH, SYNC_MODES
+from migration.loading import DEFAULT_MAX_IN_FLIGHT, DEFAULT_WRITE_MODE, WRITE_MODES
+from migration.manifest import DEFAULT_MANIFEST_PATH
+from migration.metrics import DEFAULT_METRICS_PATH, DEFAULT_REPORT_DIR
+from migration.partition import DEFAULT_MAX_SHARDS, DEFAULT_SHARD_ROWS
+from migration.pipeline import DEFAULT_QUEUE_DEPTH
+from migration.schema import (
+    DEFAULT_PARTITION_GRANULARITY,
+    MAX_CLUSTERING_FIELDS,
+    PARTITION_GRANULARITIES,
+)
+from migration.sinks import DEFAULT_DIRECT_MAX_BYTES
+from migration.staging import DEFAULT_STAGING_PREFIX
+from migration.streaming import DEFAULT_BATCH_BYTES, DEFAULT_BATCH_SIZE
+from migration.throttle import (
+    DEFAULT_MAX_WAIT_MS,
+    DEFAULT_MIN_BATCH_SIZE,
+    DEFAULT_MIN_WORKERS,
+)
+from migration.upload import (
+    DEFAULT_UPLOAD_CHUNK_SIZE,
+    DEFAULT_UPLOAD_MODE,
+    DEFAULT_UPLOAD_PARALLELISM,
+    UPLOAD_MODES,
+)
+from migration.validation import (
+    DEFAULT_VALIDATION,
+    DEFAULT_VALIDATION_WORKERS,
+    VALIDATION_LEVELS,
+)
+
+# Exit codes for schedulers: a run left incomplete can simply be retried;
+# a mismatch means a completed run's tables differ from SQL Server
+EXIT_COMPLETED = 0
+EXIT_FAILED = 1
+EXIT_INCOMPLETE = 3
+EXIT_MISMATCH = 4
+
+
+# Parse a PATTERN=VALUE table option
+def table_option(text):
+    pattern, separator, value = text.partition("=")
+    if not separator or not pattern.strip() or not value.strip():
+        raise argparse.ArgumentTypeError(f"expected PATTERN=VALUE, got '{text}'")
+    return pattern.strip(), value.strip()
+
+
+# Rows-per-second caps of --table-max-rows-per-second options
+def table_rates(options):
+    rates = {}
+    for pattern, value in options:
+        try:
+            rates[pattern] = int(value)
+        except ValueError:
+            raise SystemExit(f"Rows per second for '{pattern}' must be a number")
+    return rates
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m migration",
+        description="Export SQL Server tables to GCS and load them into BigQuery.",
+    )
+    source = parser.add_argument_group("SQL Server")
+    source.add_argument("--server", required=True)
+    source.add_argument("--database", required=True)
+    source.add_argument("--username", required=True)
+    source.add_argument(
+        "--password-env",
+        default="SQLSERVER_PASSWORD",
+        help="environment variable holding the password (default: %(default)s)",
+    )
+
+    tables = parser.add_argument_group(
+        "tables",
+        "Patterns are globs matched against the table name, or against "
+        "schema.table when they contain a dot; prefix re: for a regular "
+        "expression on schema.table.",
+    )
+    tables.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="only migrate matching tables (repeatable)",
+    )
+    tables.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="skip matching tables (repeatable)",
+    )
+    tables.add_argument(
+        "--columns",
+        action="append",
+        default=[],
+        type=table_option,
+        metavar="PATTERN=COL1,COL2",
+        help="export only these columns of matching tables; primary key and "
+        "rowversion columns are always kept (repeatable)",
+    )
+    tables.add_argument(
+        "--where",
+        action="append",
+        default=[],
+        type=table_option,
+        metavar="PATTERN=PREDICATE",
+        help="export only rows of matching tables satisfying a SQL Server "
+        "predicate (repeatable)",
+    )
+    tables.add_argument(
+        "--table-write-mode",
+        action="append",
+        default=[],
+        type=table_option,
+        metavar="PATTERN=MODE",
+        help="write mode of matching tables, overriding --write-mode (repeatable)",
+    )
+    tables.add_argument(
+        "--table-max-rows-per-second",
+        action="append",
+        default=[],
+        type=table_option,
+        metavar="PATTERN=ROWS",
+        help="cap the rows per second read from matching tables (repeatable)",
+    )
+
+    target = parser.add_argument_group("Google Cloud")
+    target.add_argument("--project", required=True)
+    target.add_argument("--bucket", required=True)
+    target.add_argument("--dataset", required=True)
+    target.add_argument(
+        "--credentials",
+        default=os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"),
+        help="service account JSON file (default: application default credentials)",
+    )
+
+    tuning = parser.add_argument_group("export")
+    tuning.add_argument("--format", choices=list(FORMATS), default=DEFAULT_FORMAT)
+    tuning.add_argument("--compression")
+    tuning.add_argument("--sync-mode", choices=SYNC_MODES, default="full")
+    tuning.add_argument(
+        "--write-mode",
+        choices=WRITE_MODES,
+        default=DEFAULT_WRITE_MODE,
+        help="what loads do to tables that already exist (default: %(default)s)",
+    )
+    tuning.add_argument("--workers", type=int, default=DEFAULT_EXPORT_WORKERS)
+    tuning.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    tuning.add_argument(
+        "--batch-mb",
+        type=int,
+        default=DEFAULT_BATCH_BYTES // (1024 * 1024),
+        help="data per fetched batch in MiB, for wide and LOB rows; 0 for row "
+        "counts only (default: %(default)s)",
+    )
+    tuning.add_argument("--shard-rows", type=int, default=DEFAULT_SHARD_ROWS)
+    tuning.add_argument("--max-shards", type=int, default=DEFAULT_MAX_SHARDS)
+    tuning.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="scale workers and batch size between the minimums and --workers/"
+        "--batch-size with SQL Server's load",
+    )
+    tuning.add_argument(
+        "--min-workers",
+        type=int,
+        default=DEFAULT_MIN_WORKERS,
+        help="fewest export workers with --adaptive (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--min-batch-size",
+        type=int,
+        default=DEFAULT_MIN_BATCH_SIZE,
+        help="smallest batch with --adaptive (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--max-wait-ms",
+        type=int,
+        default=DEFAULT_MAX_WAIT_MS,
+        help="back off when other sessions' requests wait longer than this on "
+        "average; 0 ignores wait stats (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--max-rows-per-second",
+        type=int,
+        default=0,
+        help="cap the rows per second read by the whole run; 0 for no cap",
+    )
+    tuning.add_argument(
+        "--pipeline-depth",
+        type=int,
+        default=DEFAULT_QUEUE_DEPTH,
+        help="batches buffered between fetch, encode and upload (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--upload-mode", choices=UPLOAD_MODES, default=DEFAULT_UPLOAD_MODE
+    )
+    tuning.add_argument(
+        "--upload-chunk-mb",
+        type=int,
+        default=DEFAULT_UPLOAD_CHUNK_SIZE // (1024 * 1024),
+        help="resumable chunk or composite part size in MiB (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--upload-parallelism",
+        type=int,
+        default=DEFAULT_UPLOAD_PARALLELISM,
+        help="parts of one object uploaded at once in composite mode (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--direct-max-mb",
+        type=int,
+        default=DEFAULT_DIRECT_MAX_BYTES // (1024 * 1024),
+        help="load tables up to this size straight into BigQuery, skipping GCS; "
+        "0 stages every table (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--load-jobs",
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help="BigQuery load jobs run at once (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--validate",
+        choices=VALIDATION_LEVELS,
+        default=DEFAULT_VALIDATION,
+        help="after loading, compare row counts (counts) or also per-column "
+        "aggregates (aggregates) with SQL Server (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--validation-workers",
+        type=int,
+        default=DEFAULT_VALIDATION_WORKERS,
+        help="SQL Server queries run at once while validating (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--partition-by",
+        help="DATE, DATETIME or TIMESTAMP column to partition new tables by",
+    )
+    tuning.add_argument(
+        "--partition-granularity",
+        choices=PARTITION_GRANULARITIES,
+        default=DEFAULT_PARTITION_GRANULARITY,
+        help="time partitioning granularity (default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--cluster-by",
+        default="",
+        help="comma separated columns to cluster new tables by, up to "
+        f"{MAX_CLUSTERING_FIELDS}",
+    )
+    tuning.add_argument(
+        "--staging-prefix",
+        default=DEFAULT_STAGING_PREFIX,
+        help="GCS prefix under which each run stages its objects (default: %(default)s)",
+    )
+    tuning.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH)
+    tuning.add_argument("--state", default=DEFAULT_STATE_PATH)
+    tuning.add_argument(
+        "--metrics-file",
+        default=DEFAULT_METRICS_PATH,
+        help="Prometheus metrics file rewritten after every run; empty to disable "
+        "(default: %(default)s)",
+    )
+    tuning.add_argument(
+        "--report-dir",
+        default=DEFAULT_REPORT_DIR,
+        help="directory for the JSON run reports; empty to disable "
+        "(default: %(default)s)",
+    )
+    return parser
+
+
+def config_from_args(args):
+    password = os.environ.get(args.password_env)
+    if password is None:
+        raise SystemExit(f"Set the SQL Server password in ${args.password_env}")
+    return MigrationConfig(
+        server=args.server,
+        database=args.database,
+        username=args.username,
+        password=password,
+        bucket_name=args.bucket,
+        dataset_name=args.dataset,
+        project_id=args.project,
+        credentials_file=args.credentials,
+        output_format=args.format,
+        compression=args.compression,
+        sync_mode=args.sync_mode,
+        export_workers=args.workers,
+        batch_size=args.batch_size,
+        batch_bytes=args.batch_mb * 1024 * 1024,
+        shard_rows=args.shard_rows,
+        max_shards=args.max_shards,
+        load_jobs=args.load_jobs,
+        pipeline_depth=args.pipeline_depth,
+        upload_mode=args.upload_mode,
+        upload_chunk_size=args.upload_chunk_mb * 1024 * 1024,
+        upload_parallelism=args.upload_parallelism,
+        direct_max_bytes=args.direct_max_mb * 1024 * 1024,
+        partition_by=args.partition_by,
+        partition_granularity=args.partition_granularity,
+        cluster_by=tuple(
+            name.strip() for name in args.cluster_by.split(",") if name.strip()
+        ),
+        include_tables=tuple(args.include),
+        exclude_tables=tuple(args.exclude),
+        table_columns={
+            pattern: tuple(name.strip() for name in names.split(",") if name.strip())
+            for pattern, names in args.columns
+        },
+        table_where=dict(args.where),
+        write_mode=args.write_mode,
+        table_write_modes=dict(args.table_write_mode),
+        adaptive_throttle=args.adaptive,
+        min_export_workers=args.min_workers,
+        min_batch_size=args.min_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_rows_per_second=args.max_rows_per_second,
+        table_max_rows_per_second=table_rates(args.table_max_rows_per_second),
+        validation=args.validate,
+        validation_workers=args.validation_workers,
+        staging_prefix=args.staging_prefix,
+        manifest_path=args.manifest,
+        state_path=args.state,
+        metrics_path=args.metrics_file or None,
+        report_dir=args.report_dir or None,
+    )
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = config_from_args(args)
+
+    # SIGINT/SIGTERM stop the run at the next batch boundary; it can then
+    # be resumed by running the same command again
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print("Stopping after the current batches...", file=sys.stderr)
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    try:
+        result = run_migration(config, should_stop=stop.is_set, log=print)
+    except Exception as e:
+        print(f"An error occurred: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    if not result.completed:
+        return EXIT_INCOMPLETE
+    return EXIT_MISMATCH if result.mismatched_tables else EXIT_COMPLETED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# Connections idle for longer than this are checked with a trivial query
+# before being handed out again, since the server or a firewall may have
+# dropped them in the meantime
+DEFAULT_CHECK_AFTER = 30.0
+
+HEALTH_CHECK_QUERY = "SELECT 1"
+
+
+# Build the ODBC connection string used for every SQL Server connection
+def build_connection_string(sql_server_details):
+    return (
+        f"DRIVER={{SQL Server}};"
+        f"SERVER={sql_server_details['server']};"
+        f"DATABASE={sql_server_details['database']};"
+        f"UID={sql_server_details['username']};"
+        f"PWD={sql_server_details['password']};"
+    )
+
+
+# Open a connection with pyodbc, imported only when a pool first connects so
+# the package loads without the ODBC driver (as with an injected connect)
+def pyodbc_connect(connection_string):
+    import pyodbc
+
+    return pyodbc.connect(connection_string)
+
+
+# Whether a connection still answers a trivial query
+def is_healthy(conn):
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(HEALTH_CHECK_QUERY)
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+# A bounded pool of pyodbc connections. Connections are opened lazily, so a
+# pool sized for many workers costs nothing until the workers need them.
+# Connections idle for more than check_after seconds are health-checked
+# before reuse and replaced when they fail, so a pool can be kept across
+# runs.
+class ConnectionPool:
+    def __init__(
+        self,
+        connection_string,
+        size=4,
+        connect=None,
+        check_after=DEFAULT_CHECK_AFTER,
+    ):
+        self.connection_string = connection_string
+        self.size = size
+        self.check_after = check_after
+        self._connect = connect or pyodbc_connect
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    # An idle connection, or None if it failed its health check and was
+    # discarded
+    def _reuse(self, idle):
+        conn, idle_since = idle
+        if time.monotonic() - idle_since > self.check_after and not is_healthy(conn):
+            self._discard(conn)
+            return None
+        return conn
+
+    def acquire(self):
+        while True:
+            if self._closed:
+                raise RuntimeError("Connection pool is closed")
+            try:
+                conn = self._reuse(self._idle.get_nowait())
+            except queue.Empty:
+                pass
+            else:
+                if conn is not None:
+                    return conn
+                continue
+            with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    try:
+                        return self._connect(self.connection_string)
+                    except Exception:
+                        self._opened -= 1
+                        raise
+            # Every connection is in use; wait for one to be released. The
+            # timeout lets a waiter open a replacement for a discarded one.
+            try:
+                conn = self._reuse(self._idle.get(timeout=0.5))
+            except queue.Empty:
+                continue
+            if conn is not None:
+                return conn
+
+    def release(self, conn, broken=False):
+        if broken or self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+
+    # Borrow a connection for the duration of a with-block. A connection that
+    # raised is assumed to be unusable and is replaced on the next acquire.
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, broken=True)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._opened -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,819 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from google.cloud import bigquery
+
+from migration.catalog import TableTarget, list_dataset_tables, read_catalog
+from migration.connection import ConnectionPool, build_connection_string
+from migration.export import DEFAULT_EXPORT_WORKERS, export_tables, plan_export_units
+from migration.formats import DEFAULT_FORMAT, format_for_blob, get_format
+from migration.incremental import (
+    DEFAULT_STATE_PATH,
+    StateStore,
+    merge_steps,
+    plan_incremental_units,
+    state_scope,
+    sync_steps,
+)
+from migration.loading import (
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_WRITE_MODE,
+    WRITE_DISPOSITIONS,
+    LoadScheduler,
+    check_write_mode,
+    describe_load,
+    load_steps,
+)
+from migration.manifest import DEFAULT_MANIFEST_PATH, JobManifest, run_key_for
+from migration.metrics import DEFAULT_METRICS_PATH, DEFAULT_REPORT_DIR
+from migration.partition import DEFAULT_MAX_SHARDS, DEFAULT_SHARD_ROWS
+from migration.pipeline import DEFAULT_QUEUE_DEPTH
+from migration.progress import DEFAULT_PUBLISH_INTERVAL, ProgressReporter
+from migration.resources import make_clients
+from migration.schema import (
+    DEFAULT_PARTITION_GRANULARITY,
+    TableSchemas,
+    plan_schemas,
+    without_layout,
+)
+from migration.selection import DEFAULT_SCHEMA, TableFilter, setting_for
+from migration.sinks import DEFAULT_DIRECT_MAX_BYTES, BigQuerySink, route_small_tables
+from migration.staging import (
+    DEFAULT_STAGING_PREFIX,
+    group_staged_blobs,
+    run_prefix,
+    source_name_for,
+)
+from migration.streaming import DEFAULT_BATCH_BYTES, DEFAULT_BATCH_SIZE
+from migration.throttle import (
+    DEFAULT_MAX_WAIT_MS,
+    DEFAULT_MIN_BATCH_SIZE,
+    DEFAULT_MIN_WORKERS,
+    ExportThrottle,
+    WaitStatsReader,
+)
+from migration.upload import (
+    DEFAULT_UPLOAD_CHUNK_SIZE,
+    DEFAULT_UPLOAD_MODE,
+    DEFAULT_UPLOAD_PARALLELISM,
+    Uploader,
+)
+from migration.validation import (
+    DEFAULT_VALIDATION,
+    DEFAULT_VALIDATION_WORKERS,
+    REPLACING_STATES,
+    VALIDATION_LEVELS,
+    validate_tables,
+)
+
+
+# Everything a migration needs, so the engine never reads UI widgets
+@dataclass
+class MigrationConfig:
+    server: str
+    database: str
+    username: str
+    password: str
+    bucket_name: str
+    dataset_name: str
+    project_id: str
+    credentials_file: Optional[str] = None
+    output_format: str = DEFAULT_FORMAT
+    compression: Optional[str] = None
+    sync_mode: str = "full"
+    export_workers: int = DEFAULT_EXPORT_WORKERS
+    batch_size: int = DEFAULT_BATCH_SIZE
+    batch_bytes: int = DEFAULT_BATCH_BYTES
+    shard_rows: int = DEFAULT_SHARD_ROWS
+    max_shards: int = DEFAULT_MAX_SHARDS
+    load_jobs: int = DEFAULT_MAX_IN_FLIGHT
+    pipeline_depth: int = DEFAULT_QUEUE_DEPTH
+    upload_mode: str = DEFAULT_UPLOAD_MODE
+    upload_chunk_size: int = DEFAULT_UPLOAD_CHUNK_SIZE
+    upload_parallelism: int = DEFAULT_UPLOAD_PARALLELISM
+    direct_max_bytes: int = DEFAULT_DIRECT_MAX_BYTES
+    partition_by: Optional[str] = None
+    partition_granularity: str = DEFAULT_PARTITION_GRANULARITY
+    cluster_by: Tuple[str, ...] = ()
+    include_tables: Tuple[str, ...] = ()
+    exclude_tables: Tuple[str, ...] = ()
+    table_columns: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+    table_where: Dict[str, str] = field(default_factory=dict)
+    write_mode: str = DEFAULT_WRITE_MODE
+    table_write_modes: Dict[str, str] = field(default_factory=dict)
+    adaptive_throttle: bool = False
+    min_export_workers: int = DEFAULT_MIN_WORKERS
+    min_batch_size: int = DEFAULT_MIN_BATCH_SIZE
+    max_wait_ms: int = DEFAULT_MAX_WAIT_MS
+    max_rows_per_second: int = 0
+    table_max_rows_per_second: Dict[str, int] = field(default_factory=dict)
+    validation: str = DEFAULT_VALIDATION
+    validation_workers: int = DEFAULT_VALIDATION_WORKERS
+    staging_prefix: str = DEFAULT_STAGING_PREFIX
+    manifest_path: str = DEFAULT_MANIFEST_PATH
+    state_path: str = DEFAULT_STATE_PATH
+    metrics_path: Optional[str] = DEFAULT_METRICS_PATH
+    report_dir: Optional[str] = DEFAULT_REPORT_DIR
+
+    @property
+    def table_filter(self):
+        return TableFilter(
+            self.include_tables,
+            self.exclude_tables,
+            self.table_columns,
+            self.table_where,
+        )
+
+    # Write mode of a table (a TableTarget): the mode of the first matching
+    # pattern in table_write_modes, otherwise write_mode
+    def write_mode_for(self, target):
+        write_mode = setting_for(
+            self.table_write_modes,
+            target.source_schema,
+            target.source_name,
+            self.write_mode,
+        )
+        check_write_mode(write_mode)
+        return write_mode
+
+    # Rows-per-second cap of a table (a TableTarget): the cap of the first
+    # matching pattern in table_max_rows_per_second, 0 for none
+    def max_rows_per_second_for(self, target):
+        return setting_for(
+            self.table_max_rows_per_second,
+            target.source_schema,
+            target.source_name,
+            0,
+        )
+
+    # Settings that change what a run exports, so runs with different table
+    # selections never resume each other. Empty without a selection, which
+    # keeps the run key of unfiltered runs unchanged.
+    @property
+    def selection_key(self):
+        if not (
+            self.include_tables
+            or self.exclude_tables
+            or self.table_columns
+            or self.table_where
+        ):
+            return ()
+        return (
+            self.include_tables,
+            self.exclude_tables,
+            sorted(self.table_columns.items()),
+            sorted(self.table_where.items()),
+        )
+
+    @property
+    def sql_server_details(self):
+        return {
+            "server": self.server,
+            "database": self.database,
+            "username": self.username,
+            "password": self.password,
+        }
+
+
+# mismatched_tables are the tables whose validation found differences
+RunResult = namedtuple(
+    "RunResult",
+    ["run_id", "rows_written", "completed", "stopped", "mismatched_tables"],
+    defaults=((),),
+)
+
+
+# Explicit schemas saved with the run's plan, with the configured
+# partitioning and clustering
+def table_schemas(config, manifest):
+    return TableSchemas(
+        manifest.load_schemas(),
+        config.partition_by,
+        config.partition_granularity,
+        config.cluster_by,
+    )
+
+
+def open_state_store(config):
+    return StateStore(
+        config.state_path,
+        scope=state_scope(
+            config.server, config.database, config.project_id, config.dataset_name
+        ),
+    )
+
+
+# Export SQL Server data to GCS under the run's own prefix, resuming the
+# manifest's open run when it already has a plan. With a BigQuery client,
+# tables routed to the direct path are loaded straight into BigQuery
+# instead. SQL Server connections come from pool when given. With
+# config.adaptive_throttle the number of workers querying SQL Server and
+# their batch size follow its load (see ExportThrottle). Returns an
+# ExportSummary.
+def export_to_gcs(
+    config,
+    manifest,
+    storage_client,
+    should_stop=None,
+    log=print,
+    progress=None,
+    bigquery_client=None,
+    pool=None,
+):
+    output_format = get_format(config.output_format, config.compression)
+    progress = progress or ProgressReporter()
+
+    # One SQL Server connection per export worker, from the given pool
+    # (left open for later runs) or from a pool of this export's own
+    own_pool = pool is None
+    if own_pool:
+        pool = ConnectionPool(
+            build_connection_string(config.sql_server_details),
+            size=config.export_workers,
+        )
+    # This run's objects go under their own prefix
+    prefix = run_prefix(config.staging_prefix, manifest.run_id)
+    throttle = wait_stats = None
+    try:
+        units = manifest.load_plan()
+        if units is not None:
+            log(f"Resuming migration run {manifest.run_id}")
+        else:
+            # Read sizes, columns and keys of all tables in a few bulk
+            # queries, then split the big tables into key ranges that are
+            # exported side by side, largest first
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                catalog = read_catalog(cursor, config.table_filter)
+                log(f"Source database: {catalog.summary()}")
+                progress.metrics.source_sizes(catalog.tables)
+                targets = catalog.targets(table.name for table in catalog.tables)
+                if config.sync_mode == "incremental":
+                    # Only rows changed since each table's last committed
+                    # watermark, and in full for tables missing from BigQuery
+                    state_store = open_state_store(config)
+                    existing_tables = None
+                    if bigquery_client is not None:
+                        existing_tables = list_dataset_tables(
+                            bigquery_client,
+                            bigquery_client.dataset(config.dataset_name),
+                        )
+                    units = plan_incremental_units(
+                        cursor,
+                        catalog,
+                        state_store,
+                        extension=output_format.extension,
+                        prefix=prefix,
+                        existing_tables=existing_tables,
+                        shard_rows=config.shard_rows,
+                        max_shards=config.max_shards,
+                    )
+                    # Watermarks stay pending until the load has been applied
+                    state_store.save()
+                else:
+                    units = plan_export_units(
+                        cursor,
+                        catalog,
+                        shard_rows=config.shard_rows,
+                        max_shards=config.max_shards,
+                        extension=output_format.extension,
+                        prefix=prefix,
+                    )
+                    if config.direct_max_bytes > 0:
+                        # Small tables skip GCS and load straight into
+                        # BigQuery, except those merged into an existing table
+                        units = route_small_tables(
+                            units,
+                            [
+                                table
+                                for table in catalog.tables
+                                if config.write_mode_for(targets[table.name]) != "merge"
+                            ],
+                            config.direct_max_bytes,
+                        )
+                cursor.close()
+            # Column types from the catalog, one schema per table
+            schemas = plan_schemas(catalog, [unit.table_name for unit in units])
+            manifest.save_plan(units)
+            manifest.save_schemas(schemas)
+            manifest.save_targets(targets)
+
+        direct_sink = None
+        if bigquery_client is not None and any(
+            unit.sink == "bigquery" for unit in units
+        ):
+            direct_sink = BigQuerySink(
+                bigquery_client,
+                config.dataset_name,
+                schemas=table_schemas(config, manifest),
+                existing_tables=list_dataset_tables(
+                    bigquery_client, bigquery_client.dataset(config.dataset_name)
+                ),
+                write_modes={
+                    table_name: config.write_mode_for(target)
+                    for table_name, target in manifest.load_targets().items()
+                },
+                on_retry=lambda unit, error: progress.retried("direct_load"),
+            )
+
+        # Wait stats are read on a connection of their own
+        if config.adaptive_throttle and config.max_wait_ms:
+            pool.size = max(pool.size, config.export_workers + 1)
+            wait_stats = WaitStatsReader(pool, log)
+        throttle = ExportThrottle(
+            config.export_workers,
+            config.batch_size,
+            adaptive=config.adaptive_throttle,
+            min_workers=config.min_export_workers,
+            min_batch_size=config.min_batch_size,
+            max_rows_per_second=config.max_rows_per_second,
+            table_rows_per_second={
+                table_name: config.max_rows_per_second_for(target)
+                for table_name, target in manifest.load_targets().items()
+            },
+            wait_stats=wait_stats,
+            max_wait_ms=config.max_wait_ms,
+            log=log,
+        )
+
+        # Export the tables and shards concurrently, each to its own blob
+        return export_tables(
+            pool,
+            storage_client.bucket(config.bucket_name),
+            units,
+            output_format=output_format,
+            max_workers=config.export_workers,
+            batch_size=config.batch_size,
+            should_stop=should_stop,
+            log=log,
+            manifest=manifest,
+            progress=progress,
+            queue_depth=config.pipeline_depth,
+            uploader=Uploader(
+                config.upload_mode,
+                config.upload_chunk_size,
+                config.upload_parallelism,
+            ),
+            direct_sink=direct_sink,
+            prefix=prefix,
+            throttle=throttle,
+            batch_bytes=config.batch_bytes,
+        )
+    finally:
+        if throttle is not None:
+            throttle.stop()
+        if wait_stats is not None:
+            wait_stats.close()
+        # Close every pooled connection
+        if own_pool:
+            pool.close()
+
+
+# Load the staged objects into BigQuery, one load job per table, with up to
+# config.load_jobs jobs running at once. A table that already exists is
+# skipped, replaced, appended to or merged into on its primary key according
+# to its write mode; tables without a primary key are replaced instead of
+# merged. With a manifest, exactly the objects the run's export recorded
+# are loaded (the bucket is not listed), tables still missing objects are
+# held back, tables loaded earlier in the run are not loaded again, and
+# tables load with the schemas and keys saved with the plan. Without one,
+# the objects under the prefix of run_id are listed instead; other runs'
+# objects are never loaded, so run_id is then required. Once should_stop
+# returns True no more loads are started.
+def transfer_to_bigquery(
+    config,
+    bigquery_client,
+    storage_client,
+    manifest=None,
+    log=print,
+    progress=None,
+    should_stop=None,
+    run_id=None,
+):
+    progress = progress or ProgressReporter()
+    schemas = (
+        table_schemas(config, manifest) if manifest is not None else TableSchemas()
+    )
+    targets = {}
+    if manifest is not None:
+        # Exactly the objects this run's export wrote
+        staged_tables = manifest.staged_objects()
+        targets = manifest.load_targets()
+    else:
+        # Without a manifest, fall back to listing the run's own prefix
+        if not run_id:
+            raise ValueError(
+                "Loading without a manifest needs the run ID whose objects to load"
+            )
+        prefix = run_prefix(config.staging_prefix, run_id)
+        bucket = storage_client.bucket(config.bucket_name)
+        staged_tables = group_staged_blobs(
+            (blob.name for blob in bucket.list_blobs(prefix=prefix)), prefix
+        )
+
+    state_store = None
+    if config.sync_mode == "incremental":
+        state_store = open_state_store(config)
+
+    dataset_ref = bigquery_client.dataset(config.dataset_name)
+    # Existing tables come from one listing rather than a lookup per table
+    existing_tables = list_dataset_tables(bigquery_client, dataset_ref)
+    progress.loads_planned(len(staged_tables))
+    scheduler = LoadScheduler(
+        max_in_flight=config.load_jobs,
+        on_start=lambda table_name, source_name: progress.load_state(
+            table_name, source_name, "loading"
+        ),
+        on_retry=lambda table_name, source_name, error: progress.retried("load"),
+    )
+    syncs = set()
+
+    # One load job per table, listing every object of the table
+    for table_name, blob_names in staged_tables.items():
+        table_ref = dataset_ref.table(table_name)
+        source_name = source_name_for(blob_names)
+        uri = [f"gs://{config.bucket_name}/{blob_name}" for blob_name in blob_names]
+
+        # Only load tables whose every object is in GCS, and only once per run
+        if manifest is not None:
+            status = manifest.table_status(table_name)
+            if status == "pending":
+                log(f"Table {table_name} is not fully exported yet. Skipping load")
+                progress.load_state(table_name, source_name, "held")
+                continue
+            if status == "exported" and manifest.is_loaded(table_name):
+                progress.load_state(table_name, source_name, "skipped")
+                continue
+
+        # Incremental syncs replace or merge into the table instead of skipping it
+        pending = state_store.pending(table_name) if state_store else None
+        if (
+            pending is not None
+            and not pending.get("full")
+            and table_name not in existing_tables
+        ):
+            # The changes alone would replace the table's other rows
+            log(
+                f"Table {table_name} is missing from BigQuery, so its changes "
+                "were not applied. The next run exports it in full"
+            )
+            state_store.forget(table_name)
+            if manifest is not None:
+                manifest.record_load(table_name, source_name, "skipped")
+            progress.load_state(table_name, source_name, "skipped")
+            continue
+        if pending is not None:
+            syncs.add(table_name)
+            scheduler.submit(
+                table_name,
+                source_name,
+                sync_steps(
+                    bigquery_client,
+                    table_ref,
+                    uri,
+                    schemas.load_options(
+                        table_name, format_for_blob(source_name).load_job_options()
+                    ),
+                    pending,
+                    exists=table_name in existing_tables,
+                ),
+            )
+            continue
+
+        table_target = targets.get(table_name) or TableTarget(
+            DEFAULT_SCHEMA, table_name, []
+        )
+        write_mode = config.write_mode_for(table_target)
+        exists = table_name in existing_tables
+        if exists and write_mode == "skip":
+            log(f"Table {table_name} already exists. Skipping load for {source_name}")
+            if manifest is not None:
+                manifest.record_load(table_name, source_name, "skipped")
+            progress.load_state(table_name, source_name, "skipped")
+            continue
+
+        # Source format and options follow the staged object type
+        load_options = schemas.load_options(
+            table_name, format_for_blob(source_name).load_job_options()
+        )
+        if exists and write_mode == "merge":
+            if table_target.key_columns:
+                scheduler.submit(
+                    table_name,
+                    source_name,
+                    merge_steps(
+                        bigquery_client,
+                        table_ref,
+                        uri,
+                        load_options,
+                        table_target.key_columns,
+                        staging_suffix="__stage",
+                    ),
+                )
+                continue
+            log(f"Table {table_name} has no primary key. Replacing it instead")
+            write_mode = "truncate"
+
+        state = "loaded"
+        if exists:
+            # Partitioning and clustering only apply when the load creates
+            # the table
+            load_options = without_layout(load_options)
+            state = "appended" if write_mode == "append" else "replaced"
+        # WRITE_TRUNCATE replaces the table's contents in the same job, so
+        # readers see either the old rows or the new ones
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=WRITE_DISPOSITIONS.get(write_mode, "WRITE_TRUNCATE"),
+            **load_options,
+        )
+        scheduler.submit(
+            table_name,
+            source_name,
+            load_steps(bigquery_client, uri, table_ref, job_config, state),
+        )
+
+    # Run the load jobs side by side and record each table as it finishes
+    for outcome in scheduler.run(should_stop):
+        table_name, source_name = outcome.table_name, outcome.source_name
+        if outcome.error is not None:
+            if table_name in syncs:
+                log(f"Error syncing {source_name}: {outcome.error}")
+            else:
+                log(f"Error loading data from {source_name}: {outcome.error}")
+            progress.load_state(table_name, source_name, "failed")
+            continue
+        if table_name in syncs:
+            state_store.commit(table_name)
+            log(
+                f"Changes from {source_name} have been {outcome.state} into {table_name}"
+            )
+        else:
+            log(describe_load(outcome.state, source_name, table_name))
+        if manifest is not None:
+            manifest.record_load(table_name, source_name, outcome.state, outcome.job_id)
+        progress.load_state(table_name, source_name, outcome.state)
+
+
+# Compare the tables this run replaced in BigQuery (see REPLACING_STATES)
+# with what their units read from SQL Server, at config.validation's level,
+# and log every difference. Returns the names of the tables that differ.
+def validate_load(
+    config, bigquery_client, manifest, pool, log=print, progress=None, should_stop=None
+):
+    if config.validation not in VALIDATION_LEVELS:
+        raise ValueError(
+            f"Unknown validation level '{config.validation}'. "
+            f"Choose one of: {', '.join(VALIDATION_LEVELS)}"
+        )
+    progress = progress or ProgressReporter()
+    states = manifest.load_states()
+    tables = {}
+    for unit in manifest.load_plan() or []:
+        if states.get(unit.table_name) in REPLACING_STATES:
+            tables.setdefault(unit.table_name, []).append(unit)
+    if not tables:
+        return []
+
+    columns = {}
+    if config.validation == "aggregates":
+        # Column types pick the aggregates compared
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            catalog = read_catalog(cursor, config.table_filter)
+            cursor.close()
+        columns = {table_name: catalog.columns(table_name) for table_name in tables}
+
+    log(f"Validating {len(tables)} tables against SQL Server ({config.validation})")
+    mismatched = []
+    matched = errors = skipped = 0
+    for check in validate_tables(
+        pool,
+        bigquery_client,
+        bigquery_client.dataset(config.dataset_name),
+        tables,
+        columns,
+        manifest.exported_rows(),
+        config.validation,
+        config.validation_workers,
+        should_stop,
+    ):
+        progress.metrics.validated(check)
+        if check.status == "skipped":
+            skipped += 1
+            continue
+        if check.status == "error":
+            errors += 1
+            log(f"Could not validate table {check.table_name}: {check.error}")
+            continue
+        if check.status == "match":
+            matched += 1
+            log(
+                f"Table {check.table_name} matches SQL Server ({check.target_rows} rows)"
+            )
+            continue
+        mismatched.append(check.table_name)
+        log(
+            f"Table {check.table_name} does not match SQL Server: "
+            f"{check.source_rows} rows in SQL Server, {check.exported_rows} "
+            f"exported, {check.target_rows} in BigQuery"
+        )
+        for mismatch in check.mismatches:
+            log(
+                f"  {mismatch.check}: {mismatch.source} in SQL Server, "
+                f"{mismatch.target} in BigQuery"
+            )
+    log(
+        f"Validation: {matched} tables match, {len(mismatched)} differ, "
+        f"{errors} could not be compared"
+    )
+    if skipped:
+        log(f"Validation stopped before {skipped} tables were compared")
+    return mismatched
+
+
+# Run a whole migration: export to GCS, then load into BigQuery. A run that
+# is stopped or left incomplete is resumed by the next call with the same
+# configuration. Progress goes to the given ProgressReporter, and its
+# metrics are written to config.metrics_path and a JSON report in
+# config.report_dir when the run ends. With a ResourceCache, clients and
+# SQL Server connections come from it and stay open for later runs. With
+# config.validation set, the loaded tables are then checked against SQL
+# Server (see validate_load). Returns a RunResult.
+def run_migration(config, should_stop=None, log=print, progress=None, resources=None):
+    should_stop = should_stop or (lambda: False)
+    progress = progress or ProgressReporter()
+    manifest = JobManifest(config.manifest_path)
+    pool = lease = result = None
+    try:
+        if resources is not None:
+            # Clients and connections kept from earlier runs, lent to this
+            # run until it ends
+            lease = resources.acquire(config)
+            storage_client, bigquery_client, pool = lease
+        else:
+            storage_client, bigquery_client = make_clients(config)
+
+        # Resume the unfinished run with these settings, if there is one
+        manifest.open_run(
+            run_key_for(
+                config.sql_server_details,
+                config.bucket_name,
+                config.project_id,
+                config.dataset_name,
+                config.output_format,
+                config.compression,
+                config.sync_mode,
+                *config.selection_key,
+            )
+        )
+        started = time.perf_counter()
+        summary = export_to_gcs(
+            config,
+            manifest,
+            storage_client,
+            should_stop,
+            log,
+            progress,
+            bigquery_client,
+            pool,
+        )
+        for stage, seconds in (summary.stage_seconds or {}).items():
+            progress.metrics.add_stage_seconds(stage, seconds)
+        progress.metrics.add_stage_seconds("export", time.perf_counter() - started)
+        log(f"Total rows exported: {summary.rows_written}")
+        if should_stop():
+            log("Transfer stopped by user. Run the migration again to resume it.")
+            result = RunResult(manifest.run_id, summary.rows_written, False, True)
+            return result
+
+        # Transfer data from GCS to BigQuery
+        started = time.perf_counter()
+        transfer_to_bigquery(
+            config,
+            bigquery_client,
+            storage_client,
+            manifest,
+            log,
+            progress,
+            should_stop,
+        )
+        progress.metrics.add_stage_seconds("load", time.perf_counter() - started)
+
+        mismatched = ()
+        if config.validation != "none" and not should_stop():
+            started = time.perf_counter()
+            validation_pool = pool or ConnectionPool(
+                build_connection_string(config.sql_server_details),
+                size=config.validation_workers,
+            )
+            try:
+                mismatched = validate_load(
+                    config,
+                    bigquery_client,
+                    manifest,
+                    validation_pool,
+                    log,
+                    progress,
+                    should_stop,
+                )
+            finally:
+                if pool is None:
+                    validation_pool.close()
+            progress.metrics.add_stage_seconds(
+                "validate", time.perf_counter() - started
+            )
+
+        completed = manifest.is_complete()
+        # A stopped validation leaves the run open, so the next run checks
+        # the tables again
+        if should_stop() and (not completed or config.validation != "none"):
+            log("Transfer stopped by user. Run the migration again to resume it.")
+            result = RunResult(manifest.run_id, summary.rows_written, False, True)
+            return result
+        if completed:
+            manifest.finish_run()
+            log(f"Migration run {manifest.run_id} completed.")
+        else:
+            log("Some tables did not finish. Run the migration again to resume it.")
+        result = RunResult(
+            manifest.run_id, summary.rows_written, completed, False, tuple(mismatched)
+        )
+        return result
+    finally:
+        if manifest.run_id is not None:
+            write_run_report(config, progress.metrics, manifest.run_id, result, log)
+        manifest.close()
+        if lease is not None:
+            resources.release(lease)
+
+
+# Write a run's metrics file and JSON report. Failing to write them is
+# logged; it never fails the run.
+def write_run_report(config, metrics, run_id, result, log=print):
+    try:
+        report_path = metrics.write(
+            run_id, result, config.metrics_path, config.report_dir
+        )
+    except OSError as e:
+        log(f"Could not write the run report: {e}")
+        return
+    if report_path is not None:
+        log(f"Run report saved to {report_path}")
+
+
+# Runs a migration on a background thread so a UI thread stays responsive.
+# Messages and progress arrive as ProgressEvents on the events queue, ending
+# with a "finished" event; the UI drains it with drain_events. The run stops
+# at the next batch boundary after stop() or once should_stop returns True.
+# resources is an optional ResourceCache shared with other runs.
+class MigrationWorker:
+    def __init__(
+        self,
+        config,
+        should_stop=None,
+        interval=DEFAULT_PUBLISH_INTERVAL,
+        resources=None,
+    ):
+        self.config = config
+        self.resources = resources
+        self.events = queue.Queue()
+        self.progress = ProgressReporter(self.events, interval)
+        self._should_stop = should_stop
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="migration-worker", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stopping(self):
+        if self._stop.is_set():
+            return True
+        return self._should_stop is not None and self._should_stop()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        outcome = None
+        try:
+            outcome = run_migration(
+                self.config,
+                should_stop=self.stopping,
+                log=self.progress.message,
+                progress=self.progress,
+                resources=self.resources,
+            )
+        except Exception as e:
+            self.progress.message(f"An error occurred: {str(e)}")
+            outcome = e
+        finally:
+            self.progress.finished(outcome)
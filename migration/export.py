@@ -0,0 +1,327 @@
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from migration.formats import CsvFormat
+from migration.loading import describe_load
+from migration.partition import (
+    DEFAULT_MAX_SHARDS,
+    DEFAULT_SHARD_ROWS,
+    WHOLE_TABLE,
+    plan_shards,
+    restrict_shard,
+    shard_count_for,
+)
+from migration.pipeline import DEFAULT_QUEUE_DEPTH, StageTimings, run_pipeline
+from migration.progress import ProgressReporter
+from migration.selection import quote_identifier
+from migration.sinks import GcsSink
+from migration.staging import blob_name_for, clear_staged_table, parse_staged_name
+from migration.streaming import DEFAULT_BATCH_BYTES, DEFAULT_BATCH_SIZE
+from migration.throttle import ExportThrottle
+
+DEFAULT_EXPORT_WORKERS = 4
+
+# Outcome of export_tables: rows written, the tables that did not finish
+# (failed, cancelled or stopped part way) and the busy seconds of each
+# pipeline stage, summed over the workers
+ExportSummary = namedtuple(
+    "ExportSummary",
+    ["rows_written", "incomplete_tables", "stage_seconds"],
+    defaults=(None,),
+)
+
+# One blob worth of work: a whole table or one key range of it. table_name
+# names the objects and the BigQuery table; query reads the unit's columns
+# from the schema-qualified source table ("SELECT * FROM [<table_name>]"
+# when unset); sink is "gcs" for a staged object or "bigquery" to load the
+# table directly.
+ExportUnit = namedtuple(
+    "ExportUnit",
+    ["table_name", "blob_name", "shard", "estimated_rows", "query", "sink"],
+    defaults=(None, "gcs"),
+)
+
+
+# Split the catalog's tables (or the given subset of them) into export
+# units. Tables above shard_rows rows are cut into key ranges, each
+# exported to its own shard object. Units come back largest first so the
+# longest running ones are scheduled early.
+def plan_export_units(
+    cursor,
+    catalog,
+    tables=None,
+    shard_rows=DEFAULT_SHARD_ROWS,
+    max_shards=DEFAULT_MAX_SHARDS,
+    extension="csv",
+    prefix="",
+):
+    units = []
+    for table in catalog.tables if tables is None else tables:
+        shard_count = shard_count_for(table.row_count, shard_rows, max_shards)
+        predicate = catalog.predicate(table.name)
+        shards = plan_shards(
+            cursor,
+            catalog.source(table.name),
+            shard_count,
+            catalog.split_column(table.name),
+            predicate,
+        )
+        query = catalog.select_query(table.name)
+        if len(shards) == 1:
+            units.append(
+                ExportUnit(
+                    table.name,
+                    blob_name_for(table.name, extension=extension, prefix=prefix),
+                    restrict_shard(WHOLE_TABLE, predicate),
+                    table.row_count,
+                    query,
+                )
+            )
+            continue
+        for shard_number, shard in enumerate(shards, start=1):
+            units.append(
+                ExportUnit(
+                    table.name,
+                    blob_name_for(table.name, shard_number, extension, prefix),
+                    restrict_shard(shard, predicate),
+                    table.row_count // len(shards),
+                    query,
+                )
+            )
+    units.sort(key=lambda unit: unit.estimated_rows, reverse=True)
+    return units
+
+
+# Query selecting the unit's rows from its table, taking the shard's
+# parameters
+def unit_query(unit):
+    query = unit.query
+    if query is None:
+        query = f"SELECT * FROM {quote_identifier(unit.table_name)}"
+    if unit.shard.where:
+        query += f" WHERE ({unit.shard.where})"
+    return query
+
+
+# Export one unit into the given sink over the given connection. Fetching,
+# encoding and uploading run as a pipeline (see run_pipeline), adding their
+# busy time to timings. on_batch is called with the size of every batch
+# written. Batches hold up to batch_size rows and about batch_bytes of data.
+# pacer (a FetchPacer) paces the fetches and times the query. on_fetch is
+# called with the estimated bytes of every batch fetched.
+# Returns the sink's UnitResult, or None when the stop flag cut the export
+# short (the sink's output is then left for the caller to discard).
+def export_unit(
+    conn,
+    sink,
+    unit,
+    output_format=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+    should_stop=None,
+    on_batch=None,
+    timings=None,
+    queue_depth=DEFAULT_QUEUE_DEPTH,
+    pacer=None,
+    batch_bytes=DEFAULT_BATCH_BYTES,
+    on_fetch=None,
+):
+    output_format = output_format or CsvFormat()
+    cursor = conn.cursor()
+    try:
+        started = time.perf_counter()
+        cursor.execute(unit_query(unit), *unit.shard.params)
+        if pacer is not None:
+            pacer.fetched(0, time.perf_counter() - started)
+
+        def encode(source, sink):
+            return output_format.write(
+                source,
+                sink,
+                batch_size=batch_size,
+                should_stop=should_stop,
+                on_batch=on_batch,
+            )
+
+        # Stream data to the sink in fetchmany batches while the next ones
+        # are being fetched
+        with sink.open(unit, output_format) as file:
+            rows_written = run_pipeline(
+                cursor,
+                file,
+                encode,
+                batch_size=batch_size,
+                timings=timings,
+                queue_depth=queue_depth,
+                pacer=pacer,
+                batch_bytes=batch_bytes,
+                on_fetch=on_fetch,
+            )
+        if should_stop is not None and should_stop():
+            return None
+        return sink.commit(unit, output_format, file, rows_written)
+    finally:
+        cursor.close()
+
+
+# Export many units concurrently. Every worker borrows its own connection
+# from the pool and writes its own blob; units are submitted in the order
+# given, so pass them largest first. Units routed to "bigquery" go to
+# direct_sink (a BigQuerySink) when one is given, and are staged otherwise.
+# Messages are only logged from the calling thread. With a manifest, units
+# it already records as exported are skipped and every outcome is
+# checkpointed as it happens. Objects cut short by an error or the stop flag
+# are deleted rather than left behind half written. prefix is the staging
+# prefix the units were planned under. Progress goes to the given
+# ProgressReporter. A throttle (ExportThrottle) limits how many workers
+# query SQL Server at once and paces their fetches; without one, all
+# max_workers run flat out. Returns an ExportSummary.
+def export_tables(
+    pool,
+    bucket,
+    units,
+    output_format=None,
+    max_workers=DEFAULT_EXPORT_WORKERS,
+    batch_size=DEFAULT_BATCH_SIZE,
+    should_stop=None,
+    log=print,
+    manifest=None,
+    progress=None,
+    queue_depth=DEFAULT_QUEUE_DEPTH,
+    uploader=None,
+    direct_sink=None,
+    prefix="",
+    throttle=None,
+    batch_bytes=DEFAULT_BATCH_BYTES,
+):
+    should_stop = should_stop or (lambda: False)
+    progress = progress or ProgressReporter()
+    throttle = throttle or ExportThrottle(max_workers, batch_size)
+    timings = StageTimings()
+    gcs_sink = GcsSink(bucket, uploader)
+
+    def sink_for(unit):
+        if unit.sink == "bigquery" and direct_sink is not None:
+            return direct_sink
+        return gcs_sink
+
+    if manifest is not None:
+        remaining = [unit for unit in units if not manifest.is_exported(unit.blob_name)]
+        if len(remaining) < len(units):
+            log(f"Skipping {len(units) - len(remaining)} objects already exported")
+        resumed_tables = manifest.exported_tables()
+        units = remaining
+    else:
+        resumed_tables = set()
+
+    # Shards of an earlier, differently split export under the same prefix
+    # must not be picked up by a listing (shards of a resumed run are kept)
+    sharded_tables = set()
+    for unit in units:
+        parsed = parse_staged_name(unit.blob_name, prefix)
+        if parsed is not None and parsed[2]:
+            sharded_tables.add(unit.table_name)
+    for table_name in sorted(sharded_tables - resumed_tables):
+        clear_staged_table(bucket, table_name, prefix)
+
+    def run(unit):
+        with throttle.slot(should_stop):
+            if should_stop():
+                return None
+            progress.unit_started(unit)
+            sink = sink_for(unit)
+            try:
+                with pool.connection() as conn:
+                    result = export_unit(
+                        conn,
+                        sink,
+                        unit,
+                        output_format=output_format,
+                        batch_size=batch_size,
+                        should_stop=should_stop,
+                        on_batch=lambda count: progress.rows_written(unit, count),
+                        timings=timings,
+                        queue_depth=queue_depth,
+                        pacer=throttle.pacer(unit.table_name, should_stop),
+                        batch_bytes=batch_bytes,
+                        on_fetch=lambda size: progress.bytes_fetched(unit, size),
+                    )
+            except Exception:
+                sink.discard(unit)
+                raise
+        if result is None:
+            # Stopped part way: the object may be truncated
+            sink.discard(unit)
+            return None
+        progress.unit_uploaded(unit, result.size_bytes, result.rows_written)
+        return result
+
+    total_rows_transferred = 0
+    incomplete_tables = set()
+    throttle.start()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(run, unit): unit for unit in units}
+        log(f"Exporting {len(pending)} objects with {max_workers} workers")
+        progress.export_planned(
+            len(pending), sum(unit.estimated_rows for unit in pending.values())
+        )
+
+        while pending:
+            done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            if should_stop():
+                # Units not yet started are dropped; running ones stop at
+                # their next batch boundary
+                for future, unit in pending.items():
+                    future.cancel()
+                    incomplete_tables.add(unit.table_name)
+            for future in done:
+                unit = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log(f"Error exporting {unit.blob_name} from {unit.table_name}: {e}")
+                    incomplete_tables.add(unit.table_name)
+                    if manifest is not None:
+                        manifest.record_failure(unit.blob_name, e)
+                    continue
+                if result is None:
+                    incomplete_tables.add(unit.table_name)
+                    continue
+                if manifest is not None:
+                    manifest.record_export(
+                        unit.blob_name,
+                        result.rows_written,
+                        result.size_bytes,
+                        result.generation,
+                    )
+                    if result.load_state is not None:
+                        manifest.record_load(
+                            unit.table_name, "direct", result.load_state, result.job_id
+                        )
+                if result.load_state is not None:
+                    # Not a load_state event: the load stage does not count
+                    # direct loads
+                    progress.metrics.load_state(
+                        unit.table_name, result.load_state, True
+                    )
+                total_rows_transferred += result.rows_written
+                location = sink_for(unit).location(unit)
+                if result.load_state == "skipped":
+                    log(f"Table {unit.table_name} already exists. Skipping direct load")
+                elif result.load_state is not None:
+                    message = describe_load(
+                        result.load_state, f"table '{unit.table_name}'", location
+                    )
+                    log(f"{message} ({result.rows_written} rows)")
+                else:
+                    log(
+                        f"Data from table '{unit.table_name}' has been uploaded to "
+                        f"{location} ({result.rows_written} rows)"
+                    )
+            for future in [f for f in pending if f.cancelled()]:
+                pending.pop(future)
+    throttle.stop()
+    log(f"Export stage busy time: {timings.summary()}")
+    if throttle.summary():
+        log(f"Export throttling: {throttle.summary()}")
+    return ExportSummary(total_rows_transferred, incomplete_tables, timings.snapshot())
@@ -0,0 +1,371 @@
+import datetime
+import gzip
+import io
+import re
+from decimal import Decimal
+
+from migration.streaming import (
+    DEFAULT_BATCH_SIZE,
+    binary_columns,
+    csv_encoder,
+    fetch_batches,
+    text_columns,
+    write_csv_stream,
+)
+
+# Decimal columns land in the narrowest BigQuery type that holds them
+DECIMAL_TARGET_TYPES = ["NUMERIC", "BIGNUMERIC", "STRING"]
+
+
+# Column names usable in Avro schemas and BigQuery tables
+def safe_column_name(name):
+    name = re.sub(r"[^A-Za-z0-9_]", "_", name)
+    if not name or name[0].isdigit():
+        name = f"_{name}"
+    return name
+
+
+# Reject codecs the format (or BigQuery's reader for it) does not support
+def check_compression(format_name, compression, supported):
+    if compression not in supported:
+        choices = ", ".join(str(codec) for codec in supported)
+        raise ValueError(
+            f"Unsupported compression {compression!r} for {format_name}; "
+            f"expected one of {choices}"
+        )
+
+
+# Arrow type of a column from its pyodbc description entry
+def arrow_type(column):
+    import pyarrow as pa
+
+    type_code, precision, scale = column[1], column[4], column[5]
+    if type_code is bool:
+        return pa.bool_()
+    if type_code is int:
+        return pa.int64()
+    if type_code is float:
+        return pa.float64()
+    if type_code is Decimal:
+        if precision and precision <= 38:
+            return pa.decimal128(precision, scale or 0)
+        return pa.decimal256(precision or 76, scale or 38)
+    if type_code in (bytes, bytearray):
+        return pa.binary()
+    if type_code is datetime.datetime:
+        return pa.timestamp("us")
+    if type_code is datetime.date:
+        return pa.date32()
+    if type_code is datetime.time:
+        return pa.time64("us")
+    return pa.string()
+
+
+# Encoder turning a batch of rows into CSV text with pyarrow's C++ CSV
+# writer: the batch is transposed once, each column becomes one typed Arrow
+# array and every value is formatted in native code rather than by str()
+# one value at a time. Binary columns are base64-encoded first. A batch
+# Arrow cannot convert (a value out of its column's range, say) goes
+# through the csv module instead. None when pyarrow is not installed.
+def arrow_csv_encoder(description):
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return None
+
+    binary = binary_columns(description)
+    types = [
+        pa.string() if index in binary else arrow_type(column)
+        for index, column in enumerate(description)
+    ]
+    schema = pa.schema(
+        [(f"c{index}", column_type) for index, column_type in enumerate(types)]
+    )
+    options = pa_csv.WriteOptions(include_header=False)
+    fallback = csv_encoder(description)
+
+    def to_array(values, column_type):
+        try:
+            return pa.array(values, type=column_type)
+        except pa.ArrowException:
+            if not pa.types.is_string(column_type):
+                raise
+        # Values without a native Arrow type (UUID, sql_variant, ...) as text
+        return pa.array(
+            [
+                value if value is None or isinstance(value, str) else str(value)
+                for value in values
+            ],
+            type=column_type,
+        )
+
+    def encode(rows):
+        try:
+            batch = pa.RecordBatch.from_arrays(
+                [
+                    to_array(values, column_type)
+                    for values, column_type in zip(text_columns(rows, binary), types)
+                ],
+                schema=schema,
+            )
+        except (pa.ArrowException, TypeError, ValueError, OverflowError):
+            return fallback(rows)
+        output = pa.BufferOutputStream()
+        pa_csv.write_csv(batch, output, options)
+        return output.getvalue().to_pybytes().decode("utf-8")
+
+    return encode
+
+
+# Text CSV with a header row, loaded with the table's explicit schema (see
+# TableSchemas.load_options); a row that does not fit fails the load. With
+# gzip the text is compressed as it is written, so nothing is buffered
+# beyond the compressor's window; BigQuery reads .csv.gz objects directly.
+class CsvFormat:
+    name = "csv"
+    compressions = (None, "gzip")
+
+    def __init__(self, compression=None):
+        check_compression(self.name, compression, self.compressions)
+        self.compression = compression
+        self.extension = "csv.gz" if compression == "gzip" else "csv"
+        self.binary = compression == "gzip"
+
+    def write(
+        self,
+        cursor,
+        file,
+        batch_size=DEFAULT_BATCH_SIZE,
+        should_stop=None,
+        on_batch=None,
+    ):
+        encoder = arrow_csv_encoder(cursor.description)
+        if self.compression is None:
+            return write_csv_stream(
+                cursor,
+                file,
+                batch_size=batch_size,
+                should_stop=should_stop,
+                on_batch=on_batch,
+                encoder=encoder,
+            )
+        with gzip.GzipFile(fileobj=file, mode="wb", compresslevel=6) as compressed:
+            text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+            rows_written = write_csv_stream(
+                cursor,
+                text,
+                batch_size=batch_size,
+                should_stop=should_stop,
+                on_batch=on_batch,
+                encoder=encoder,
+            )
+            text.flush()
+            text.detach()
+        return rows_written
+
+    def load_job_options(self):
+        return {
+            "source_format": "CSV",
+            "skip_leading_rows": 1,
+        }
+
+
+# Parquet built one record batch per fetchmany batch, keeping SQL Server
+# types (DECIMAL, DATETIME2, VARBINARY, ...) instead of their text forms
+class ParquetFormat:
+    name = "parquet"
+    extension = "parquet"
+    binary = True
+    compressions = (None, "snappy", "gzip", "zstd")
+
+    def __init__(self, compression="snappy"):
+        check_compression(self.name, compression, self.compressions)
+        self.compression = compression
+
+    def write(
+        self,
+        cursor,
+        file,
+        batch_size=DEFAULT_BATCH_SIZE,
+        should_stop=None,
+        on_batch=None,
+    ):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema(
+            [
+                (safe_column_name(column[0]), arrow_type(column))
+                for column in cursor.description
+            ]
+        )
+        # Values without a native Arrow type (UUID, sql_variant, ...) as text
+        as_text = [
+            index
+            for index, field in enumerate(schema)
+            if pa.types.is_string(field.type)
+        ]
+
+        rows_written = 0
+        with pq.ParquetWriter(
+            file, schema, compression=self.compression or "none"
+        ) as writer:
+            for rows in fetch_batches(cursor, batch_size, on_batch):
+                if should_stop is not None and should_stop():
+                    break
+                columns = [list(values) for values in zip(*rows)]
+                for index in as_text:
+                    columns[index] = [
+                        value if value is None or isinstance(value, str) else str(value)
+                        for value in columns[index]
+                    ]
+                writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+                rows_written += len(rows)
+        return rows_written
+
+    def load_job_options(self):
+        return {
+            "source_format": "PARQUET",
+            "decimal_target_types": DECIMAL_TARGET_TYPES,
+        }
+
+
+# Avro object container file written block by block by fastavro. Blocks are
+# compressed individually, so the codec adds no buffering.
+class AvroFormat:
+    name = "avro"
+    extension = "avro"
+    binary = True
+    compressions = (None, "deflate", "snappy", "zstd")
+
+    # fastavro's names for the codecs
+    codecs = {
+        None: "null",
+        "deflate": "deflate",
+        "snappy": "snappy",
+        "zstd": "zstandard",
+    }
+
+    def __init__(self, compression=None):
+        check_compression(self.name, compression, self.compressions)
+        self.compression = compression
+        self.codec = self.codecs[compression]
+
+    def avro_type(self, column):
+        type_code, precision, scale = column[1], column[4], column[5]
+        if type_code is bool:
+            return "boolean"
+        if type_code is int:
+            return "long"
+        if type_code is float:
+            return "double"
+        if type_code is Decimal:
+            return {
+                "type": "bytes",
+                "logicalType": "decimal",
+                "precision": precision or 38,
+                "scale": scale or 0,
+            }
+        if type_code in (bytes, bytearray):
+            return "bytes"
+        if type_code is datetime.datetime:
+            # BigQuery reads this annotation as DATETIME (no time zone)
+            return {"type": "string", "logicalType": "datetime"}
+        if type_code is datetime.date:
+            return {"type": "int", "logicalType": "date"}
+        if type_code is datetime.time:
+            return {"type": "long", "logicalType": "time-micros"}
+        return "string"
+
+    def write(
+        self,
+        cursor,
+        file,
+        batch_size=DEFAULT_BATCH_SIZE,
+        should_stop=None,
+        on_batch=None,
+    ):
+        import fastavro
+
+        names = [safe_column_name(column[0]) for column in cursor.description]
+        types = [self.avro_type(column) for column in cursor.description]
+        schema = fastavro.parse_schema(
+            {
+                "type": "record",
+                "name": "Row",
+                "fields": [
+                    {"name": name, "type": ["null", avro_type], "default": None}
+                    for name, avro_type in zip(names, types)
+                ],
+            }
+        )
+        # Columns fastavro expects as text
+        as_text = [
+            index
+            for index, avro_type in enumerate(types)
+            if avro_type == "string"
+            or (isinstance(avro_type, dict) and avro_type["type"] == "string")
+        ]
+        counter = {"rows": 0}
+
+        def records():
+            for rows in fetch_batches(cursor, batch_size, on_batch):
+                if should_stop is not None and should_stop():
+                    break
+                for row in rows:
+                    values = list(row)
+                    for index in as_text:
+                        value = values[index]
+                        if isinstance(value, datetime.datetime):
+                            values[index] = value.isoformat(sep=" ")
+                        elif value is not None and not isinstance(value, str):
+                            values[index] = str(value)
+                    yield dict(zip(names, values))
+                counter["rows"] += len(rows)
+
+        fastavro.writer(file, schema, records(), codec=self.codec)
+        return counter["rows"]
+
+    def load_job_options(self):
+        return {
+            "source_format": "AVRO",
+            "use_avro_logical_types": True,
+            "decimal_target_types": DECIMAL_TARGET_TYPES,
+        }
+
+
+FORMATS = {
+    CsvFormat.name: CsvFormat,
+    ParquetFormat.name: ParquetFormat,
+    AvroFormat.name: AvroFormat,
+}
+DEFAULT_FORMAT = CsvFormat.name
+
+
+# Look up an output format by name, e.g. get_format("parquet", "zstd").
+# Without a compression the format's default codec is used.
+def get_format(name, compression=None):
+    try:
+        format_class = FORMATS[name.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unknown output format {name!r}; expected one of {', '.join(FORMATS)}"
+        )
+    if compression is None:
+        return format_class()
+    return format_class(compression=compression)
+
+
+# Output format of a staging object, judged by its extension. Parquet and
+# Avro record their codec inside the file, so only CSV needs a variant.
+def format_for_blob(blob_name):
+    for output_format in (
+        CsvFormat("gzip"),
+        CsvFormat(),
+        ParquetFormat(),
+        AvroFormat(),
+    ):
+        if blob_name.endswith(f".{output_format.extension}"):
+            return output_format
+    return None
@@ -0,0 +1,353 @@
+import json
+import os
+import threading
+
+from google.cloud import bigquery
+
+from migration.export import ExportUnit, plan_export_units
+from migration.formats import safe_column_name
+from migration.partition import Shard, restrict_shard
+from migration.schema import without_layout
+from migration.selection import quote_identifier
+from migration.staging import blob_name_for
+
+SYNC_MODES = ("full", "incremental")
+DEFAULT_STATE_PATH = os.path.join("UI_Data", "sync_state.json")
+
+# Extra column of change-tracking deltas holding I/U/D
+CHANGE_OP_COLUMN = "_change_op"
+
+
+# Watermarks are kept per source database and target dataset: a delta only
+# applies to the dataset that holds the rows before it
+def state_scope(server, database, project_id, dataset_name):
+    return f"{server}/{database}->{project_id}.{dataset_name}"
+
+
+# Per-table high-watermarks of incremental syncs, kept in a JSON file. A
+# new watermark is staged as "pending" when its delta is exported and only
+# committed once BigQuery has applied it, so a failed load is re-sent.
+class StateStore:
+    def __init__(self, path=DEFAULT_STATE_PATH, scope="default"):
+        self.path = path
+        self.scope = scope
+        self._lock = threading.Lock()
+        try:
+            with open(path) as file:
+                self._data = json.load(file)
+        except FileNotFoundError:
+            self._data = {}
+
+    def _tables(self):
+        return self._data.setdefault(self.scope, {})
+
+    def get(self, table_name):
+        return self._tables().get(table_name, {})
+
+    def pending(self, table_name):
+        return self.get(table_name).get("pending")
+
+    def stage(self, table_name, **entry):
+        with self._lock:
+            self._tables().setdefault(table_name, {})["pending"] = entry
+
+    # Drop a table's watermarks, so its next sync exports it in full
+    def forget(self, table_name):
+        with self._lock:
+            self._tables().pop(table_name, None)
+        self.save()
+
+    def commit(self, table_name):
+        with self._lock:
+            state = self._tables().get(table_name, {})
+            pending = state.pop("pending", None)
+            if pending is None:
+                return
+            for key in ("mode", "column", "key_columns", "watermark"):
+                if key in pending:
+                    state[key] = pending[key]
+        self.save()
+
+    def save(self):
+        with self._lock:
+            folder_name = os.path.dirname(self.path)
+            if folder_name:
+                os.makedirs(folder_name, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as file:
+                json.dump(self._data, file, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+
+
+# rowversion columns are reported as "timestamp" by INFORMATION_SCHEMA
+def find_rowversion_column(columns):
+    for column_name, data_type in columns:
+        if data_type in ("timestamp", "rowversion"):
+            return column_name
+    return None
+
+
+# Query returning the net changes since a Change Tracking version of the
+# table with quoted name source. Deleted rows only carry their key; the
+# other columns come back NULL. With a predicate only matching changes are
+# sent, plus every delete (merging a delete of an unselected row is a no-op).
+def change_tracking_query(source, columns, key_columns, predicate=None):
+    join = " AND ".join(
+        f"T.{quote_identifier(key)} = CT.{quote_identifier(key)}" for key in key_columns
+    )
+    select = [f"CT.SYS_CHANGE_OPERATION AS {quote_identifier(CHANGE_OP_COLUMN)}"]
+    for column_name, _ in columns:
+        alias = "CT" if column_name in key_columns else "T"
+        select.append(f"{alias}.{quote_identifier(column_name)}")
+    query = (
+        f"SELECT {', '.join(select)} "
+        f"FROM CHANGETABLE(CHANGES {source}, ?) AS CT "
+        f"LEFT JOIN {source} AS T ON {join}"
+    )
+    if predicate:
+        query = (
+            f"SELECT * FROM ({query}) AS D WHERE ({predicate}) "
+            f"OR D.{quote_identifier(CHANGE_OP_COLUMN)} = 'D'"
+        )
+    return query
+
+
+# Plan the export units of an incremental sync of the catalog's tables and
+# stage the watermark each one will reach. Tables with Change Tracking send
+# their net changes (with deletes), tables with a rowversion column send
+# rows changed since the last watermark, and everything else - or a table
+# seen for the first time - is exported in full (split into shards as
+# usual). existing_tables names the tables of the target dataset, when
+# known: a table missing from it is exported in full, whatever its
+# watermark, since a delta alone would lose the rest of its rows.
+def plan_incremental_units(
+    cursor,
+    catalog,
+    state_store,
+    extension="csv",
+    prefix="",
+    existing_tables=None,
+    **shard_options,
+):
+    units = []
+    full_tables = []
+    upper = None
+    for table in catalog.tables:
+        table_name = table.name
+        state = state_store.get(table_name)
+        if existing_tables is not None and table_name not in existing_tables:
+            state = {}
+        columns = catalog.column_types(table_name)
+        key_columns = catalog.primary_key(table_name)
+        if not key_columns:
+            # Nothing to merge on: reload the table
+            state_store.stage(table_name, mode="full", full=True)
+            full_tables.append(table)
+            continue
+
+        versions = catalog.change_tracking_versions(table_name)
+        if versions is not None:
+            current_version, min_valid_version = versions
+            last_version = (
+                state.get("watermark")
+                if state.get("mode") == "change_tracking"
+                else None
+            )
+            entry = dict(
+                mode="change_tracking",
+                key_columns=key_columns,
+                watermark=current_version,
+            )
+            if (
+                last_version is None
+                or min_valid_version is None
+                or last_version < min_valid_version
+            ):
+                state_store.stage(table_name, full=True, **entry)
+                full_tables.append(table)
+            elif last_version < current_version:
+                state_store.stage(table_name, full=False, **entry)
+                units.append(
+                    ExportUnit(
+                        table_name,
+                        blob_name_for(table_name, extension=extension, prefix=prefix),
+                        Shard(None, (last_version,)),
+                        0,
+                        change_tracking_query(
+                            catalog.source(table_name),
+                            columns,
+                            key_columns,
+                            catalog.predicate(table_name),
+                        ),
+                    )
+                )
+            continue
+
+        rowversion_column = find_rowversion_column(columns)
+        if rowversion_column is not None:
+            if upper is None:
+                # Database wide, so one value serves every table of the plan
+                cursor.execute("SELECT MIN_ACTIVE_ROWVERSION()")
+                upper = bytes(cursor.fetchone()[0])
+            last = state.get("watermark") if state.get("mode") == "rowversion" else None
+            entry = dict(
+                mode="rowversion",
+                column=rowversion_column,
+                key_columns=key_columns,
+                watermark=upper.hex(),
+            )
+            if last is None:
+                state_store.stage(table_name, full=True, **entry)
+                full_tables.append(table)
+            elif bytes.fromhex(last) < upper:
+                state_store.stage(table_name, full=False, **entry)
+                column = quote_identifier(rowversion_column)
+                units.append(
+                    ExportUnit(
+                        table_name,
+                        blob_name_for(table_name, extension=extension, prefix=prefix),
+                        restrict_shard(
+                            Shard(
+                                f"{column} >= ? AND {column} < ?",
+                                (bytes.fromhex(last), upper),
+                            ),
+                            catalog.predicate(table_name),
+                        ),
+                        0,
+                        catalog.select_query(table_name),
+                    )
+                )
+            continue
+
+        state_store.stage(table_name, mode="full", full=True)
+        full_tables.append(table)
+
+    units.extend(
+        plan_export_units(
+            cursor,
+            catalog,
+            full_tables,
+            extension=extension,
+            prefix=prefix,
+            **shard_options,
+        )
+    )
+    units.sort(key=lambda unit: unit.estimated_rows, reverse=True)
+    return units
+
+
+# MERGE statement applying a delta table to its target on the key columns
+def merge_statement(target, staging, columns, key_columns, with_deletes):
+    on = " AND ".join(f"T.`{key}` = S.`{key}`" for key in key_columns)
+    update = ", ".join(f"`{column}` = S.`{column}`" for column in columns)
+    insert = ", ".join(f"`{column}`" for column in columns)
+    values = ", ".join(f"S.`{column}`" for column in columns)
+    clauses = []
+    if with_deletes:
+        clauses.append(f"WHEN MATCHED AND S.`{CHANGE_OP_COLUMN}` = 'D' THEN DELETE")
+        clauses.append(f"WHEN MATCHED THEN UPDATE SET {update}")
+        clauses.append(
+            f"WHEN NOT MATCHED AND S.`{CHANGE_OP_COLUMN}` != 'D' "
+            f"THEN INSERT ({insert}) VALUES ({values})"
+        )
+    else:
+        clauses.append(f"WHEN MATCHED THEN UPDATE SET {update}")
+        clauses.append(f"WHEN NOT MATCHED THEN INSERT ({insert}) VALUES ({values})")
+    return f"MERGE `{target}` AS T USING `{staging}` AS S ON {on} " + " ".join(clauses)
+
+
+# The steps (see migration.loading.load_steps) that apply a staged
+# incremental export to BigQuery. Full snapshots replace the target; deltas
+# are loaded into a staging table and merged on the SQL Server primary key.
+# A delta whose target table is gone fails rather than replacing the table
+# with the changed rows alone. exists=False (the table was not in the
+# dataset listing) skips looking the target up.
+def sync_steps(bigquery_client, table_ref, uri, load_options, pending, exists=True):
+    target = None
+    if exists:
+        try:
+            target = bigquery_client.get_table(table_ref)
+        except Exception:
+            pass
+
+    with_deletes = pending.get("mode") == "change_tracking"
+    load_options = dict(load_options)
+    if target is not None:
+        # Partitioning and clustering only apply when the load creates the table
+        load_options = without_layout(load_options)
+
+    if pending.get("full"):
+        job_config = bigquery.LoadJobConfig(
+            write_disposition="WRITE_TRUNCATE", **load_options
+        )
+        yield lambda: bigquery_client.load_table_from_uri(
+            uri, table_ref, job_config=job_config
+        )
+        return "replaced"
+    if target is None:
+        raise RuntimeError(
+            f"Table {table_ref.table_id} is missing from BigQuery; its changes "
+            "cannot be merged without the rest of its rows"
+        )
+
+    return (
+        yield from merge_steps(
+            bigquery_client,
+            table_ref,
+            uri,
+            load_options,
+            pending["key_columns"],
+            target,
+            with_deletes,
+        )
+    )
+
+
+# The steps that load uri into a staging table next to the existing target
+# table and MERGE it into the target on key_columns (SQL Server names),
+# outcome "merged". The staging table takes the target's schema (looked up
+# unless given) and is dropped afterwards. With with_deletes, rows whose
+# change operation is "D" are deleted from the target.
+def merge_steps(
+    bigquery_client,
+    table_ref,
+    uri,
+    load_options,
+    key_columns,
+    target=None,
+    with_deletes=False,
+    staging_suffix="__delta",
+):
+    if target is None:
+        target = bigquery_client.get_table(table_ref)
+    load_options = without_layout(load_options)
+    staging_ref = bigquery.DatasetReference(
+        table_ref.project, table_ref.dataset_id
+    ).table(f"{table_ref.table_id}{staging_suffix}")
+    # The change operation column only ever lives in the staging table
+    target_fields = [field for field in target.schema if field.name != CHANGE_OP_COLUMN]
+    if load_options.get("source_format") == "CSV" or "schema" in load_options:
+        # Keep the target's types instead of guessing them from a small delta
+        schema = list(target_fields)
+        if with_deletes:
+            schema.insert(0, bigquery.SchemaField(CHANGE_OP_COLUMN, "STRING"))
+        load_options.update(autodetect=False, schema=schema)
+    job_config = bigquery.LoadJobConfig(
+        write_disposition="WRITE_TRUNCATE", **load_options
+    )
+    try:
+        yield lambda: bigquery_client.load_table_from_uri(
+            uri, staging_ref, job_config=job_config
+        )
+        columns = [field.name for field in target_fields]
+        statement = merge_statement(
+            f"{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}",
+            f"{staging_ref.project}.{staging_ref.dataset_id}.{staging_ref.table_id}",
+            columns,
+            [safe_column_name(key) for key in key_columns],
+            with_deletes,
+        )
+        yield lambda: bigquery_client.query(statement)
+    finally:
+        bigquery_client.delete_table(staging_ref, not_found_ok=True)
+    return "merged"
@@ -0,0 +1,251 @@
+import random
+import time
+from collections import deque, namedtuple
+
+from google.api_core import exceptions as api_exceptions
+
+# Load jobs kept running in BigQuery at the same time
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# Seconds between two polls of the running jobs
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Submissions of one job before its table is reported as failed
+DEFAULT_MAX_ATTEMPTS = 5
+
+# First retry delay in seconds; doubled per attempt up to MAX_BACKOFF
+DEFAULT_BACKOFF = 2.0
+MAX_BACKOFF = 60.0
+
+# What a load does to a table that already exists: leave it alone, replace
+# its contents (atomically, in one WRITE_TRUNCATE job), append to it, or
+# stage the rows and MERGE them into it on the SQL Server primary key
+WRITE_MODES = ("skip", "truncate", "append", "merge")
+DEFAULT_WRITE_MODE = "truncate"
+WRITE_DISPOSITIONS = {"truncate": "WRITE_TRUNCATE", "append": "WRITE_APPEND"}
+
+
+# How the console describes a finished load of each state
+LOAD_MESSAGES = {
+    "loaded": "Data from {source} has been loaded into {target}",
+    "replaced": "Data from {source} has replaced the contents of {target}",
+    "appended": "Data from {source} has been appended to {target}",
+    "merged": "Data from {source} has been merged into {target}",
+}
+
+
+def check_write_mode(write_mode):
+    if write_mode not in WRITE_MODES:
+        raise ValueError(
+            f"Unknown write mode '{write_mode}'. Choose one of: {', '.join(WRITE_MODES)}"
+        )
+
+
+def describe_load(state, source, target):
+    return LOAD_MESSAGES.get(state, LOAD_MESSAGES["loaded"]).format(
+        source=source, target=target
+    )
+
+
+# Job error reasons that are worth submitting the job again for
+TRANSIENT_REASONS = (
+    "backendError",
+    "internalError",
+    "jobBackendError",
+    "jobInternalError",
+    "rateLimitExceeded",
+)
+
+TRANSIENT_EXCEPTIONS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    ConnectionError,
+)
+
+
+# A job that finished with an error; errors holds its error result
+class LoadJobError(Exception):
+    def __init__(self, error_result):
+        super().__init__(error_result.get("message") or error_result.get("reason"))
+        self.errors = [error_result]
+
+
+# How one table's load ended. state is the outcome returned by its steps,
+# or "failed" with the error set.
+LoadOutcome = namedtuple(
+    "LoadOutcome", ["table_name", "source_name", "state", "job_id", "error"]
+)
+
+
+# Whether a failed submission, poll or job should be tried again
+def is_transient(error):
+    if isinstance(error, TRANSIENT_EXCEPTIONS):
+        return True
+    reasons = [e.get("reason") for e in getattr(error, "errors", None) or []]
+    return any(reason in TRANSIENT_REASONS for reason in reasons)
+
+
+def backoff_delay(attempt, backoff=DEFAULT_BACKOFF):
+    delay = min(backoff * 2 ** (attempt - 1), MAX_BACKOFF)
+    return delay * random.uniform(0.5, 1.0)
+
+
+# The steps of a plain load: one load job, outcome state ("loaded" unless
+# given).
+#
+# Steps are generators: they yield a callable that submits a BigQuery job
+# and returns it, receive the job back once it is done, and return the
+# outcome. The scheduler calls a submit callable again when its job fails
+# with a transient error.
+def load_steps(bigquery_client, uri, table_ref, job_config, state="loaded"):
+    yield lambda: bigquery_client.load_table_from_uri(
+        uri, table_ref, job_config=job_config
+    )
+    return state
+
+
+# Run steps to completion in the calling thread, one job after the other
+def run_steps(steps):
+    try:
+        submit = next(steps)
+        while True:
+            job = submit()
+            job.result()
+            submit = steps.send(job)
+    except StopIteration as finished:
+        return finished.value
+
+
+class _Running:
+    def __init__(self, table_name, source_name, steps):
+        self.table_name = table_name
+        self.source_name = source_name
+        self.steps = steps
+        self.submit = None
+        self.job = None
+        self.attempts = 0
+        self.retry_at = None
+
+
+# Submits the load jobs of many tables concurrently, at most max_in_flight
+# at a time, polls them together and retries transient failures with
+# exponential backoff. run() yields a LoadOutcome per table as its jobs
+# finish, so callers can record and report each table right away.
+# on_start and on_retry are called with the table and source names (and the
+# error, for on_retry) when a table's load starts and before a job is
+# tried again.
+class LoadScheduler:
+    def __init__(
+        self,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        backoff=DEFAULT_BACKOFF,
+        on_start=None,
+        on_retry=None,
+        sleep=time.sleep,
+    ):
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.on_start = on_start
+        self.on_retry = on_retry
+        self._sleep = sleep
+        self._waiting = deque()
+        self._running = []
+
+    # Queue a table's load; steps is a generator as described for load_steps
+    def submit(self, table_name, source_name, steps):
+        self._waiting.append(_Running(table_name, source_name, steps))
+
+    def _fail(self, entry, error):
+        self._running.remove(entry)
+        entry.steps.close()
+        job_id = entry.job.job_id if entry.job is not None else None
+        return LoadOutcome(entry.table_name, entry.source_name, "failed", job_id, error)
+
+    def _retry_or_fail(self, entry, error):
+        if entry.attempts < self.max_attempts and is_transient(error):
+            if self.on_retry is not None:
+                self.on_retry(entry.table_name, entry.source_name, error)
+            entry.job = None
+            entry.retry_at = time.monotonic() + backoff_delay(
+                entry.attempts, self.backoff
+            )
+            return None
+        return self._fail(entry, error)
+
+    # Submit the entry's current step. Returns a LoadOutcome if it failed
+    # for good, None otherwise.
+    def _launch(self, entry):
+        entry.attempts += 1
+        entry.retry_at = None
+        try:
+            entry.job = entry.submit()
+        except Exception as e:
+            return self._retry_or_fail(entry, e)
+        return None
+
+    # Move on to the entry's next step, or finish it
+    def _advance(self, entry, job):
+        try:
+            entry.submit = entry.steps.send(job)
+        except StopIteration as finished:
+            self._running.remove(entry)
+            return LoadOutcome(
+                entry.table_name, entry.source_name, finished.value, job.job_id, None
+            )
+        except Exception as e:
+            return self._fail(entry, e)
+        entry.attempts = 0
+        return self._launch(entry)
+
+    def _start(self, entry):
+        self._running.append(entry)
+        if self.on_start is not None:
+            self.on_start(entry.table_name, entry.source_name)
+        try:
+            entry.submit = next(entry.steps)
+        except Exception as e:
+            return self._fail(entry, e)
+        return self._launch(entry)
+
+    def _poll(self, entry):
+        if entry.job is None:
+            if time.monotonic() < entry.retry_at:
+                return None
+            return self._launch(entry)
+        try:
+            entry.job.reload()
+        except Exception as e:
+            if is_transient(e):
+                return None  # Poll again next round
+            return self._fail(entry, e)
+        if entry.job.state != "DONE":
+            return None
+        if entry.job.error_result:
+            return self._retry_or_fail(entry, LoadJobError(entry.job.error_result))
+        return self._advance(entry, entry.job)
+
+    # Run every queued load. Once should_stop returns True no more tables
+    # are started, but jobs already running are waited for.
+    def run(self, should_stop=None):
+        should_stop = should_stop or (lambda: False)
+        while self._waiting or self._running:
+            if should_stop():
+                self._waiting.clear()
+            while self._waiting and len(self._running) < self.max_in_flight:
+                outcome = self._start(self._waiting.popleft())
+                if outcome is not None:
+                    yield outcome
+            if not self._running:
+                continue
+            self._sleep(self.poll_interval)
+            for entry in list(self._running):
+                outcome = self._poll(entry)
+                if outcome is not None:
+                    yield outcome
@@ -0,0 +1,375 @@
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from decimal import Decimal
+
+from google.cloud import bigquery
+
+from migration.catalog import TableTarget
+from migration.export import ExportUnit
+from migration.partition import Shard
+
+DEFAULT_MANIFEST_PATH = os.path.join("UI_Data", "migration_manifest.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    run_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS units (
+    run_id TEXT NOT NULL,
+    blob_name TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    definition TEXT NOT NULL,
+    status TEXT NOT NULL,
+    rows INTEGER,
+    bytes INTEGER,
+    generation INTEGER,
+    error TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (run_id, blob_name)
+);
+CREATE TABLE IF NOT EXISTS loads (
+    run_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    source_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    job_id TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (run_id, table_name)
+);
+CREATE TABLE IF NOT EXISTS schemas (
+    run_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    definition TEXT NOT NULL,
+    PRIMARY KEY (run_id, table_name)
+);
+CREATE TABLE IF NOT EXISTS targets (
+    run_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    source_schema TEXT NOT NULL,
+    source_name TEXT NOT NULL,
+    key_columns TEXT NOT NULL,
+    PRIMARY KEY (run_id, table_name)
+);
+"""
+
+
+def now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+# Identify a migration by what it reads, how it stages it and where it
+# loads it, so clicking "Migrate" again with the same settings resumes the
+# unfinished run, while a run into another dataset starts afresh
+def run_key_for(sql_server_details, bucket_name, project_id, dataset_name, *options):
+    parts = [
+        sql_server_details["server"],
+        sql_server_details["database"],
+        bucket_name,
+        project_id,
+        dataset_name,
+    ] + [str(option) for option in options]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+# Shard parameters are ints, decimals, dates or bytes; keep their types
+# through JSON so a resumed run uses exactly the ranges it planned
+def encode_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"bytes": bytes(value).hex()}
+    if isinstance(value, Decimal):
+        return {"decimal": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"date": value.isoformat()}
+    return value
+
+
+def decode_value(value):
+    if not isinstance(value, dict):
+        return value
+    if "bytes" in value:
+        return bytes.fromhex(value["bytes"])
+    if "decimal" in value:
+        return Decimal(value["decimal"])
+    if "datetime" in value:
+        return datetime.datetime.fromisoformat(value["datetime"])
+    return datetime.date.fromisoformat(value["date"])
+
+
+# Persistent record of a migration run: the planned export units, which of
+# them reached GCS (with row and byte counts and the object generation),
+# and which tables BigQuery has loaded. A run stays open until every unit
+# is exported and every table loaded, so an interrupted run resumes where
+# it stopped instead of starting again from the first table.
+class JobManifest:
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        folder_name = os.path.dirname(path)
+        if folder_name:
+            os.makedirs(folder_name, exist_ok=True)
+        self.path = path
+        self.run_id = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def _execute(self, statement, *params):
+        with self._lock, self._db:
+            return self._db.execute(statement, params).fetchall()
+
+    # Continue the unfinished run with this key, or start a new one.
+    # Returns True when an earlier run is being resumed.
+    def open_run(self, run_key):
+        rows = self._execute(
+            "SELECT run_id FROM runs WHERE run_key = ? AND status = 'running' "
+            "ORDER BY started_at DESC LIMIT 1",
+            run_key,
+        )
+        if rows:
+            self.run_id = rows[0][0]
+            return True
+        self.run_id = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self._execute(
+            "INSERT INTO runs (run_id, run_key, status, started_at) VALUES (?, ?, 'running', ?)",
+            self.run_id,
+            run_key,
+            now(),
+        )
+        return False
+
+    def finish_run(self):
+        self._execute(
+            "UPDATE runs SET status = 'completed', finished_at = ? WHERE run_id = ?",
+            now(),
+            self.run_id,
+        )
+
+    def save_plan(self, units):
+        for position, unit in enumerate(units):
+            definition = json.dumps(
+                {
+                    "where": unit.shard.where,
+                    "params": [encode_value(value) for value in unit.shard.params],
+                    "estimated_rows": unit.estimated_rows,
+                    "query": unit.query,
+                    "sink": unit.sink,
+                }
+            )
+            self._execute(
+                "INSERT OR REPLACE INTO units (run_id, blob_name, table_name, position, "
+                "definition, status, updated_at) VALUES (?, ?, ?, ?, ?, 'planned', ?)",
+                self.run_id,
+                unit.blob_name,
+                unit.table_name,
+                position,
+                definition,
+                now(),
+            )
+
+    # Units planned for this run, or None if it has not been planned yet
+    def load_plan(self):
+        rows = self._execute(
+            "SELECT table_name, blob_name, definition FROM units "
+            "WHERE run_id = ? ORDER BY position",
+            self.run_id,
+        )
+        if not rows:
+            return None
+        units = []
+        for table_name, blob_name, definition in rows:
+            definition = json.loads(definition)
+            shard = Shard(
+                definition["where"],
+                tuple(decode_value(value) for value in definition["params"]),
+            )
+            units.append(
+                ExportUnit(
+                    table_name,
+                    blob_name,
+                    shard,
+                    definition["estimated_rows"],
+                    definition["query"],
+                    definition.get("sink", "gcs"),
+                )
+            )
+        return units
+
+    # BigQuery schemas read from SQL Server when the run was planned, so a
+    # resumed run loads with the same schemas without reading them again
+    def save_schemas(self, schemas):
+        for table_name, schema in schemas.items():
+            self._execute(
+                "INSERT OR REPLACE INTO schemas (run_id, table_name, definition) "
+                "VALUES (?, ?, ?)",
+                self.run_id,
+                table_name,
+                json.dumps([field.to_api_repr() for field in schema]),
+            )
+
+    def load_schemas(self):
+        rows = self._execute(
+            "SELECT table_name, definition FROM schemas WHERE run_id = ?",
+            self.run_id,
+        )
+        return {
+            table_name: [
+                bigquery.SchemaField.from_api_repr(field)
+                for field in json.loads(definition)
+            ]
+            for table_name, definition in rows
+        }
+
+    # Source table and primary key of every planned table (TableTargets), so
+    # the loads pick their write mode and merge keys without SQL Server
+    def save_targets(self, targets):
+        for table_name, target in targets.items():
+            self._execute(
+                "INSERT OR REPLACE INTO targets "
+                "(run_id, table_name, source_schema, source_name, key_columns) "
+                "VALUES (?, ?, ?, ?, ?)",
+                self.run_id,
+                table_name,
+                target.source_schema,
+                target.source_name,
+                json.dumps(list(target.key_columns)),
+            )
+
+    def load_targets(self):
+        rows = self._execute(
+            "SELECT table_name, source_schema, source_name, key_columns "
+            "FROM targets WHERE run_id = ?",
+            self.run_id,
+        )
+        return {
+            table_name: TableTarget(source_schema, source_name, json.loads(key_columns))
+            for table_name, source_schema, source_name, key_columns in rows
+        }
+
+    def is_exported(self, blob_name):
+        rows = self._execute(
+            "SELECT 1 FROM units WHERE run_id = ? AND blob_name = ? AND status = 'exported'",
+            self.run_id,
+            blob_name,
+        )
+        return bool(rows)
+
+    def record_export(self, blob_name, rows, size_bytes, generation):
+        self._execute(
+            "UPDATE units SET status = 'exported', rows = ?, bytes = ?, generation = ?, "
+            "error = NULL, updated_at = ? WHERE run_id = ? AND blob_name = ?",
+            rows,
+            size_bytes,
+            generation,
+            now(),
+            self.run_id,
+            blob_name,
+        )
+
+    def record_failure(self, blob_name, error):
+        self._execute(
+            "UPDATE units SET status = 'failed', error = ?, updated_at = ? "
+            "WHERE run_id = ? AND blob_name = ?",
+            str(error),
+            now(),
+            self.run_id,
+            blob_name,
+        )
+
+    # "exported" once every unit of the table is in GCS, "pending" while
+    # some are missing, None when the table is not part of this run
+    def table_status(self, table_name):
+        rows = self._execute(
+            "SELECT status FROM units WHERE run_id = ? AND table_name = ?",
+            self.run_id,
+            table_name,
+        )
+        if not rows:
+            return None
+        if all(status == "exported" for (status,) in rows):
+            return "exported"
+        return "pending"
+
+    def exported_tables(self):
+        rows = self._execute(
+            "SELECT DISTINCT table_name FROM units WHERE run_id = ? AND status = 'exported'",
+            self.run_id,
+        )
+        return {table_name for (table_name,) in rows}
+
+    # Objects this run staged in GCS, keyed by table, in plan order. Units
+    # loaded straight into BigQuery have no object.
+    def staged_objects(self):
+        rows = self._execute(
+            "SELECT table_name, blob_name, definition FROM units "
+            "WHERE run_id = ? AND status = 'exported' ORDER BY position",
+            self.run_id,
+        )
+        objects = {}
+        for table_name, blob_name, definition in rows:
+            if json.loads(definition).get("sink", "gcs") == "gcs":
+                objects.setdefault(table_name, []).append(blob_name)
+        return objects
+
+    def is_loaded(self, table_name):
+        rows = self._execute(
+            "SELECT 1 FROM loads WHERE run_id = ? AND table_name = ?",
+            self.run_id,
+            table_name,
+        )
+        return bool(rows)
+
+    def record_load(self, table_name, source_name, status, job_id=None):
+        self._execute(
+            "INSERT OR REPLACE INTO loads (run_id, table_name, source_name, status, "
+            "job_id, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            self.run_id,
+            table_name,
+            source_name,
+            status,
+            job_id,
+            now(),
+        )
+
+    # Final load status of every table loaded (or skipped) in this run
+    def load_states(self):
+        rows = self._execute(
+            "SELECT table_name, status FROM loads WHERE run_id = ?", self.run_id
+        )
+        return dict(rows)
+
+    # Rows exported per table, over the units exported so far
+    def exported_rows(self):
+        rows = self._execute(
+            "SELECT table_name, SUM(rows) FROM units "
+            "WHERE run_id = ? AND status = 'exported' GROUP BY table_name",
+            self.run_id,
+        )
+        return {table_name: total or 0 for table_name, total in rows}
+
+    # True once every planned unit is exported and every table loaded
+    def is_complete(self):
+        rows = self._execute(
+            "SELECT COUNT(*) FROM units WHERE run_id = ? AND status != 'exported'",
+            self.run_id,
+        )
+        if rows[0][0]:
+            return False
+        rows = self._execute(
+            "SELECT COUNT(DISTINCT u.table_name) FROM units AS u "
+            "LEFT JOIN loads AS l ON l.run_id = u.run_id AND l.table_name = u.table_name "
+            "WHERE u.run_id = ? AND l.table_name IS NULL",
+            self.run_id,
+        )
+        return rows[0][0] == 0
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,289 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+# The latest run's metrics in the Prometheus text exposition format, for a
+# node_exporter textfile collector or any scraper that reads files
+DEFAULT_METRICS_PATH = os.path.join("UI_Data", "migration_metrics.prom")
+
+# One JSON report per run attempt
+DEFAULT_REPORT_DIR = os.path.join("UI_Data", "run_reports")
+
+# Upper bounds in seconds of the export and load duration histograms
+DURATION_BUCKETS = (1, 5, 15, 60, 300, 900, 3600)
+
+# Stages a run's time is split across: busy seconds of the export pipeline
+# stages, then wall seconds of the export, load and validation stages as a
+# whole
+STAGE_NAMES = ("fetch", "encode", "upload", "export", "load", "validate")
+
+
+# Cumulative histogram of durations in seconds
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def as_dict(self):
+        return {
+            "buckets": {
+                str(bound): count for bound, count in zip(self.buckets, self.counts)
+            },
+            "count": self.count,
+            "sum": round(self.sum, 3),
+        }
+
+
+class _TableMetrics:
+    def __init__(self):
+        self.objects = 0
+        self.rows = 0
+        self.bytes_fetched = 0
+        self.bytes_uploaded = 0
+        self.source_bytes = 0
+        self.export_seconds = 0.0
+        self.load_seconds = None
+        self.load_state = None
+        self.validation = None
+
+
+# A validation TableCheck as JSON, values that JSON lacks as text
+def _check_dict(check):
+    def plain(value):
+        return value if value is None or isinstance(value, int) else str(value)
+
+    return {
+        "status": check.status,
+        "source_rows": check.source_rows,
+        "exported_rows": check.exported_rows,
+        "target_rows": check.target_rows,
+        "mismatches": [
+            {
+                "check": mismatch.check,
+                "source": plain(mismatch.source),
+                "target": plain(mismatch.target),
+            }
+            for mismatch in check.mismatches
+        ],
+        "error": check.error,
+    }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Measurements of one run attempt: rows and bytes per table, how long each
+# object took to export and each table to load, busy time per stage,
+# retries per kind ("load", "direct_load") and validation outcomes. Safe to
+# update from the export workers; recorded through the run's
+# ProgressReporter.
+class RunMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = datetime.datetime.now()
+        self.tables = {}
+        self.stage_seconds = dict.fromkeys(STAGE_NAMES, 0.0)
+        self.retries = {}
+        self.export_seconds = Histogram()
+        self.load_seconds = Histogram()
+        self._unit_started = {}
+        self._load_started = {}
+
+    def _table(self, table_name):
+        return self.tables.setdefault(table_name, _TableMetrics())
+
+    # SQL Server size of the tables read, from the catalog
+    def source_sizes(self, tables):
+        with self._lock:
+            for table in tables:
+                self._table(table.name).source_bytes = table.size_bytes
+
+    def unit_started(self, unit):
+        with self._lock:
+            self._unit_started[unit.blob_name] = time.monotonic()
+
+    def unit_finished(self, unit, rows, size_bytes):
+        with self._lock:
+            started = self._unit_started.pop(unit.blob_name, None)
+            table = self._table(unit.table_name)
+            table.objects += 1
+            table.rows += rows
+            table.bytes_uploaded += size_bytes or 0
+            if started is not None:
+                seconds = time.monotonic() - started
+                table.export_seconds += seconds
+                self.export_seconds.observe(seconds)
+
+    # Estimated bytes of a batch fetched from SQL Server (see BatchSizer)
+    def fetched(self, table_name, size_bytes):
+        with self._lock:
+            self._table(table_name).bytes_fetched += size_bytes
+
+    def load_state(self, table_name, state, final):
+        with self._lock:
+            if state == "loading":
+                self._load_started[table_name] = time.monotonic()
+                return
+            if not final:
+                return
+            table = self._table(table_name)
+            table.load_state = state
+            started = self._load_started.pop(table_name, None)
+            if started is not None:
+                table.load_seconds = time.monotonic() - started
+                self.load_seconds.observe(table.load_seconds)
+
+    # Outcome of validating a table, a TableCheck
+    def validated(self, check):
+        with self._lock:
+            self._table(check.table_name).validation = check
+
+    def retried(self, kind):
+        with self._lock:
+            self.retries[kind] = self.retries.get(kind, 0) + 1
+
+    def add_stage_seconds(self, stage, seconds):
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+
+    # The run attempt as a JSON-serialisable dict. result is the run's
+    # RunResult, if it got one.
+    def report(self, run_id, result=None):
+        with self._lock:
+            rows = sum(table.rows for table in self.tables.values())
+            export_wall = self.stage_seconds["export"]
+            tables = {}
+            for table_name, table in sorted(self.tables.items()):
+                tables[table_name] = {
+                    "objects": table.objects,
+                    "rows": table.rows,
+                    "source_bytes": table.source_bytes,
+                    "bytes_fetched": table.bytes_fetched,
+                    "bytes_uploaded": table.bytes_uploaded,
+                    "export_seconds": round(table.export_seconds, 3),
+                    # Per export worker busy on the table
+                    "rows_per_second": (
+                        round(table.rows / table.export_seconds, 1)
+                        if table.export_seconds
+                        else None
+                    ),
+                    "load_state": table.load_state,
+                    "load_seconds": (
+                        round(table.load_seconds, 3)
+                        if table.load_seconds is not None
+                        else None
+                    ),
+                    "validation": (
+                        _check_dict(table.validation)
+                        if table.validation is not None
+                        else None
+                    ),
+                }
+            return {
+                "run_id": run_id,
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "finished_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "completed": result.completed if result is not None else False,
+                "stopped": result.stopped if result is not None else False,
+                "rows": rows,
+                "rows_per_second": (
+                    round(rows / export_wall, 1) if export_wall else None
+                ),
+                "source_bytes": sum(t.source_bytes for t in self.tables.values()),
+                "bytes_fetched": sum(t.bytes_fetched for t in self.tables.values()),
+                "bytes_uploaded": sum(t.bytes_uploaded for t in self.tables.values()),
+                "stage_seconds": {
+                    stage: round(seconds, 3)
+                    for stage, seconds in self.stage_seconds.items()
+                },
+                "retries": dict(self.retries),
+                "export_seconds": self.export_seconds.as_dict(),
+                "load_seconds": self.load_seconds.as_dict(),
+                "tables": tables,
+            }
+
+    # The run attempt in the Prometheus text exposition format, which the
+    # node_exporter textfile collector reads: no info type, units or EOF
+    # marker, and counters typed under their _total name. source_bytes is
+    # the tables' size in the catalog; fetched bytes are estimated from the
+    # measured width of the rows read.
+    def prometheus_text(self, run_id, result=None):
+        report = self.report(run_id, result)
+        lines = [
+            "# TYPE migration_run_info gauge",
+            f'migration_run_info{{run_id="{_escape(run_id)}"}} 1',
+            "# TYPE migration_rows_per_second gauge",
+            f"migration_rows_per_second {report['rows_per_second'] or 0}",
+            "# TYPE migration_stage_seconds gauge",
+        ]
+        for stage, seconds in report["stage_seconds"].items():
+            lines.append(f'migration_stage_seconds{{stage="{stage}"}} {seconds}')
+        lines.append("# TYPE migration_retries_total counter")
+        for kind, count in sorted(report["retries"].items()):
+            lines.append(f'migration_retries_total{{kind="{_escape(kind)}"}} {count}')
+        for name, key, kind in (
+            ("migration_rows_total", "rows", "counter"),
+            ("migration_fetched_bytes_total", "bytes_fetched", "counter"),
+            ("migration_uploaded_bytes_total", "bytes_uploaded", "counter"),
+            ("migration_source_bytes", "source_bytes", "gauge"),
+        ):
+            lines.append(f"# TYPE {name} {kind}")
+            for table_name, table in report["tables"].items():
+                lines.append(f'{name}{{table="{_escape(table_name)}"}} {table[key]}')
+        lines.append("# TYPE migration_validation_mismatches gauge")
+        for table_name, table in report["tables"].items():
+            validation = table["validation"]
+            if validation is not None and validation["status"] in ("match", "mismatch"):
+                lines.append(
+                    f'migration_validation_mismatches{{table="{_escape(table_name)}"}} '
+                    f'{len(validation["mismatches"])}'
+                )
+        for name, histogram in (
+            ("migration_export_object_seconds", self.export_seconds),
+            ("migration_load_job_seconds", self.load_seconds),
+        ):
+            lines.append(f"# TYPE {name} histogram")
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_count {histogram.count}")
+            lines.append(f"{name}_sum {histogram.sum:.3f}")
+        return "\n".join(lines) + "\n"
+
+    # Write the metrics file (replacing the previous run's) and this
+    # attempt's JSON report. Returns the report's path.
+    def write(self, run_id, result=None, metrics_path=None, report_dir=None):
+        if metrics_path:
+            _write_atomically(metrics_path, self.prometheus_text(run_id, result))
+        if not report_dir:
+            return None
+        report_path = os.path.join(
+            report_dir, f"{run_id}_{self.started_at:%Y%m%d-%H%M%S}.json"
+        )
+        _write_atomically(
+            report_path, json.dumps(self.report(run_id, result), indent=2) + "\n"
+        )
+        return report_path
+
+
+# Scrapers never see a half-written file
+def _write_atomically(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(temporary, path)
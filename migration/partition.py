@@ -0,0 +1,114 @@
+import datetime
+import math
+from collections import namedtuple
+from decimal import Decimal
+
+from migration.selection import quote_identifier
+
+# Target number of rows per shard and the cap on shards for one table
+DEFAULT_SHARD_ROWS = 5_000_000
+DEFAULT_MAX_SHARDS = 16
+
+INTEGER_TYPES = {"tinyint", "smallint", "int", "bigint"}
+DECIMAL_TYPES = {"decimal", "numeric"}
+DATE_TYPES = {"date", "datetime", "datetime2", "smalldatetime"}
+SPLITTABLE_TYPES = INTEGER_TYPES | DECIMAL_TYPES | DATE_TYPES
+
+# A shard is a WHERE clause (None for the whole table) and its parameters
+Shard = namedtuple("Shard", ["where", "params"])
+WHOLE_TABLE = Shard(None, ())
+
+
+# Pick the column to split a table on: the leading clustered (or primary)
+# key column when it has a numeric or date type (range scans on it are
+# cheap), otherwise the first numeric or date column. key_columns and
+# columns are (column, data_type) pairs. Returns one such pair or None.
+def choose_split_column(key_columns, columns):
+    for column_name, data_type in key_columns:
+        if data_type.lower() in SPLITTABLE_TYPES:
+            return column_name, data_type.lower()
+    for column_name, data_type in columns:
+        if data_type.lower() in SPLITTABLE_TYPES:
+            return column_name, data_type.lower()
+    return None
+
+
+# Narrow a shard to the rows matching predicate, a SQL Server condition on
+# the table
+def restrict_shard(shard, predicate):
+    if not predicate:
+        return shard
+    if shard.where is None:
+        return Shard(predicate, shard.params)
+    return Shard(f"({predicate}) AND ({shard.where})", shard.params)
+
+
+# Split [low, high] into shard_count boundaries, dropping duplicates that
+# appear when the range is narrower than the shard count
+def split_range(low, high, shard_count):
+    if isinstance(low, int):
+        span = high - low + 1
+        bounds = [low + span * i // shard_count for i in range(shard_count)]
+    elif isinstance(low, Decimal):
+        step = (high - low) / shard_count
+        bounds = [low + step * i for i in range(shard_count)]
+    elif isinstance(low, (datetime.datetime, datetime.date)):
+        step = (high - low) / shard_count
+        # date + timedelta drops the sub-day part, keeping date bounds whole
+        bounds = [low + step * i for i in range(shard_count)]
+    else:
+        raise TypeError(f"Cannot split a range of {type(low).__name__} values")
+    return sorted(set(bounds))
+
+
+# Turn boundaries into non-overlapping WHERE clauses. The first shard also
+# takes NULL keys and the last one is open ended, so every row lands in
+# exactly one shard even if rows were added after planning.
+def shards_from_bounds(column_name, bounds):
+    column = quote_identifier(column_name)
+    shards = []
+    for index in range(len(bounds)):
+        if index == 0:
+            if len(bounds) == 1:
+                return [WHOLE_TABLE]
+            shards.append(Shard(f"{column} < ? OR {column} IS NULL", (bounds[1],)))
+        elif index == len(bounds) - 1:
+            shards.append(Shard(f"{column} >= ?", (bounds[index],)))
+        else:
+            shards.append(
+                Shard(
+                    f"{column} >= ? AND {column} < ?",
+                    (bounds[index], bounds[index + 1]),
+                )
+            )
+    return shards
+
+
+# Number of shards a table of row_count rows should be split into
+def shard_count_for(
+    row_count, shard_rows=DEFAULT_SHARD_ROWS, max_shards=DEFAULT_MAX_SHARDS
+):
+    if not shard_rows or row_count <= shard_rows:
+        return 1
+    return min(max_shards, math.ceil(row_count / shard_rows))
+
+
+# Plan the key-range shards of one table (source is its quoted name) along
+# split_column (see choose_split_column). With a predicate, the key range
+# spans only the rows it selects, which are all the export reads. Tables
+# without a usable column or with a single distinct key value are exported
+# whole.
+def plan_shards(cursor, source, shard_count, split_column, predicate=None):
+    if shard_count <= 1 or split_column is None:
+        return [WHOLE_TABLE]
+    column_name, _ = split_column
+    column = quote_identifier(column_name)
+
+    query = f"SELECT MIN({column}), MAX({column}) FROM {source}"
+    if predicate:
+        query = f"{query} WHERE ({predicate})"
+    cursor.execute(query)
+    low, high = cursor.fetchone()
+    if low is None or low == high:
+        return [WHOLE_TABLE]
+    return shards_from_bounds(column_name, split_range(low, high, shard_count))
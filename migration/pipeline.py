@@ -0,0 +1,250 @@
+import queue
+import threading
+import time
+
+from migration.streaming import DEFAULT_BATCH_BYTES, DEFAULT_BATCH_SIZE, BatchSizer
+
+# Batches waiting to be encoded, and encoded chunks waiting to be uploaded.
+# A full queue blocks the stage feeding it, so one export holds at most
+# about this many batches plus this many chunks in memory.
+DEFAULT_QUEUE_DEPTH = 4
+
+# Encoded output handed to the uploader at once
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+STAGES = ("fetch", "encode", "upload")
+
+# Marks the end of a queue
+_DONE = object()
+
+
+# Seconds each stage spent working (not waiting on its neighbours), added
+# up over every export that shares it. The stage with the largest share of
+# the wall time is the bottleneck.
+class StageTimings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.seconds)
+
+    def summary(self):
+        return ", ".join(
+            f"{stage} {seconds:.1f}s" for stage, seconds in self.snapshot().items()
+        )
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+class _Aborted(Exception):
+    pass
+
+
+# Put an item on a bounded queue, giving up once abort is set so a stage
+# never blocks forever on a neighbour that has stopped
+def _put(items, item, abort):
+    while not abort.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+    raise _Aborted()
+
+
+# Stands in for the cursor on the encoder side: fetchmany hands out the
+# batches read by the fetcher thread
+class QueueCursor:
+    def __init__(self, batches, description):
+        self.description = description
+        self.arraysize = DEFAULT_BATCH_SIZE
+        self._batches = batches
+        self._finished = False
+        self.waited = 0.0
+
+    def fetchmany(self, size=None):
+        if self._finished:
+            return []
+        started = time.perf_counter()
+        item = self._batches.get()
+        self.waited += time.perf_counter() - started
+        if item is _DONE:
+            self._finished = True
+            return []
+        if isinstance(item, _Failed):
+            self._finished = True
+            raise item.error
+        return item
+
+
+# Stands in for the blob file on the encoder side: writes are gathered into
+# chunks of about chunk_size and queued for the uploader thread
+class ChunkWriter:
+    def __init__(self, chunks, abort, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._chunks = chunks
+        self._abort = abort
+        self.chunk_size = chunk_size
+        self._pieces = []
+        self._buffered = 0
+        self._position = 0
+        self.closed = False
+        self.waited = 0.0
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return False
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        if not data:
+            return 0
+        self._pieces.append(bytes(data) if isinstance(data, memoryview) else data)
+        self._buffered += len(data)
+        self._position += len(data)
+        if self._buffered >= self.chunk_size:
+            self._send()
+        return len(data)
+
+    def _send(self):
+        if not self._pieces:
+            return
+        empty = "" if isinstance(self._pieces[0], str) else b""
+        chunk = empty.join(self._pieces)
+        self._pieces = []
+        self._buffered = 0
+        started = time.perf_counter()
+        _put(self._chunks, chunk, self._abort)
+        self.waited += time.perf_counter() - started
+
+    def tell(self):
+        return self._position
+
+    # Encoders flush as they go; chunks are only sent once full
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self._send()
+            self.closed = True
+
+
+# Export an executed cursor into file with the fetch, encode and upload
+# stages each on their own thread, connected by bounded queues: the database
+# keeps streaming rows while the previous batches are encoded and uploaded.
+# encode(cursor, file) runs the output format's writer and returns the rows
+# written. Busy time per stage is added to timings. Fetches hold up to
+# batch_size rows and about batch_bytes of data (see BatchSizer), so wide
+# and LOB-heavy rows come in smaller batches. A pacer (FetchPacer) can lower
+# the batch size further and may hold the fetcher back after a fetch.
+# on_fetch is called from the fetch thread with the estimated size of every
+# batch fetched: its rows times the row width BatchSizer measured.
+def run_pipeline(
+    cursor,
+    file,
+    encode,
+    batch_size=DEFAULT_BATCH_SIZE,
+    timings=None,
+    queue_depth=DEFAULT_QUEUE_DEPTH,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    pacer=None,
+    batch_bytes=DEFAULT_BATCH_BYTES,
+    on_fetch=None,
+):
+    timings = timings or StageTimings()
+    batches = queue.Queue(queue_depth)
+    chunks = queue.Queue(queue_depth)
+    # Set when the encoder stops reading, and when the uploader fails
+    stop_fetching = threading.Event()
+    upload_failed = threading.Event()
+    errors = []
+
+    sizer = BatchSizer(cursor.description, batch_size, batch_bytes)
+
+    def fetch():
+        busy = 0.0
+        try:
+            while True:
+                size = sizer.size(pacer.batch_size if pacer is not None else None)
+                cursor.arraysize = size
+                started = time.perf_counter()
+                rows = cursor.fetchmany(size)
+                elapsed = time.perf_counter() - started
+                busy += elapsed
+                if not rows:
+                    break
+                sizer.measured(rows)
+                if on_fetch is not None:
+                    on_fetch(len(rows) * sizer.row_width)
+                if pacer is not None:
+                    pacer.fetched(len(rows), elapsed, stop_fetching.is_set)
+                _put(batches, rows, stop_fetching)
+            _put(batches, _DONE, stop_fetching)
+        except _Aborted:
+            pass
+        except Exception as e:
+            try:
+                _put(batches, _Failed(e), stop_fetching)
+            except _Aborted:
+                pass
+        finally:
+            timings.add("fetch", busy)
+
+    def upload():
+        busy = 0.0
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is _DONE:
+                    break
+                started = time.perf_counter()
+                file.write(chunk)
+                busy += time.perf_counter() - started
+        except Exception as e:
+            errors.append(e)
+            upload_failed.set()
+        finally:
+            timings.add("upload", busy)
+
+    fetcher = threading.Thread(target=fetch, name="export-fetch", daemon=True)
+    uploader = threading.Thread(target=upload, name="export-upload", daemon=True)
+    fetcher.start()
+    uploader.start()
+
+    source = QueueCursor(batches, cursor.description)
+    sink = ChunkWriter(chunks, upload_failed, chunk_size)
+    rows_written = None
+    started = time.perf_counter()
+    try:
+        rows_written = encode(source, sink)
+        sink.close()
+    except _Aborted:
+        pass  # The uploader failed; its error is raised below
+    finally:
+        timings.add(
+            "encode", time.perf_counter() - started - source.waited - sink.waited
+        )
+        # Release the fetcher, then let the uploader drain what is queued
+        stop_fetching.set()
+        try:
+            _put(chunks, _DONE, upload_failed)
+        except _Aborted:
+            pass
+        fetcher.join()
+        uploader.join()
+    if errors:
+        raise errors[0]
+    return rows_written
@@ -0,0 +1,212 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from migration.metrics import RunMetrics
+
+# Row counts from the export workers are published at most this often
+DEFAULT_PUBLISH_INTERVAL = 0.5
+
+# Most events taken off the queue per UI poll, so a backlog cannot hold
+# up the UI thread
+DEFAULT_DRAIN_LIMIT = 500
+
+# One progress update. kind is one of "message", "export_planned",
+# "rows_estimated", "unit_started", "rows_written", "unit_uploaded",
+# "loads_planned", "load_state" or "finished"; value is the message text, a
+# count, a state name or, for "finished", the RunResult or exception of the
+# run.
+ProgressEvent = namedtuple("ProgressEvent", ["kind", "table_name", "name", "value"])
+
+# Load states after which a table needs no more work in this run
+FINAL_LOAD_STATES = (
+    "loaded",
+    "skipped",
+    "replaced",
+    "appended",
+    "merged",
+    "held",
+    "failed",
+)
+
+
+# Publishes progress events from any thread onto a queue. Rows written are
+# added up per object and published as one event per object every
+# interval seconds, so the row loop only pays for a counter update. Without
+# a queue every event is dropped. Object, load and retry events are also
+# recorded in metrics (a RunMetrics), which never misses any.
+class ProgressReporter:
+    def __init__(self, events=None, interval=DEFAULT_PUBLISH_INTERVAL, metrics=None):
+        self.events = events
+        self.interval = interval
+        self.metrics = metrics or RunMetrics()
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._published_at = time.monotonic()
+
+    def _put(self, kind, table_name=None, name=None, value=None):
+        if self.events is not None:
+            self.events.put(ProgressEvent(kind, table_name, name, value))
+
+    def message(self, text):
+        self._put("message", value=text)
+
+    # estimated_rows comes from the catalog's row counts and drives the ETA
+    def export_planned(self, unit_count, estimated_rows=0):
+        self._put("export_planned", value=unit_count)
+        if estimated_rows:
+            self._put("rows_estimated", value=estimated_rows)
+
+    def unit_started(self, unit):
+        self.metrics.unit_started(unit)
+        self._put("unit_started", unit.table_name, unit.blob_name, unit.estimated_rows)
+
+    def rows_written(self, unit, count):
+        if self.events is None:
+            return
+        with self._lock:
+            key = (unit.table_name, unit.blob_name)
+            self._rows[key] = self._rows.get(key, 0) + count
+            if time.monotonic() - self._published_at < self.interval:
+                return
+        self.flush()
+
+    def bytes_fetched(self, unit, size_bytes):
+        self.metrics.fetched(unit.table_name, size_bytes)
+
+    def unit_uploaded(self, unit, size_bytes, rows=0):
+        self.metrics.unit_finished(unit, rows, size_bytes)
+        self.flush()
+        self._put("unit_uploaded", unit.table_name, unit.blob_name, size_bytes)
+
+    def loads_planned(self, table_count):
+        self._put("loads_planned", value=table_count)
+
+    def load_state(self, table_name, source_name, state):
+        self.metrics.load_state(table_name, state, state in FINAL_LOAD_STATES)
+        self._put("load_state", table_name, source_name, state)
+
+    # A job or request of the given kind failed transiently and is tried again
+    def retried(self, kind):
+        self.metrics.retried(kind)
+
+    def finished(self, outcome):
+        self.flush()
+        self._put("finished", value=outcome)
+
+    # Publish the row counts added up since the last flush
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, {}
+            self._published_at = time.monotonic()
+        for (table_name, blob_name), count in rows.items():
+            self._put("rows_written", table_name, blob_name, count)
+
+
+# Take the events waiting on the queue without blocking
+def drain_events(events, limit=DEFAULT_DRAIN_LIMIT):
+    drained = []
+    while len(drained) < limit:
+        try:
+            drained.append(events.get_nowait())
+        except queue.Empty:
+            break
+    return drained
+
+
+# Running totals of a migration, folded from its progress events on the UI
+# side
+class ProgressState:
+    def __init__(self):
+        self.units_total = 0
+        self.units_done = 0
+        self.rows_total = 0
+        self.rows_written = 0
+        self.export_started_at = None
+        self.bytes_uploaded = 0
+        self.loads_total = 0
+        self.load_states = {}
+        self.finished = False
+        self.outcome = None
+
+    def apply(self, event):
+        if event.kind == "export_planned":
+            self.units_total = event.value
+            self.export_started_at = time.monotonic()
+        elif event.kind == "rows_estimated":
+            self.rows_total = event.value
+        elif event.kind == "rows_written":
+            self.rows_written += event.value
+        elif event.kind == "unit_uploaded":
+            self.units_done += 1
+            self.bytes_uploaded += event.value or 0
+        elif event.kind == "loads_planned":
+            self.loads_total = event.value
+        elif event.kind == "load_state":
+            self.load_states[event.table_name] = event.value
+        elif event.kind == "finished":
+            self.finished = True
+            self.outcome = event.value
+
+    @property
+    def loads_done(self):
+        return sum(
+            1 for state in self.load_states.values() if state in FINAL_LOAD_STATES
+        )
+
+    # Objects exported so far; with a row estimate, partly written objects
+    # count by their rows
+    @property
+    def units_progress(self):
+        if self.rows_total and self.units_done < self.units_total:
+            return self.units_total * min(self.rows_written / self.rows_total, 1.0)
+        return self.units_done
+
+    # Share of the planned objects and loads that are done, from 0 to 1
+    @property
+    def fraction(self):
+        if self.finished:
+            return 1.0
+        total = self.units_total + self.loads_total
+        if not total:
+            return 0.0
+        return min((self.units_progress + self.loads_done) / total, 1.0)
+
+    # Seconds until the export finishes at the row rate so far, or None
+    # without a row estimate, before the first rows and once loading began
+    def export_eta(self, now=None):
+        if (
+            not self.rows_total
+            or not self.rows_written
+            or self.export_started_at is None
+            or self.units_done >= self.units_total
+            or self.loads_total
+        ):
+            return None
+        elapsed = (now or time.monotonic()) - self.export_started_at
+        remaining = max(self.rows_total - self.rows_written, 0)
+        return elapsed * remaining / self.rows_written
+
+    def summary(self):
+        text = (
+            f"{self.units_done}/{self.units_total} objects exported, "
+            f"{self.rows_written:,} rows, "
+            f"{self.bytes_uploaded / (1024 * 1024):.1f} MB uploaded"
+        )
+        eta = self.export_eta()
+        if eta is not None:
+            text += f", export about {format_duration(eta)} left"
+        if self.loads_total:
+            text += f", {self.loads_done}/{self.loads_total} tables loaded"
+        return text
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
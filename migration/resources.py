@@ -0,0 +1,151 @@
+import os
+import threading
+from collections import namedtuple
+
+from google.cloud import bigquery
+from google.cloud import storage
+
+from migration.connection import ConnectionPool, build_connection_string
+
+
+# GCS and BigQuery clients authenticated with the configured service
+# account file, or with application default credentials without one
+def make_clients(config):
+    if config.credentials_file:
+        storage_client = storage.Client.from_service_account_json(
+            config.credentials_file, project=config.project_id
+        )
+        bigquery_client = bigquery.Client.from_service_account_json(
+            config.credentials_file, project=config.project_id
+        )
+    else:
+        storage_client = storage.Client(project=config.project_id)
+        bigquery_client = bigquery.Client(project=config.project_id)
+    return storage_client, bigquery_client
+
+
+# What identifies a credentials file's contents without reading it: a new
+# upload or an edited file changes it
+def credentials_key(credentials_file):
+    if not credentials_file:
+        return None
+    try:
+        stat = os.stat(credentials_file)
+    except OSError:
+        return (credentials_file, None)
+    return (credentials_file, stat.st_mtime_ns, stat.st_size)
+
+
+def _close_client(client):
+    close = getattr(client, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+# What a run borrows from a ResourceCache: its Google Cloud clients and a
+# SQL Server connection pool of its own
+Lease = namedtuple("Lease", ["storage_client", "bigquery_client", "pool"])
+
+
+# SQL Server connection pools and Google Cloud clients kept across runs, so
+# a process running many migrations (the Streamlit app, reruns included)
+# does not authenticate and open new connections for each of them. A run
+# leases what it needs and releases it when it ends. Clients are shared by
+# the runs of a project with the same credentials file; superseded ones
+# are closed once no run uses them. A pool serves one run at a time, so
+# its size fits that run; a run finding every pool of its server, database
+# and user busy gets a new one, and pools left with an old password are
+# closed once released. client_factory builds the clients of a config, and
+# connect opens SQL Server connections (pyodbc.connect by default).
+class ResourceCache:
+    def __init__(self, client_factory=make_clients, connect=None):
+        self._client_factory = client_factory
+        self._connect = connect
+        self._lock = threading.Lock()
+        # (project ID, credentials key) -> [clients, runs using them]
+        self._clients = {}
+        # Newest credentials key of each project
+        self._credentials = {}
+        # (server, database, user) -> [[pool, in use]]
+        self._pools = {}
+
+    # Borrow the config's clients and an idle pool sized for its export
+    # workers. Every lease must be given back with release.
+    def acquire(self, config):
+        credentials = credentials_key(config.credentials_file)
+        client_key = (config.project_id, credentials)
+        with self._lock:
+            entry = self._clients.get(client_key)
+            if entry is None:
+                entry = [self._client_factory(config), 0]
+                self._clients[client_key] = entry
+            self._credentials[config.project_id] = credentials
+            self._evict_clients(config.project_id)
+            pool = self._acquire_pool(config)
+            entry[1] += 1
+            storage_client, bigquery_client = entry[0]
+            return Lease(storage_client, bigquery_client, pool)
+
+    # An idle pool of the config's SQL Server, or a new one. Called with the
+    # lock held.
+    def _acquire_pool(self, config):
+        key = (config.server, config.database, config.username)
+        connection_string = build_connection_string(config.sql_server_details)
+        entries = self._pools.setdefault(key, [])
+        for entry in list(entries):
+            pool, in_use = entry
+            if in_use:
+                continue
+            if pool.connection_string != connection_string:
+                # Left with an old password
+                pool.close()
+                entries.remove(entry)
+                continue
+            entry[1] = True
+            pool.size = config.export_workers
+            return pool
+        pool = ConnectionPool(
+            connection_string, size=config.export_workers, connect=self._connect
+        )
+        entries.append([pool, True])
+        return pool
+
+    # Close the idle clients of a project that newer credentials replaced.
+    # Called with the lock held.
+    def _evict_clients(self, project_id):
+        for key, (clients, users) in list(self._clients.items()):
+            if key[0] != project_id or key[1] == self._credentials.get(project_id):
+                continue
+            if users == 0:
+                del self._clients[key]
+                for client in clients:
+                    _close_client(client)
+
+    # Give back what acquire lent
+    def release(self, lease):
+        with self._lock:
+            for key, entry in self._clients.items():
+                if entry[0][0] is lease.storage_client:
+                    entry[1] -= 1
+                    self._evict_clients(key[0])
+                    break
+            for entries in self._pools.values():
+                for entry in entries:
+                    if entry[0] is lease.pool:
+                        entry[1] = False
+
+    # Close everything, runs still holding a lease included
+    def close(self):
+        with self._lock:
+            for entries in self._pools.values():
+                for pool, _ in entries:
+                    pool.close()
+            for clients, _ in self._clients.values():
+                for client in clients:
+                    _close_client(client)
+            self._pools = {}
+            self._clients = {}
+            self._credentials = {}
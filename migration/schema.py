@@ -0,0 +1,170 @@
+from collections import namedtuple
+
+from google.cloud import bigquery
+
+from migration.formats import safe_column_name
+
+# One column of a SQL Server table, as read by the catalog
+ColumnInfo = namedtuple(
+    "ColumnInfo", ["name", "data_type", "max_length", "precision", "scale", "nullable"]
+)
+
+# SQL Server types with a fixed BigQuery counterpart. DECIMAL/NUMERIC
+# depend on their precision and scale, see bigquery_type.
+TYPE_MAP = {
+    "bit": "BOOL",
+    "tinyint": "INT64",
+    "smallint": "INT64",
+    "int": "INT64",
+    "bigint": "INT64",
+    "float": "FLOAT64",
+    "real": "FLOAT64",
+    "date": "DATE",
+    "datetime": "DATETIME",
+    "datetime2": "DATETIME",
+    "smalldatetime": "DATETIME",
+    "datetimeoffset": "TIMESTAMP",
+    "time": "TIME",
+    "binary": "BYTES",
+    "varbinary": "BYTES",
+    "image": "BYTES",
+    "timestamp": "BYTES",  # rowversion
+    "rowversion": "BYTES",
+}
+
+# Precision and scale of the money types
+MONEY_TYPES = {"money": (19, 4), "smallmoney": (10, 4)}
+
+# Largest precision and scale NUMERIC holds; anything wider is BIGNUMERIC
+NUMERIC_MAX_DIGITS = 29
+NUMERIC_MAX_SCALE = 9
+
+# Column types BigQuery can partition and cluster a table by
+PARTITION_TYPES = ("DATE", "DATETIME", "TIMESTAMP")
+CLUSTER_TYPES = (
+    "BOOL",
+    "INT64",
+    "NUMERIC",
+    "BIGNUMERIC",
+    "STRING",
+    "DATE",
+    "DATETIME",
+    "TIMESTAMP",
+)
+MAX_CLUSTERING_FIELDS = 4
+PARTITION_GRANULARITIES = ("HOUR", "DAY", "MONTH", "YEAR")
+DEFAULT_PARTITION_GRANULARITY = "DAY"
+
+# Load job options that only apply when the load creates the table
+LAYOUT_OPTIONS = ("time_partitioning", "clustering_fields")
+
+
+# Copy of load job options without the layout options, for loads into a
+# table that already exists
+def without_layout(load_options):
+    return {
+        option: value
+        for option, value in load_options.items()
+        if option not in LAYOUT_OPTIONS
+    }
+
+
+# (BigQuery type, precision, scale) for a SQL Server column. Character,
+# GUID, XML and other types without a counterpart are loaded as STRING.
+def bigquery_type(column):
+    if column.data_type in TYPE_MAP:
+        return TYPE_MAP[column.data_type], None, None
+    if column.data_type in MONEY_TYPES:
+        precision, scale = MONEY_TYPES[column.data_type]
+        return "NUMERIC", precision, scale
+    if column.data_type in ("decimal", "numeric"):
+        precision, scale = column.precision or 18, column.scale or 0
+        if precision - scale <= NUMERIC_MAX_DIGITS and scale <= NUMERIC_MAX_SCALE:
+            return "NUMERIC", precision, scale
+        return "BIGNUMERIC", precision, scale
+    return "STRING", None, None
+
+
+# Explicit BigQuery schema for a table. Every column is NULLABLE: change
+# tracking deltas carry NULLs in the non-key columns of deleted rows.
+def bigquery_schema(columns):
+    schema = []
+    for column in columns:
+        field_type, precision, scale = bigquery_type(column)
+        options = {}
+        if precision is not None:
+            options.update(precision=precision, scale=scale)
+        schema.append(
+            bigquery.SchemaField(
+                safe_column_name(column.name), field_type, mode="NULLABLE", **options
+            )
+        )
+    return schema
+
+
+# Explicit schemas for the tables of a run, plus the optional partitioning
+# and clustering applied when a load creates a table. A column named by
+# partition_by or cluster_by is used in every table that has it with a
+# suitable type; tables without it are left unpartitioned or unclustered.
+class TableSchemas:
+    def __init__(
+        self,
+        schemas=None,
+        partition_by=None,
+        partition_granularity=DEFAULT_PARTITION_GRANULARITY,
+        cluster_by=(),
+    ):
+        if partition_granularity not in PARTITION_GRANULARITIES:
+            raise ValueError(
+                f"Unknown partition granularity '{partition_granularity}'. "
+                f"Choose one of: {', '.join(PARTITION_GRANULARITIES)}"
+            )
+        self.schemas = dict(schemas or {})
+        self.partition_by = partition_by
+        self.partition_granularity = partition_granularity
+        self.cluster_by = tuple(cluster_by or ())
+
+    def get(self, table_name):
+        return self.schemas.get(table_name)
+
+    def layout(self, schema):
+        fields = {field.name.lower(): field for field in schema}
+        options = {}
+        if self.partition_by:
+            field = fields.get(safe_column_name(self.partition_by).lower())
+            if field is not None and field.field_type in PARTITION_TYPES:
+                options["time_partitioning"] = bigquery.TimePartitioning(
+                    type_=self.partition_granularity, field=field.name
+                )
+        clustering_fields = []
+        for name in self.cluster_by:
+            field = fields.get(safe_column_name(name).lower())
+            if field is not None and field.field_type in CLUSTER_TYPES:
+                clustering_fields.append(field.name)
+        if clustering_fields:
+            options["clustering_fields"] = clustering_fields[:MAX_CLUSTERING_FIELDS]
+        return options
+
+    # Load job options for a table: the format's options with the explicit
+    # schema. Tables without a known schema keep the format's options, and
+    # CSV, which carries no types, has BigQuery autodetect them. Either way
+    # bad rows fail the load instead of being dropped.
+    def load_options(self, table_name, load_options):
+        schema = self.get(table_name)
+        if schema is None:
+            options = dict(load_options)
+            if options.get("source_format") == "CSV":
+                options["autodetect"] = True
+            return options
+        options = dict(load_options, schema=schema, autodetect=False)
+        options.update(self.layout(schema))
+        return options
+
+
+# Build the schema of every table from the catalog's columns, keyed by
+# table name. Sharded tables get one schema, not one per shard.
+def plan_schemas(catalog, table_names):
+    return {
+        table_name: bigquery_schema(catalog.columns(table_name))
+        for table_name in set(table_names)
+    }
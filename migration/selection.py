@@ -0,0 +1,114 @@
+import fnmatch
+import re
+
+# Patterns starting with this prefix are regular expressions; anything else
+# is a glob
+REGEX_PREFIX = "re:"
+
+# Schema of tables whose objects and BigQuery tables keep their bare name
+DEFAULT_SCHEMA = "dbo"
+
+
+# Bracket-quote a SQL Server identifier, or a schema-qualified one from its
+# parts: quote_identifier("sales", "orders") -> [sales].[orders]
+def quote_identifier(*parts):
+    return ".".join("[" + part.replace("]", "]]") + "]" for part in parts)
+
+
+# A glob or regular expression matched case-insensitively against a table.
+# Globs without a dot match the table name in any schema; regular
+# expressions and globs with a dot match "schema.table".
+class TablePattern:
+    def __init__(self, pattern):
+        self.pattern = pattern
+        if pattern.startswith(REGEX_PREFIX):
+            self._regex = re.compile(pattern[len(REGEX_PREFIX) :], re.IGNORECASE)
+            self._qualified = True
+        else:
+            self._regex = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+            self._qualified = "." in pattern
+
+    def matches(self, schema, table):
+        name = f"{schema}.{table}" if self._qualified else table
+        return self._regex.fullmatch(name) is not None
+
+
+# Which tables a migration moves, and what it reads from each of them.
+# A table is selected when it matches an include pattern (or there are
+# none) and no exclude pattern. columns and where map a table pattern to
+# the columns to export and to a SQL Server predicate rows must satisfy;
+# the first matching pattern applies.
+class TableFilter:
+    def __init__(self, include=(), exclude=(), columns=None, where=None):
+        self.include = [TablePattern(pattern) for pattern in include or ()]
+        self.exclude = [TablePattern(pattern) for pattern in exclude or ()]
+        self.columns = [
+            (TablePattern(pattern), list(names))
+            for pattern, names in (columns or {}).items()
+        ]
+        self.where = [
+            (TablePattern(pattern), predicate)
+            for pattern, predicate in (where or {}).items()
+        ]
+
+    def selects(self, schema, table):
+        if self.include and not any(
+            pattern.matches(schema, table) for pattern in self.include
+        ):
+            return False
+        return not any(pattern.matches(schema, table) for pattern in self.exclude)
+
+    # The given columns narrowed to the configured projection, in table
+    # order. Columns in keep (primary key and rowversion, which incremental
+    # syncs need) are never dropped.
+    def project(self, schema, table, columns, keep=()):
+        for pattern, names in self.columns:
+            if not pattern.matches(schema, table):
+                continue
+            wanted = {name.lower() for name in names}
+            unknown = wanted - {column.name.lower() for column in columns}
+            if unknown:
+                raise ValueError(
+                    f"Unknown columns for {schema}.{table}: {', '.join(sorted(unknown))}"
+                )
+            kept = wanted | {name.lower() for name in keep}
+            return [column for column in columns if column.name.lower() in kept]
+        return columns
+
+    def predicate(self, schema, table):
+        for pattern, predicate in self.where:
+            if pattern.matches(schema, table):
+                return predicate
+        return None
+
+
+# Value of the first pattern in rules (a mapping of table pattern to value)
+# that matches the table, or default when none does
+def setting_for(rules, schema, table, default=None):
+    for pattern, value in (rules or {}).items():
+        if TablePattern(pattern).matches(schema, table):
+            return value
+    return default
+
+
+# Name of the objects and BigQuery table of every (schema, table) pair.
+# Tables in the default schema keep their name, others are prefixed with
+# their schema, and names that would still collide get a numeric suffix.
+# Names are assigned over all tables of the database, so a table's name
+# does not depend on which tables a run selects.
+def target_names(source_tables):
+    names = {}
+    taken = set()
+    ordered = sorted(
+        source_tables,
+        key=lambda pair: (pair[0].lower() != DEFAULT_SCHEMA, pair[0], pair[1]),
+    )
+    for schema, table in ordered:
+        base = table if schema.lower() == DEFAULT_SCHEMA else f"{schema}_{table}"
+        name, suffix = base, 1
+        while name.lower() in taken:
+            suffix += 1
+            name = f"{base}_{suffix}"
+        taken.add(name.lower())
+        names[(schema, table)] = name
+    return names
@@ -0,0 +1,202 @@
+import io
+import time
+from collections import Counter, namedtuple
+
+from google.cloud import bigquery
+
+from migration.loading import (
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_WRITE_MODE,
+    WRITE_DISPOSITIONS,
+    backoff_delay,
+    is_transient,
+)
+from migration.schema import TableSchemas, without_layout
+from migration.upload import Uploader
+
+# Where an export unit goes: "gcs" stages it for a load job, "bigquery"
+# loads it straight into its table
+SINKS = ("gcs", "bigquery")
+
+# Tables up to this size in SQL Server go straight to BigQuery when direct
+# loads are enabled; bigger ones are staged in GCS. The whole encoded table
+# is held in memory, once per export worker.
+DEFAULT_DIRECT_MAX_BYTES = 64 * 1024 * 1024
+
+# What one finished unit left behind. A unit loaded straight into BigQuery
+# also carries its load state ("loaded", "replaced", "appended" or
+# "skipped") and job ID.
+UnitResult = namedtuple(
+    "UnitResult",
+    ["rows_written", "size_bytes", "generation", "load_state", "job_id"],
+    defaults=(None, None),
+)
+
+
+# Where the encoded output of an export unit is written. open() returns a
+# writer for the unit; commit() is called once the writer is closed and the
+# export was not stopped, and returns a UnitResult; discard() removes
+# whatever a failed or stopped export left behind.
+class Sink:
+    name = None
+
+    def open(self, unit, output_format):
+        raise NotImplementedError
+
+    def commit(self, unit, output_format, writer, rows_written):
+        raise NotImplementedError
+
+    def discard(self, unit):
+        pass
+
+    # Where the unit ended up, for messages
+    def location(self, unit):
+        raise NotImplementedError
+
+
+# Stages each unit as its own object in a GCS bucket
+class GcsSink(Sink):
+    name = "gcs"
+
+    def __init__(self, bucket, uploader=None):
+        self.bucket = bucket
+        self.uploader = uploader or Uploader()
+
+    def open(self, unit, output_format):
+        return self.uploader.open(
+            self.bucket.blob(unit.blob_name), output_format.binary
+        )
+
+    def commit(self, unit, output_format, writer, rows_written):
+        blob = self.bucket.blob(unit.blob_name)
+        blob.reload()
+        return UnitResult(rows_written, blob.size, blob.generation)
+
+    def discard(self, unit):
+        try:
+            self.bucket.blob(unit.blob_name).delete()
+        except Exception:
+            pass
+
+    def location(self, unit):
+        return f"GCS bucket: gs://{self.bucket.name}/{unit.blob_name}"
+
+
+# An in-memory file that keeps its contents after close, for loading.
+# Uncompressed CSV arrives as text and is stored as UTF-8.
+class MemoryBuffer(io.BytesIO):
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return super().write(data)
+
+    def close(self):
+        pass
+
+    def release(self):
+        super().close()
+
+
+# Loads each unit straight into its BigQuery table with load_table_from_file
+# from an in-memory buffer, without going through GCS. Like the staged load,
+# it writes existing tables according to the table's write mode in
+# write_modes (keyed by table name; merge tables are never routed here) and
+# uses the table's explicit schema when schemas has one.
+class BigQuerySink(Sink):
+    name = "bigquery"
+
+    def __init__(
+        self,
+        bigquery_client,
+        dataset_name,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        schemas=None,
+        existing_tables=None,
+        write_modes=None,
+        on_retry=None,
+    ):
+        self.bigquery_client = bigquery_client
+        self.dataset_name = dataset_name
+        self.max_attempts = max_attempts
+        self.schemas = schemas or TableSchemas()
+        # Tables already in the dataset, from one listing up front. Without
+        # it each unit looks its table up.
+        self.existing_tables = existing_tables
+        self.write_modes = write_modes or {}
+        # Called with the unit and the error before a load is tried again
+        self.on_retry = on_retry
+
+    def _table_ref(self, unit):
+        return self.bigquery_client.dataset(self.dataset_name).table(unit.table_name)
+
+    def _exists(self, table_ref):
+        if self.existing_tables is not None:
+            return table_ref.table_id in self.existing_tables
+        try:
+            self.bigquery_client.get_table(table_ref)
+            return True
+        except Exception:
+            return False
+
+    def open(self, unit, output_format):
+        return MemoryBuffer()
+
+    def commit(self, unit, output_format, writer, rows_written):
+        try:
+            table_ref = self._table_ref(unit)
+            size_bytes = len(writer.getbuffer())
+            write_mode = self.write_modes.get(unit.table_name, DEFAULT_WRITE_MODE)
+            load_options = self.schemas.load_options(
+                unit.table_name, output_format.load_job_options()
+            )
+            state = "loaded"
+            if self._exists(table_ref):
+                if write_mode == "skip":
+                    return UnitResult(rows_written, size_bytes, None, "skipped")
+                state = "appended" if write_mode == "append" else "replaced"
+                load_options = without_layout(load_options)
+            job_config = bigquery.LoadJobConfig(
+                write_disposition=WRITE_DISPOSITIONS.get(write_mode, "WRITE_TRUNCATE"),
+                **load_options,
+            )
+            attempt = 1
+            while True:
+                try:
+                    load_job = self.bigquery_client.load_table_from_file(
+                        writer, table_ref, job_config=job_config, rewind=True
+                    )
+                    load_job.result()
+                    return UnitResult(
+                        rows_written, size_bytes, None, state, load_job.job_id
+                    )
+                except Exception as e:
+                    if attempt >= self.max_attempts or not is_transient(e):
+                        raise
+                    if self.on_retry is not None:
+                        self.on_retry(unit, e)
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+        finally:
+            writer.release()
+
+    def discard(self, unit):
+        pass
+
+    def location(self, unit):
+        return f"BigQuery table: {self.dataset_name}.{unit.table_name}"
+
+
+# Send the tables whose SQL Server size is known and at most max_bytes
+# straight to BigQuery; sharded tables and tables of unknown size (no
+# partition stats) stay staged in GCS
+def route_small_tables(units, tables, max_bytes=DEFAULT_DIRECT_MAX_BYTES):
+    unit_counts = Counter(unit.table_name for unit in units)
+    small_tables = {
+        table.name
+        for table in tables
+        if 0 < table.size_bytes <= max_bytes and unit_counts[table.name] == 1
+    }
+    return [
+        unit._replace(sink="bigquery") if unit.table_name in small_tables else unit
+        for unit in units
+    ]
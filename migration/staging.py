@@ -0,0 +1,88 @@
+import posixpath
+import re
+
+# Shard objects of a split table: <table>/part-00001.csv, <table>/part-00002.csv, ...
+SHARD_PATTERN = re.compile(r"^(?P<table>.+)/part-\d{5}\.(?P<extension>[a-z]+(\.gz)?)$")
+
+# Object extensions the load stage knows how to read
+STAGED_EXTENSIONS = ("csv", "csv.gz", "parquet", "avro")
+
+# Each run stages its objects under <staging prefix><run ID>/, so the load
+# stage never sees objects of other runs
+DEFAULT_STAGING_PREFIX = "migration-runs/"
+
+
+def run_prefix(staging_prefix, run_id):
+    return f"{staging_prefix}{run_id}/"
+
+
+# Name of the staging object for a table, or for one of its shards
+def blob_name_for(table_name, shard_number=None, extension="csv", prefix=""):
+    if shard_number is None:
+        return f"{prefix}{table_name}.{extension}"
+    return f"{prefix}{table_name}/part-{shard_number:05d}.{extension}"
+
+
+# Wildcard naming every shard of a table in messages and the manifest; the
+# load job itself lists the shard objects one by one
+def shard_wildcard_for(table_name, extension="csv", prefix=""):
+    return f"{prefix}{table_name}/part-*.{extension}"
+
+
+# Split a staging object name into (table name, extension, is_shard), or
+# None when the object is not a staging object under prefix
+def parse_staged_name(blob_name, prefix=""):
+    if not blob_name.startswith(prefix):
+        return None
+    blob_name = blob_name[len(prefix) :]
+    match = SHARD_PATTERN.match(blob_name)
+    if match and match.group("extension") in STAGED_EXTENSIONS:
+        return match.group("table"), match.group("extension"), True
+    base_name = posixpath.basename(blob_name)
+    for extension in STAGED_EXTENSIONS:
+        if base_name.endswith(f".{extension}"):
+            return base_name[: -len(extension) - 1], extension, False
+    return None
+
+
+# Group staging object names under prefix by destination table. Sharded
+# tables keep their shards only: a whole-table object next to them is left
+# over from an earlier, unsplit export.
+def group_staged_blobs(blob_names, prefix=""):
+    tables = {}
+    for blob_name in blob_names:
+        parsed = parse_staged_name(blob_name, prefix)
+        if parsed is None:
+            continue
+        table_name, extension, is_shard = parsed
+        tables.setdefault(table_name, []).append((is_shard, blob_name))
+    grouped = {}
+    for table_name, objects in tables.items():
+        shards = sorted(blob_name for is_shard, blob_name in objects if is_shard)
+        grouped[table_name] = shards or [objects[0][1]]
+    return grouped
+
+
+# Name standing for a table's staged objects in messages and the manifest:
+# the object itself, or the wildcard over its shards
+def source_name_for(blob_names):
+    if len(blob_names) == 1:
+        return blob_names[0]
+    # Without a prefix the shard's "table" is everything before /part-
+    folder, extension, _ = parse_staged_name(blob_names[0])
+    return shard_wildcard_for(folder, extension)
+
+
+# Remove staging objects of a table left under prefix by an earlier run, so
+# a listing never picks up shards from a different split or format
+def clear_staged_table(bucket, table_name, prefix=""):
+    for blob in bucket.list_blobs(prefix=f"{prefix}{table_name}/part-"):
+        blob.delete()
+    for extension in STAGED_EXTENSIONS:
+        blob = bucket.blob(
+            blob_name_for(table_name, extension=extension, prefix=prefix)
+        )
+        try:
+            blob.delete()
+        except Exception:
+            pass
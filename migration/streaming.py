@@ -0,0 +1,170 @@
+import base64
+import csv
+import io
+
+# Number of rows pulled from the cursor per round trip
+DEFAULT_BATCH_SIZE = 10000
+
+# Bytes of row data a batch may hold, however many rows that is; batches of
+# wide or LOB-heavy rows get fewer rows
+DEFAULT_BATCH_BYTES = 16 * 1024 * 1024
+
+# Longest text or binary value SQL Server stores in row; longer declared
+# sizes (and none at all) mean a large object: VARCHAR(MAX), NVARCHAR(MAX),
+# VARBINARY(MAX), TEXT, IMAGE, XML
+MAX_IN_ROW_LENGTH = 8000
+
+# Width assumed for a large-object value until rows have been measured
+LOB_WIDTH_GUESS = 64 * 1024
+
+# Width assumed for values that are not text or binary
+SCALAR_WIDTH = 8
+
+# Bytes counted for every value on top of its data, for the Python object
+# holding it
+VALUE_OVERHEAD = 16
+
+# Rows of each batch whose width is measured
+WIDTH_SAMPLE_ROWS = 64
+
+
+# Yield lists of rows from an executed cursor without ever holding the full
+# result set in memory. on_batch is called with the size of each batch once
+# the consumer has written it.
+def fetch_batches(cursor, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    cursor.arraysize = batch_size
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+        if on_batch is not None:
+            on_batch(len(rows))
+
+
+# Indexes of the binary columns of a cursor description
+def binary_columns(description):
+    return [
+        index
+        for index, column in enumerate(description)
+        if column[1] in (bytes, bytearray)
+    ]
+
+
+# Indexes of the large-object columns of a cursor description: text and
+# binary columns without a declared size up to MAX_IN_ROW_LENGTH
+def lob_columns(description):
+    return [
+        index
+        for index, column in enumerate(description)
+        if column[1] in (str, bytes, bytearray)
+        and not 0 < (column[3] or 0) <= MAX_IN_ROW_LENGTH
+    ]
+
+
+def _value_width(value):
+    if value is None:
+        return VALUE_OVERHEAD
+    if isinstance(value, (str, bytes, bytearray)):
+        return VALUE_OVERHEAD + len(value)
+    return VALUE_OVERHEAD + SCALAR_WIDTH
+
+
+# Rows to fetch at a time so that a batch holds about batch_bytes, and never
+# more than batch_size rows. The row width starts from the declared column
+# sizes (LOB_WIDTH_GUESS for large objects) and follows a sample of every
+# batch fetched: it rises at once when rows get wider and falls back
+# gradually.
+class BatchSizer:
+    def __init__(
+        self,
+        description,
+        batch_size=DEFAULT_BATCH_SIZE,
+        batch_bytes=DEFAULT_BATCH_BYTES,
+    ):
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.lob_columns = lob_columns(description or [])
+        widths = [
+            column[3] if column[1] in (str, bytes, bytearray) else SCALAR_WIDTH
+            for column in description or []
+        ]
+        for index in self.lob_columns:
+            widths[index] = LOB_WIDTH_GUESS
+        self.row_width = sum(VALUE_OVERHEAD + width for width in widths)
+
+    # Rows for the next fetch, at most limit when one is given
+    def size(self, limit=None):
+        rows = self.batch_size if limit is None else min(limit, self.batch_size)
+        if self.batch_bytes and self.row_width:
+            rows = min(rows, self.batch_bytes // self.row_width)
+        return max(1, rows)
+
+    def measured(self, rows):
+        if not rows:
+            return
+        sample = rows[:: max(1, len(rows) // WIDTH_SAMPLE_ROWS)]
+        total = sum(_value_width(value) for row in sample for value in row)
+        width = total // len(sample)
+        self.row_width = max(width, (self.row_width + width) // 2)
+
+
+# Binary values as base64 text, the form BigQuery reads into BYTES
+def encode_binary(values):
+    encode = base64.b64encode
+    return [
+        None if value is None else encode(value).decode("ascii") for value in values
+    ]
+
+
+# Columns of a batch of rows, with the binary columns base64-encoded. The
+# rows are transposed once and only the columns that need converting are
+# touched, instead of copying every row.
+def text_columns(rows, binary):
+    columns = list(zip(*rows))
+    for index in binary:
+        columns[index] = encode_binary(columns[index])
+    return columns
+
+
+# Encoder turning a batch of rows into CSV text with the csv module. Rows
+# without binary columns are written as fetched.
+def csv_encoder(description):
+    binary = binary_columns(description)
+    text = io.StringIO()
+    csv_writer = csv.writer(text)
+
+    def encode(rows):
+        text.seek(0)
+        text.truncate()
+        csv_writer.writerows(zip(*text_columns(rows, binary)) if binary else rows)
+        return text.getvalue()
+
+    return encode
+
+
+# Stream the result of an executed cursor into a text file object as CSV,
+# batch by batch. encoder turns a batch of rows into CSV text; by default
+# the csv module's (see csv_encoder). Returns the number of data rows
+# written.
+def write_csv_stream(
+    cursor,
+    file,
+    batch_size=DEFAULT_BATCH_SIZE,
+    should_stop=None,
+    on_batch=None,
+    encoder=None,
+):
+    # Write the header
+    header = [column[0] for column in cursor.description]
+    csv.writer(file).writerow(header)
+
+    encode = encoder or csv_encoder(cursor.description)
+    rows_written = 0
+    for rows in fetch_batches(cursor, batch_size, on_batch):
+        # Checked once per batch rather than once per row
+        if should_stop is not None and should_stop():
+            break
+        file.write(encode(rows))
+        rows_written += len(rows)
+    return rows_written
@@ -0,0 +1,353 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from migration.streaming import DEFAULT_BATCH_SIZE
+
+# Seconds between two adjustments of the worker count and batch size
+DEFAULT_ADJUST_INTERVAL = 5.0
+
+DEFAULT_MIN_WORKERS = 1
+
+DEFAULT_MIN_BATCH_SIZE = 1000
+
+# Average wait of other sessions' requests, in milliseconds, above which
+# the export backs off; 0 ignores wait stats
+DEFAULT_MAX_WAIT_MS = 500
+
+# How much slower per row a table's fetches may get than its fastest seen
+# before the export backs off
+DEFAULT_LATENCY_TOLERANCE = 2.0
+
+# Bursts a rows-per-second cap lets through, in seconds of its rate
+RATE_BURST_SECONDS = 1.0
+
+# Waits that mean a session is idle rather than held up
+IDLE_WAIT_TYPES = (
+    "WAITFOR",
+    "BROKER_RECEIVE_WAITFOR",
+    "SP_SERVER_DIAGNOSTICS_SLEEP",
+    "XE_LIVE_TARGET_TVF",
+)
+
+# Requests of other sessions that are waiting right now: how many, how many
+# of them are blocked by a session of this process, and their average wait
+# so far. Sessions of this process are told apart by client host and PID.
+# Needs VIEW SERVER STATE.
+QUERY_WAIT_STATS = f"""
+SELECT COUNT(*),
+    SUM(CASE WHEN b.host_process_id = ? AND b.host_name = HOST_NAME()
+        THEN 1 ELSE 0 END),
+    AVG(CAST(r.wait_time AS FLOAT))
+FROM sys.dm_exec_requests AS r
+JOIN sys.dm_exec_sessions AS s ON s.session_id = r.session_id
+LEFT JOIN sys.dm_exec_sessions AS b ON b.session_id = r.blocking_session_id
+WHERE s.is_user_process = 1
+    AND r.session_id <> @@SPID
+    AND NOT (s.host_process_id = ? AND s.host_name = HOST_NAME())
+    AND r.wait_type IS NOT NULL
+    AND r.wait_type NOT IN ({", ".join(f"'{name}'" for name in IDLE_WAIT_TYPES)})
+"""
+
+WaitStats = namedtuple("WaitStats", ["waiting", "blocked_by_export", "average_wait_ms"])
+
+
+def read_wait_stats(cursor):
+    pid = os.getpid()
+    cursor.execute(QUERY_WAIT_STATS, pid, pid)
+    row = cursor.fetchone()
+    return WaitStats(int(row[0] or 0), int(row[1] or 0), float(row[2] or 0))
+
+
+# Reads wait stats on a connection of its own, borrowed from the pool for
+# as long as the export runs. Without permission to read them (or on any
+# other error) it logs once and reports nothing from then on.
+class WaitStatsReader:
+    def __init__(self, pool, log=print):
+        self.pool = pool
+        self.log = log
+        self._conn = None
+        self._disabled = False
+
+    def __call__(self):
+        if self._disabled:
+            return None
+        try:
+            if self._conn is None:
+                self._conn = self.pool.acquire()
+            cursor = self._conn.cursor()
+            try:
+                return read_wait_stats(cursor)
+            finally:
+                cursor.close()
+        except Exception as e:
+            self.log(f"SQL Server wait stats are not available, ignoring them: {e}")
+            self._disabled = True
+            self.close(broken=True)
+            return None
+
+    def close(self, broken=False):
+        if self._conn is not None:
+            self.pool.release(self._conn, broken=broken)
+            self._conn = None
+
+
+# Caps a flow of rows at rows_per_second, letting bursts of up to
+# RATE_BURST_SECONDS of it through. Shared by every thread it limits.
+class RateLimiter:
+    def __init__(self, rows_per_second):
+        self.rows_per_second = rows_per_second
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    # Seconds to wait after passing rows, so the flow stays under the cap
+    def delay(self, rows):
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + rows / self.rows_per_second
+            return max(0.0, self._next - now - RATE_BURST_SECONDS)
+
+
+# Sleep for seconds, in short steps, until stopped returns True
+def _sleep(seconds, stopped):
+    deadline = time.monotonic() + seconds
+    while not stopped():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, 0.1))
+
+
+# Paces the fetches of one export unit of table_name: the batch size to
+# fetch next, and the waits that keep the table and the run under their
+# rows-per-second caps. Fetch times feed the throttle's latency
+# measurements of the table.
+class FetchPacer:
+    def __init__(self, throttle, limiters, should_stop=None, table_name=None):
+        self.throttle = throttle
+        self.limiters = limiters
+        self.should_stop = should_stop or (lambda: False)
+        self.table_name = table_name
+
+    @property
+    def batch_size(self):
+        return self.throttle.batch_size
+
+    # rows were fetched in seconds (rows is 0 for the query's execution).
+    # Blocks while a cap holds the unit back, or until stopped or
+    # should_stop returns True.
+    def fetched(self, rows, seconds, stopped=None):
+        self.throttle.record(rows, seconds, self.table_name)
+        if not rows or not self.limiters:
+            return
+        delay = max(limiter.delay(rows) for limiter in self.limiters)
+        if delay:
+            self.throttle.record_wait(delay)
+            _sleep(delay, lambda: self.should_stop() or (stopped and stopped()))
+
+
+# Keeps an export's load on SQL Server in check. Workers take a slot before
+# querying, and at most `workers` slots are handed out; each fetch asks its
+# FetchPacer for the batch size and waits out the rows-per-second caps of
+# the run (max_rows_per_second) and of its table (table_rows_per_second,
+# keyed by table name); 0 or None means no cap.
+#
+# When adaptive, a monitor thread adjusts the worker count and batch size
+# every interval seconds, between the minimums and max_workers/batch_size.
+# Starting from min_workers, it adds a worker and doubles the batch while
+# SQL Server keeps up (and no cap held fetches back), and halves both when
+# it shows pressure: a table's fetches taking more than latency_tolerance
+# times longer per row than its own fastest interval so far (wide tables
+# are slower per row than narrow ones), other sessions' requests
+# waiting longer than max_wait_ms on average, or requests blocked by the
+# export's own sessions. wait_stats returns a WaitStats (or None when they
+# are unavailable).
+class ExportThrottle:
+    def __init__(
+        self,
+        max_workers,
+        batch_size=DEFAULT_BATCH_SIZE,
+        adaptive=False,
+        min_workers=DEFAULT_MIN_WORKERS,
+        min_batch_size=DEFAULT_MIN_BATCH_SIZE,
+        max_rows_per_second=None,
+        table_rows_per_second=None,
+        wait_stats=None,
+        max_wait_ms=DEFAULT_MAX_WAIT_MS,
+        latency_tolerance=DEFAULT_LATENCY_TOLERANCE,
+        interval=DEFAULT_ADJUST_INTERVAL,
+        log=print,
+    ):
+        self.max_workers = max_workers
+        self.max_batch_size = batch_size
+        self.adaptive = adaptive
+        self.min_workers = max(1, min(min_workers, max_workers))
+        self.min_batch_size = max(1, min(min_batch_size, batch_size))
+        self.wait_stats = wait_stats
+        self.max_wait_ms = max_wait_ms
+        self.latency_tolerance = latency_tolerance
+        self.interval = interval
+        self.log = log
+        self.workers = self.min_workers if adaptive else max_workers
+        self.batch_size = self.min_batch_size if adaptive else batch_size
+        self.backoffs = 0
+        self.throttled_seconds = 0.0
+        self._run_limiter = (
+            RateLimiter(max_rows_per_second) if max_rows_per_second else None
+        )
+        self._table_limiters = {
+            table_name: RateLimiter(rows_per_second)
+            for table_name, rows_per_second in (table_rows_per_second or {}).items()
+            if rows_per_second
+        }
+        self._lock = threading.Condition()
+        self._active = 0
+        self._rows = 0
+        # Rows and seconds of each table's fetches over the interval
+        self._fetches = {}
+        # Fastest seconds per row of each table over an interval
+        self._best_latency = {}
+        self._held_back = 0.0
+        self._worker_range = [self.workers, self.workers]
+        self._batch_range = [self.batch_size, self.batch_size]
+        self._stopped = threading.Event()
+        self._monitor = None
+
+    def start(self):
+        if self.adaptive and self._monitor is None:
+            self._monitor = threading.Thread(
+                target=self._watch, name="export-throttle", daemon=True
+            )
+            self._monitor.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            self.adjust()
+
+    # Hold one of the current worker slots for the duration of a with-block.
+    # Waiting for one ends early once should_stop returns True.
+    @contextmanager
+    def slot(self, should_stop=None):
+        with self._lock:
+            while self._active >= self.workers:
+                if should_stop is not None and should_stop():
+                    break
+                self._lock.wait(0.5)
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._lock.notify_all()
+
+    def pacer(self, table_name, should_stop=None):
+        limiters = [
+            limiter
+            for limiter in (self._run_limiter, self._table_limiters.get(table_name))
+            if limiter is not None
+        ]
+        return FetchPacer(self, limiters, should_stop, table_name)
+
+    def record(self, rows, seconds, table_name=None):
+        with self._lock:
+            self._rows += rows
+            fetches = self._fetches.setdefault(table_name, [0, 0.0])
+            fetches[0] += rows
+            fetches[1] += seconds
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.throttled_seconds += seconds
+            self._held_back += seconds
+
+    # Whether SQL Server shows pressure, and why. latencies maps tables to
+    # their seconds per row over the interval.
+    def _pressure(self, latencies, stats):
+        for table_name, latency in latencies.items():
+            best = self._best_latency.get(table_name)
+            if best is not None and latency > best * self.latency_tolerance:
+                table = f" of {table_name}" if table_name is not None else ""
+                return (
+                    f"fetches{table} take {latency * 1e6:.1f} ms per 1000 rows "
+                    f"(best {best * 1e6:.1f})"
+                )
+        if stats is not None:
+            if stats.blocked_by_export:
+                return f"{stats.blocked_by_export} requests blocked by the export"
+            if self.max_wait_ms and stats.average_wait_ms > self.max_wait_ms:
+                return (
+                    f"{stats.waiting} requests waiting {stats.average_wait_ms:.0f} ms "
+                    "on average"
+                )
+        return None
+
+    # Take the measurements of the last interval and scale the worker count
+    # and batch size up or down
+    def adjust(self):
+        stats = self.wait_stats() if self.wait_stats is not None else None
+        with self._lock:
+            rows, fetches, held_back = self._rows, self._fetches, self._held_back
+            self._rows, self._fetches, self._held_back = 0, {}, 0.0
+            # Seconds per row of each table, over its fetches of the interval
+            latencies = {
+                table_name: seconds / table_rows
+                for table_name, (table_rows, seconds) in fetches.items()
+                if table_rows
+            }
+            reason = self._pressure(latencies, stats)
+            for table_name, latency in latencies.items():
+                best = self._best_latency.get(table_name)
+                if best is None or latency < best:
+                    self._best_latency[table_name] = latency
+            if reason is not None:
+                workers = max(self.min_workers, self.workers // 2)
+                batch_size = max(self.min_batch_size, self.batch_size // 2)
+                self.backoffs += 1
+            elif rows and not held_back:
+                # More workers would only wait longer on the caps
+                workers = min(self.max_workers, self.workers + 1)
+                batch_size = min(self.max_batch_size, self.batch_size * 2)
+            else:
+                return
+            changed = (workers, batch_size) != (self.workers, self.batch_size)
+            self.workers, self.batch_size = workers, batch_size
+            self._worker_range = [
+                min(self._worker_range[0], workers),
+                max(self._worker_range[1], workers),
+            ]
+            self._batch_range = [
+                min(self._batch_range[0], batch_size),
+                max(self._batch_range[1], batch_size),
+            ]
+            self._lock.notify_all()
+        if reason is not None and changed:
+            self.log(
+                f"SQL Server under pressure ({reason}): down to {workers} "
+                f"workers, batches of {batch_size} rows"
+            )
+
+    def summary(self):
+        with self._lock:
+            parts = []
+            if self.adaptive:
+                parts.append(
+                    f"{self._worker_range[0]} to {self._worker_range[1]} workers, "
+                    f"batches of {self._batch_range[0]} to {self._batch_range[1]} "
+                    "rows, "
+                    f"backed off {self.backoffs} times"
+                )
+            if self.throttled_seconds:
+                parts.append(
+                    f"rows-per-second caps held fetches back "
+                    f"{self.throttled_seconds:.1f}s"
+                )
+            return "; ".join(parts)
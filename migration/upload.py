@@ -0,0 +1,190 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+# "resumable" streams each object through one resumable upload session;
+# "composite" uploads parts of it side by side and joins them with compose
+UPLOAD_MODES = ("resumable", "composite")
+DEFAULT_UPLOAD_MODE = "resumable"
+
+# Resumable upload chunk, and composite part size. GCS wants resumable
+# chunks in multiples of 256 KiB.
+CHUNK_ALIGNMENT = 256 * 1024
+DEFAULT_UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+
+# Parts of one object uploaded at the same time in composite mode
+DEFAULT_UPLOAD_PARALLELISM = 4
+
+# Compose accepts at most this many source objects per request
+MAX_COMPOSE_SOURCES = 32
+
+# Composite parts are staged under this prefix, where the load stage never
+# looks, and deleted once composed
+COMPONENT_PREFIX = "_components/"
+
+
+def check_chunk_size(chunk_size):
+    if chunk_size <= 0 or chunk_size % CHUNK_ALIGNMENT:
+        raise ValueError(
+            f"Upload chunk size must be a positive multiple of {CHUNK_ALIGNMENT} bytes"
+        )
+
+
+# Writes an object as parts of part_size bytes, uploading up to parallelism
+# parts at a time with per-part retries, then composes them into the final
+# object. A failed part is retried on its own; the table is not restarted.
+# Objects that fit in one part are uploaded directly.
+class CompositeWriter:
+    def __init__(
+        self,
+        blob,
+        part_size=DEFAULT_UPLOAD_CHUNK_SIZE,
+        parallelism=DEFAULT_UPLOAD_PARALLELISM,
+        retry=DEFAULT_RETRY,
+    ):
+        self.blob = blob
+        self.part_size = part_size
+        self.retry = retry
+        self.closed = False
+        self._buffer = bytearray()
+        self._parts = []
+        self._futures = []
+        self._executor = ThreadPoolExecutor(max_workers=parallelism)
+        # Bounds the parts held in memory while they upload
+        self._slots = threading.BoundedSemaphore(parallelism)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[: self.part_size]))
+            del self._buffer[: self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _component(self, name):
+        return self.blob.bucket.blob(f"{COMPONENT_PREFIX}{self.blob.name}/{name}")
+
+    def _upload_part(self, data):
+        # Report a failed part as soon as possible rather than at close
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        part = self._component(f"{len(self._parts):05d}")
+        self._parts.append(part)
+        self._slots.acquire()
+        future = self._executor.submit(
+            part.upload_from_string,
+            data,
+            content_type="application/octet-stream",
+            retry=self.retry,
+        )
+        future.add_done_callback(lambda future: self._slots.release())
+        self._futures.append(future)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if not self._parts:
+                self.blob.upload_from_string(
+                    bytes(self._buffer),
+                    content_type="application/octet-stream",
+                    retry=self.retry,
+                )
+                return
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            for future in self._futures:
+                future.result()
+            self._compose(self._parts)
+        finally:
+            self._buffer = bytearray()
+            self._cleanup()
+
+    # Join the parts into the object, in rounds of at most
+    # MAX_COMPOSE_SOURCES sources
+    def _compose(self, sources):
+        level = 0
+        while len(sources) > MAX_COMPOSE_SOURCES:
+            level += 1
+            merged = []
+            for start in range(0, len(sources), MAX_COMPOSE_SOURCES):
+                target = self._component(f"merged-{level}-{len(merged):05d}")
+                target.compose(
+                    sources[start : start + MAX_COMPOSE_SOURCES], retry=self.retry
+                )
+                merged.append(target)
+            self._parts.extend(merged)
+            sources = merged
+        self.blob.compose(sources, retry=self.retry)
+
+    # Give up on the object: nothing is composed and every part is removed
+    def abort(self):
+        self.closed = True
+        for future in self._futures:
+            future.cancel()
+        self._cleanup()
+
+    def _cleanup(self):
+        wait(self._futures)
+        for part in self._parts:
+            try:
+                part.delete()
+            except Exception:
+                pass
+        self._parts = []
+        self._executor.shutdown(wait=True)
+
+
+# How staging objects are uploaded to GCS
+class Uploader:
+    def __init__(
+        self,
+        mode=DEFAULT_UPLOAD_MODE,
+        chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE,
+        parallelism=DEFAULT_UPLOAD_PARALLELISM,
+    ):
+        if mode not in UPLOAD_MODES:
+            raise ValueError(
+                f"Unknown upload mode '{mode}'. Choose one of: {', '.join(UPLOAD_MODES)}"
+            )
+        check_chunk_size(chunk_size)
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.parallelism = parallelism
+
+    # Open a writer for blob. Binary writers must ignore flush() calls made
+    # by the Parquet/Avro encoders; every chunk is retried on its own when
+    # it fails with a transient error.
+    def open(self, blob, binary):
+        if self.mode == "composite":
+            return CompositeWriter(blob, self.chunk_size, self.parallelism)
+        if binary:
+            return blob.open(
+                "wb", ignore_flush=True, chunk_size=self.chunk_size, retry=DEFAULT_RETRY
+            )
+        return blob.open(
+            "w",
+            encoding="utf-8",
+            newline="",
+            chunk_size=self.chunk_size,
+            retry=DEFAULT_RETRY,
+        )
@@ -0,0 +1,287 @@
+import math
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from migration.export import unit_query
+from migration.formats import safe_column_name
+from migration.selection import quote_identifier
+
+# "counts" compares row counts, "aggregates" also compares per-column
+# aggregates that SQL Server and BigQuery compute alike
+VALIDATION_LEVELS = ("none", "counts", "aggregates")
+DEFAULT_VALIDATION = "none"
+
+# Shard queries run against SQL Server at once
+DEFAULT_VALIDATION_WORKERS = 4
+
+# Load outcomes after which the table holds exactly the exported rows;
+# appends and merges also keep rows from before the run
+REPLACING_STATES = ("loaded", "replaced")
+
+# One compared value: SQL Server and BigQuery expressions over a column
+# ({column} in the templates), and how the values of several shards
+# combine ("sum", "min" or "max")
+Aggregate = namedtuple("Aggregate", ["name", "source_sql", "target_sql", "combine"])
+
+ROW_COUNT = Aggregate("rows", "COUNT_BIG(*)", "COUNT(*)", "sum")
+
+INTEGER_TYPES = ("tinyint", "smallint", "int", "bigint")
+DECIMAL_TYPES = ("decimal", "numeric", "money", "smallmoney")
+FLOAT_TYPES = ("float", "real")
+ORDERED_TYPES = ("date", "datetime", "datetime2", "smalldatetime", "time")
+CHARACTER_TYPES = ("char", "varchar", "nchar", "nvarchar")
+BINARY_TYPES = ("binary", "varbinary", "image", "timestamp", "rowversion")
+
+# Scale of the money types
+MONEY_SCALES = {"money": 4, "smallmoney": 4}
+
+# Count of values that are neither NULL nor empty. CSV cannot tell an
+# empty string from NULL, so empty values are left out on both sides.
+NON_EMPTY = "SUM(CASE WHEN DATALENGTH({column}) > 0 THEN 1 ELSE 0 END)"
+
+# Outcome of validating one table: its rows in SQL Server, as exported and
+# in BigQuery. status is "match", "mismatch", "error" or "skipped" (the
+# validation was stopped first); mismatches are Mismatches; error says why
+# the table could not be compared.
+TableCheck = namedtuple(
+    "TableCheck",
+    ["table_name", "status", "source_rows", "exported_rows", "target_rows"]
+    + ["mismatches", "error"],
+    defaults=((), None),
+)
+
+Mismatch = namedtuple("Mismatch", ["check", "source", "target"])
+
+
+# Aggregates compared for a column (a ColumnInfo), by its SQL Server type.
+# Sums are exact (DECIMAL and NUMERIC on either side); floats and
+# date/time types compare their smallest and largest values, since float
+# sums depend on the order rows are added in. datetimeoffset, GUID, XML
+# and the other types without a BigQuery counterpart only count non-empty
+# values. Character lengths count UTF-16 code units of non-_SC collations
+# as characters, so text with characters outside the BMP can mismatch.
+def column_aggregates(column):
+    source = quote_identifier(column.name)
+    target = f"`{safe_column_name(column.name)}`"
+    data_type = column.data_type
+
+    def aggregate(kind, source_sql, target_sql, combine="sum"):
+        return Aggregate(
+            f"{kind}({column.name})",
+            source_sql.format(column=source),
+            target_sql.format(column=target),
+            combine,
+        )
+
+    if data_type == "bit":
+        return [
+            aggregate("count", "COUNT_BIG({column})", "COUNT({column})"),
+            aggregate("true", "SUM(CAST({column} AS BIGINT))", "COUNTIF({column})"),
+        ]
+    if data_type in INTEGER_TYPES:
+        return [
+            aggregate("count", "COUNT_BIG({column})", "COUNT({column})"),
+            aggregate(
+                "sum",
+                "SUM(CAST({column} AS DECIMAL(38, 0)))",
+                "SUM(CAST({column} AS NUMERIC))",
+            ),
+        ]
+    if data_type in DECIMAL_TYPES:
+        scale = MONEY_SCALES.get(data_type, column.scale or 0)
+        return [
+            aggregate("count", "COUNT_BIG({column})", "COUNT({column})"),
+            aggregate(
+                "sum", f"SUM(CAST({{column}} AS DECIMAL(38, {scale})))", "SUM({column})"
+            ),
+        ]
+    if data_type in FLOAT_TYPES or data_type in ORDERED_TYPES:
+        return [
+            aggregate("count", "COUNT_BIG({column})", "COUNT({column})"),
+            aggregate("min", "MIN({column})", "MIN({column})", "min"),
+            aggregate("max", "MAX({column})", "MAX({column})", "max"),
+        ]
+    if data_type in BINARY_TYPES:
+        return [
+            aggregate("non_empty", NON_EMPTY, "COUNTIF(BYTE_LENGTH({column}) > 0)"),
+            aggregate(
+                "bytes",
+                "SUM(CAST(DATALENGTH({column}) AS BIGINT))",
+                "SUM(BYTE_LENGTH({column}))",
+            ),
+        ]
+    aggregates = [aggregate("non_empty", NON_EMPTY, "COUNTIF(LENGTH({column}) > 0)")]
+    if data_type in CHARACTER_TYPES:
+        # LEN ignores trailing spaces unless something follows them. The
+        # column is widened to NVARCHAR(MAX) first: appending to a wide
+        # VARCHAR or CHAR would otherwise truncate it to NVARCHAR(4000).
+        aggregates.append(
+            aggregate(
+                "length",
+                "SUM(CAST(LEN(CAST({column} AS NVARCHAR(MAX)) + N'x') - 1 AS BIGINT))",
+                "SUM(LENGTH({column}))",
+            )
+        )
+    return aggregates
+
+
+# Aggregates compared for a table at the given validation level
+def table_aggregates(columns, level):
+    aggregates = [ROW_COUNT]
+    if level == "aggregates":
+        for column in columns:
+            aggregates.extend(column_aggregates(column))
+    return aggregates
+
+
+# Query computing the aggregates over exactly the rows a unit exported:
+# its own query, change tracking and predicates included
+def source_query(unit, aggregates):
+    select = ", ".join(aggregate.source_sql for aggregate in aggregates)
+    return f"SELECT {select} FROM ({unit_query(unit)}) AS exported"
+
+
+def target_query(table_id, aggregates):
+    select = ", ".join(aggregate.target_sql for aggregate in aggregates)
+    return f"SELECT {select} FROM `{table_id}`"
+
+
+def _combine(aggregate, values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return 0 if aggregate.combine == "sum" else None
+    if aggregate.combine == "min":
+        return min(values)
+    if aggregate.combine == "max":
+        return max(values)
+    return sum(values)
+
+
+def _same(source, target):
+    if source is None or target is None:
+        return source is None and target is None
+    if isinstance(source, float) or isinstance(target, float):
+        return math.isclose(float(source), float(target), rel_tol=1e-9)
+    if isinstance(source, (int, Decimal)) and isinstance(target, (int, Decimal)):
+        return Decimal(source) == Decimal(target)
+    return source == target
+
+
+# Mismatches between the combined SQL Server values and BigQuery's. Sums of
+# nothing are 0 on the SQL Server side; BigQuery returns NULL for them.
+def compare(aggregates, source_values, target_values):
+    mismatches = []
+    for aggregate, source, target in zip(aggregates, source_values, target_values):
+        if target is None and aggregate.combine == "sum":
+            target = 0
+        if not _same(source, target):
+            mismatches.append(Mismatch(aggregate.name, source, target))
+    return mismatches
+
+
+# Compare what the given tables hold in BigQuery with what their units read
+# from SQL Server, without reading rows back. tables maps each table name
+# to its ExportUnits, columns maps it to its ColumnInfos and exported_rows
+# to the rows the export recorded. Every table's BigQuery query is started
+# first, so BigQuery computes them side by side while the units' SQL Server
+# queries run on max_workers pooled connections, each over one shard.
+# Yields a TableCheck per table; once should_stop returns True, the tables
+# not yet compared are yielded as skipped.
+def validate_tables(
+    pool,
+    bigquery_client,
+    dataset_ref,
+    tables,
+    columns,
+    exported_rows=None,
+    level="counts",
+    max_workers=DEFAULT_VALIDATION_WORKERS,
+    should_stop=None,
+):
+    should_stop = should_stop or (lambda: False)
+    exported_rows = exported_rows or {}
+    aggregates = {
+        table_name: table_aggregates(columns.get(table_name, []), level)
+        for table_name in tables
+    }
+
+    jobs = {}
+    for table_name in tables:
+        table_ref = dataset_ref.table(table_name)
+        table_id = f"{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}"
+        try:
+            jobs[table_name] = bigquery_client.query(
+                target_query(table_id, aggregates[table_name])
+            )
+        except Exception as e:
+            jobs[table_name] = e
+
+    def read_shard(table_name, unit):
+        if should_stop():
+            return None
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    source_query(unit, aggregates[table_name]), *unit.shard.params
+                )
+                return tuple(cursor.fetchone())
+            finally:
+                cursor.close()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        shards = {
+            table_name: [
+                executor.submit(read_shard, table_name, unit) for unit in units
+            ]
+            for table_name, units in tables.items()
+        }
+        stopped = False
+        for table_name, futures in shards.items():
+            compared = aggregates[table_name]
+            exported = exported_rows.get(table_name)
+            if not stopped:
+                try:
+                    rows = [future.result() for future in futures]
+                except Exception as e:
+                    yield TableCheck(
+                        table_name, "error", None, exported, None, (), str(e)
+                    )
+                    continue
+                stopped = any(row is None for row in rows)
+            if stopped:
+                # Shards not started are not run once stopped
+                for future in futures:
+                    future.cancel()
+                yield TableCheck(
+                    table_name,
+                    "skipped",
+                    None,
+                    exported,
+                    None,
+                    (),
+                    "validation stopped",
+                )
+                continue
+            try:
+                source_values = [
+                    _combine(aggregate, [row[position] for row in rows])
+                    for position, aggregate in enumerate(compared)
+                ]
+                job = jobs[table_name]
+                if isinstance(job, Exception):
+                    raise job
+                target_values = list(next(iter(job.result())).values())
+            except Exception as e:
+                yield TableCheck(table_name, "error", None, exported, None, (), str(e))
+                continue
+            mismatches = compare(compared, source_values, target_values)
+            yield TableCheck(
+                table_name,
+                "mismatch" if mismatches else "match",
+                source_values[0],
+                exported,
+                target_values[0],
+                tuple(mismatches),
+            )
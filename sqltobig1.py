@@ -1,15 +1,34 @@
 import tkinter as tk
 from tkinter import filedialog
-import pyodbc
-import csv
 import os
-from google.cloud import storage
-from google.cloud import bigquery
 import datetime  # Import datetime module for date and time operations
+from migration.engine import MigrationConfig, MigrationWorker
+from migration.export import DEFAULT_EXPORT_WORKERS
+from migration.formats import DEFAULT_FORMAT
+from migration.loading import DEFAULT_MAX_IN_FLIGHT, DEFAULT_WRITE_MODE
+from migration.partition import DEFAULT_MAX_SHARDS, DEFAULT_SHARD_ROWS
+from migration.progress import ProgressState, drain_events
+from migration.resources import ResourceCache
+from migration.streaming import DEFAULT_BATCH_SIZE
 
 # Global variables
 JSON_AUTH_FILE_PATH = ""
 stop_transfer = False
+FETCH_BATCH_SIZE = DEFAULT_BATCH_SIZE  # Rows fetched from SQL Server per round trip
+EXPORT_WORKERS = DEFAULT_EXPORT_WORKERS  # Tables exported in parallel
+SHARD_ROWS = DEFAULT_SHARD_ROWS  # Tables above this row count are split by key range
+MAX_SHARDS_PER_TABLE = DEFAULT_MAX_SHARDS
+LOAD_JOBS = DEFAULT_MAX_IN_FLIGHT  # BigQuery load jobs run at the same time
+INCLUDE_TABLES = ()  # Table globs to migrate, e.g. ("sales.*",); empty means all
+EXCLUDE_TABLES = ()  # Table globs to skip
+OUTPUT_FORMAT = DEFAULT_FORMAT  # Staging format: "csv", "parquet" or "avro"
+COMPRESSION = None  # "gzip" for CSV; "snappy"/"zstd" for Parquet and Avro
+SYNC_MODE = "full"  # "incremental" exports only rows changed since the last run
+WRITE_MODE = DEFAULT_WRITE_MODE  # "truncate", "append", "merge" or "skip"
+POLL_INTERVAL_MS = 200  # How often the window picks up progress from the worker
+migration_worker = None
+# Clients and SQL Server connections reused by every migration of the window
+shared_resources = ResourceCache()
 
 
 # Define the append_to_console function to add messages to the console output
@@ -24,136 +43,26 @@ def get_current_datetime():
     return now.strftime("%Y-%m-%d_%H-%M-%S")
 
 
-# Define export_to_gcs to accept UI elements as arguments
-def export_to_gcs(sql_server_details, bucket_name):
-    global stop_transfer
-    try:
-        # Connect to SQL Server
-        conn = pyodbc.connect(
-            f"DRIVER={{SQL Server}};"
-            f"SERVER={sql_server_details['server']};"
-            f"DATABASE={sql_server_details['database']};"
-            f"UID={sql_server_details['username']};"
-            f"PWD={sql_server_details['password']};"
-        )
-
-        # Create a cursor from the connection
-        cursor = conn.cursor()
-
-        # Query to get all tables in the database
-        query_tables = "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE = 'BASE TABLE'"
-        cursor.execute(query_tables)
-        tables = cursor.fetchall()
-
-        total_rows_transferred = 0  # Counter for total rows transferred
-
-        # Initialize the Google Cloud Storage client
-        storage_client = storage.Client()
-
-        # Iterate over each table
-        for table in tables:
-            if stop_transfer:
-                print("Transfer stopped by user.")
-                break
-
-            table_name = table[0]
-            append_to_console(f"Exporting data from table: {table_name}")
-
-            # Query to select all data from the current table
-            query_data = f"SELECT * FROM {table_name}"
-            cursor.execute(query_data)
-
-            # Specify the name of the object in the bucket
-            blob_name = f"{table_name}.csv"
-
-            # Get the bucket
-            bucket = storage_client.bucket(bucket_name)
-
-            # Create a blob object in the bucket
-            blob = bucket.blob(blob_name)
-
-            # Write data directly to the blob
-            with blob.open("w", encoding="utf-8", newline="") as file:
-                csv_writer = csv.writer(file)
-
-                # Write the header
-                header = [column[0] for column in cursor.description]
-                csv_writer.writerow(header)
-
-                # Write data rows and track progress
-                for row in cursor.fetchall():
-                    if stop_transfer:
-                        print("Transfer stopped by user.")
-                        break
-                    csv_writer.writerow(row)
-                    total_rows_transferred += 1
-
-            append_to_console(
-                f"Data from table '{table_name}' has been uploaded to GCS bucket: gs://{bucket_name}/{blob_name}"
-            )
-        # Transfer data from GCS to BigQuery
-        transfer_to_bigquery()
-
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-
-    finally:
-        # Close the cursor and connection
-        if "cursor" in locals() and cursor:
-            cursor.close()
-        if "conn" in locals() and conn:
-            conn.close()
-
-
-# Define transfer_to_bigquery to accept UI elements as arguments
-def transfer_to_bigquery():
-    global JSON_AUTH_FILE_PATH
-
-    if not JSON_AUTH_FILE_PATH:
-        append_to_console("Please select the JSON authentication file.")
-        return
-
-    PROJECT_ID = project_entry.get()
-    DATASET_NAME = dataset_entry.get()
-    BUCKET_NAME = bucket_entry.get()
-
-    bigquery_client = bigquery.Client(project=PROJECT_ID)
-    storage_client = storage.Client(project=PROJECT_ID)
-
-    bucket = storage_client.get_bucket(BUCKET_NAME)
-    blobs = bucket.list_blobs()
-
-    for blob in blobs:
-        if blob.name.endswith(".csv"):
-            table_name = os.path.splitext(os.path.basename(blob.name))[0]
-            dataset_ref = bigquery_client.dataset(DATASET_NAME)
-            table_ref = dataset_ref.table(table_name)
-
-            try:
-                bigquery_client.get_table(table_ref)
-                append_to_console(
-                    f"Table {table_name} already exists. Skipping load for {blob.name}"
-                )
-            except Exception as e:
-                try:
-                    job_config = bigquery.LoadJobConfig(
-                        autodetect=True,
-                        skip_leading_rows=1,
-                        source_format=bigquery.SourceFormat.CSV,
-                        max_bad_records=1000,  # Adjust this value as needed
-                    )
-                    uri = f"gs://{BUCKET_NAME}/{blob.name}"
-                    load_job = bigquery_client.load_table_from_uri(
-                        uri, table_ref, job_config=job_config
-                    )
-                    load_job.result()  # Waits for the job to complete.
-                    append_to_console(
-                        f"Data from {blob.name} has been loaded into {table_name}"
-                    )
-                except Exception as load_error:
-                    append_to_console(
-                        f"Error loading data from {blob.name}: {load_error}"
-                    )
+# Build the engine configuration from the UI fields and the settings above
+def build_migration_config(sql_server_details, bucket_name, dataset_name, project_id):
+    return MigrationConfig(
+        bucket_name=bucket_name,
+        dataset_name=dataset_name,
+        project_id=project_id,
+        credentials_file=JSON_AUTH_FILE_PATH or None,
+        output_format=OUTPUT_FORMAT,
+        compression=COMPRESSION,
+        sync_mode=SYNC_MODE,
+        write_mode=WRITE_MODE,
+        export_workers=EXPORT_WORKERS,
+        batch_size=FETCH_BATCH_SIZE,
+        shard_rows=SHARD_ROWS,
+        max_shards=MAX_SHARDS_PER_TABLE,
+        load_jobs=LOAD_JOBS,
+        include_tables=INCLUDE_TABLES,
+        exclude_tables=EXCLUDE_TABLES,
+        **sql_server_details,
+    )
 
 
 def validate_ui_fields():
@@ -174,7 +83,10 @@ def validate_ui_fields():
 
 # Modify export_and_transfer_button_click function to accept UI elements as arguments
 def export_and_transfer_button_click():
-    global stop_transfer
+    global stop_transfer, migration_worker
+    if migration_worker is not None and migration_worker.is_alive():
+        append_to_console("A migration is already running.")
+        return
     stop_transfer = False
     if not validate_ui_fields():
         append_to_console("Please fill in all fields before initiating the migration.")
@@ -188,13 +100,36 @@ def export_and_transfer_button_click():
     bucket_name = bucket_entry.get()
     dataset_name = dataset_entry.get()
 
-    # Export data from SQL Server to GCS
-    export_to_gcs(sql_server_details, bucket_name)
+    # Export data from SQL Server to GCS and transfer it to BigQuery on a
+    # background thread, so the window and the Cancel button stay responsive
+    config = build_migration_config(
+        sql_server_details, bucket_name, dataset_name, project_entry.get()
+    )
+    migration_worker = MigrationWorker(
+        config, should_stop=lambda: stop_transfer, resources=shared_resources
+    )
+    migration_worker.start()
+    export_transfer_button.config(state=tk.DISABLED)
+    root.after(POLL_INTERVAL_MS, poll_progress, ProgressState())
 
     # Save UI data
     save_ui_data(sql_server_details, JSON_AUTH_FILE_PATH, bucket_name, dataset_name)
 
 
+# Show the worker's messages and progress; reschedules itself until the
+# migration has finished
+def poll_progress(progress_state):
+    for event in drain_events(migration_worker.events):
+        progress_state.apply(event)
+        if event.kind == "message":
+            append_to_console(event.value)
+    progress_label.config(text=progress_state.summary())
+    if progress_state.finished:
+        export_transfer_button.config(state=tk.NORMAL)
+        return
+    root.after(POLL_INTERVAL_MS, poll_progress, progress_state)
+
+
 def select_json_file():
     global JSON_AUTH_FILE_PATH
     JSON_AUTH_FILE_PATH = filedialog.askopenfilename(
@@ -291,22 +226,26 @@ json_file_label.grid(row=2, column=1, sticky=tk.E)
 json_file_entry = tk.Entry(root)
 json_file_entry.grid(row=2, column=2, padx=5, pady=5, sticky=tk.W, columnspan=2)
 
-# Load your icon image (replace 'path_to_icon.png' with the actual path to your icon file)
-# Load your icon image
-icon_image = tk.PhotoImage(file=r"C:\Users\admin\Downloads\search.png")
+# Load the icon image from next to this script; fall back to a text button
+icon_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "search.png")
+if os.path.exists(icon_path):
+    icon_image = tk.PhotoImage(file=icon_path)
 
-# Resize the icon by a factor of 2
-icon_image_resized = icon_image.subsample(17, 16)
+    # Resize the icon by a factor of 2
+    icon_image_resized = icon_image.subsample(17, 16)
+    button_options = {"image": icon_image_resized}
+else:
+    button_options = {"text": "Browse", "fg": "white"}
 
 # Set the background color of the button to match the window background
 json_file_button = tk.Button(
     root,
     command=select_json_file,
-    image=icon_image_resized,
     bg="#2C3E50",
     highlightthickness=0,
     bd=0,
     activebackground="#2C3E50",
+    **button_options,
 )
 json_file_button.place(x=650, y=90)
 
@@ -344,6 +283,9 @@ console_frame.grid(row=6, column=0, columnspan=4, sticky="nsew", padx=10, pady=5
 console_label = tk.Label(console_frame, text="Console Output", bg="#34495E", fg="white")
 console_label.pack(pady=(0, 3))
 
+progress_label = tk.Label(console_frame, text="", bg="#34495E", fg="white")
+progress_label.pack(pady=(0, 3))
+
 console_output = tk.Text(
     console_frame, wrap=tk.WORD, bg="black", fg="white", height=10, width=80
 )
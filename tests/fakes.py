@@ -0,0 +1,430 @@
+import bisect
+import datetime
+import fnmatch
+import io
+import itertools
+import re
+import threading
+from collections import namedtuple
+from decimal import Decimal
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud import bigquery
+
+from migration.catalog import (
+    QUERY_CHANGE_TRACKING,
+    QUERY_CLUSTERED_KEYS,
+    QUERY_COLUMNS,
+    QUERY_PRIMARY_KEYS,
+    QUERY_TABLE_SIZES,
+)
+from migration.sinks import MemoryBuffer, Sink, UnitResult
+from migration.throttle import QUERY_WAIT_STATS
+
+# In-process stand-ins for SQL Server, the Google Cloud clients and a Sink,
+# for the tests and benchmarks of the export, upload and load paths without
+# a database or a project
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+        self.generation = None
+
+    def _store(self, data):
+        with self.bucket.lock:
+            self.bucket.generation += 1
+            self.bucket.objects[self.name] = (bytes(data), self.bucket.generation)
+
+    def upload_from_string(self, data, content_type=None, retry=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        def attempt():
+            self.bucket.client.maybe_fail()
+            self._store(data)
+
+        if callable(retry):
+            attempt = retry(attempt)
+        attempt()
+
+    def open(self, mode="r", encoding=None, newline=None, **kwargs):
+        if "r" in mode:
+            data = self.download_as_bytes()
+            if "b" in mode:
+                return io.BytesIO(data)
+            return io.StringIO(data.decode(encoding or "utf-8"), newline=newline)
+        writer = _FakeWriter(self)
+        if "b" in mode:
+            return writer
+        return io.TextIOWrapper(writer, encoding=encoding or "utf-8", newline=newline)
+
+    def compose(self, sources, retry=None, **kwargs):
+        with self.bucket.lock:
+            data = b"".join(self.bucket.objects[source.name][0] for source in sources)
+        self._store(data)
+
+    def download_as_bytes(self, **kwargs):
+        try:
+            return self.bucket.objects[self.name][0]
+        except KeyError:
+            raise api_exceptions.NotFound(f"No such object: {self.name}")
+
+    def exists(self, **kwargs):
+        return self.name in self.bucket.objects
+
+    def reload(self, **kwargs):
+        data = self.download_as_bytes()
+        self.size = len(data)
+        self.generation = self.bucket.objects[self.name][1]
+
+    def delete(self, **kwargs):
+        with self.bucket.lock:
+            if self.bucket.objects.pop(self.name, None) is None:
+                raise api_exceptions.NotFound(f"No such object: {self.name}")
+
+
+class _FakeWriter(io.RawIOBase):
+    def __init__(self, blob):
+        super().__init__()
+        self.blob = blob
+        self._data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._data += data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.blob._store(self._data)
+        super().close()
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.objects = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix=None, **kwargs):
+        with self.lock:
+            names = sorted(self.objects)
+        return [
+            self.blob(name) for name in names if not prefix or name.startswith(prefix)
+        ]
+
+
+# A storage client whose first fail_uploads uploads fail with a transient
+# error, to exercise the retry paths
+class FakeStorageClient:
+    def __init__(self, fail_uploads=0):
+        self.fail_uploads = fail_uploads
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, name):
+        with self._lock:
+            if name not in self._buckets:
+                self._buckets[name] = FakeBucket(self, name)
+            return self._buckets[name]
+
+    def maybe_fail(self):
+        with self._lock:
+            if self.fail_uploads <= 0:
+                return
+            self.fail_uploads -= 1
+        raise api_exceptions.ServiceUnavailable("Injected upload failure")
+
+
+class FakeJob:
+    def __init__(self, job_id, error_result=None):
+        self.job_id = job_id
+        self.state = "DONE"
+        self.error_result = error_result
+
+    def reload(self, **kwargs):
+        pass
+
+    def result(self, **kwargs):
+        if self.error_result:
+            raise api_exceptions.BadRequest(self.error_result["message"])
+        return self
+
+
+# A BigQuery client that records loaded tables as raw bytes per table ID.
+# load_table_from_uri reads the objects (a URI, wildcard or list of them)
+# from the given FakeStorageClient.
+class FakeBigQueryClient:
+    def __init__(self, project="fake-project", storage_client=None):
+        self.project = project
+        self.storage_client = storage_client
+        self.tables = {}
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def dataset(self, dataset_name):
+        return bigquery.DatasetReference(self.project, dataset_name)
+
+    def get_table(self, table_ref):
+        if table_ref.table_id not in self.tables:
+            raise api_exceptions.NotFound(f"Not found: Table {table_ref.table_id}")
+        return self.tables[table_ref.table_id]
+
+    def list_tables(self, dataset, **kwargs):
+        with self._lock:
+            table_ids = sorted(self.tables)
+        return [bigquery.TableReference(dataset, table_id) for table_id in table_ids]
+
+    def _finish_load(self, table_ref, data):
+        with self._lock:
+            self.tables[table_ref.table_id] = data
+            job = FakeJob(f"fake-job-{len(self.jobs) + 1}")
+            self.jobs.append(job)
+        return job
+
+    def load_table_from_file(self, file, table_ref, job_config=None, rewind=False):
+        if rewind:
+            file.seek(0)
+        return self._finish_load(table_ref, file.read())
+
+    def load_table_from_uri(self, uri, table_ref, job_config=None):
+        data = b""
+        for source_uri in [uri] if isinstance(uri, str) else uri:
+            bucket_name, pattern = source_uri[len("gs://") :].split("/", 1)
+            bucket = self.storage_client.bucket(bucket_name)
+            data += b"".join(
+                blob.download_as_bytes()
+                for blob in bucket.list_blobs()
+                if fnmatch.fnmatchcase(blob.name, pattern)
+            )
+        return self._finish_load(table_ref, data)
+
+
+# A Sink that keeps every unit's output in memory, keyed by object name
+class MemorySink(Sink):
+    name = "memory"
+
+    def __init__(self):
+        self.objects = {}
+
+    def open(self, unit, output_format):
+        return MemoryBuffer()
+
+    def commit(self, unit, output_format, writer, rows_written):
+        self.objects[unit.blob_name] = writer.getvalue()
+        writer.release()
+        return UnitResult(rows_written, len(self.objects[unit.blob_name]), None)
+
+    def discard(self, unit):
+        self.objects.pop(unit.blob_name, None)
+
+    def location(self, unit):
+        return f"memory: {unit.blob_name}"
+
+
+# pyodbc type code of each SQL Server type, for cursor descriptions
+PYODBC_TYPE_CODES = {
+    "bit": bool,
+    "tinyint": int,
+    "smallint": int,
+    "int": int,
+    "bigint": int,
+    "float": float,
+    "real": float,
+    "decimal": Decimal,
+    "numeric": Decimal,
+    "money": Decimal,
+    "smallmoney": Decimal,
+    "date": datetime.date,
+    "datetime": datetime.datetime,
+    "datetime2": datetime.datetime,
+    "smalldatetime": datetime.datetime,
+    "time": datetime.time,
+    "binary": bytes,
+    "varbinary": bytes,
+    "image": bytes,
+    "timestamp": bytes,
+    "rowversion": bytes,
+}
+
+# A synthetic SQL Server table. columns are ColumnInfos, the first being
+# the primary and clustered key; make_row(index) returns row number index
+# as a tuple whose first value is key(index). key must increase with index
+# (the identity by default); an uneven one makes key ranges, and so shards,
+# hold very different numbers of rows.
+FakeTable = namedtuple(
+    "FakeTable",
+    ["name", "columns", "row_count", "make_row", "key", "schema"],
+    defaults=(None, "dbo"),
+)
+
+# Key-range conditions written by shards_from_bounds
+_SHARD_BELOW = re.compile(r"^\[[^\]]+\] < \? OR \[[^\]]+\] IS NULL$")
+_SHARD_FROM = re.compile(r"^\[[^\]]+\] >= \?$")
+_SHARD_BETWEEN = re.compile(r"^\[[^\]]+\] >= \? AND \[[^\]]+\] < \?$")
+
+
+class _KeyIndex:
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.row_count
+
+    def __getitem__(self, index):
+        return _key(self.table, index)
+
+
+def _key(table, index):
+    return table.key(index) if table.key is not None else index
+
+
+class FakeSqlCursor:
+    def __init__(self, server):
+        self.server = server
+        self.description = None
+        self.arraysize = 1
+        self._rows = iter(())
+
+    def _table(self, source):
+        schema, name = [part.strip("[]") for part in source.split(".")]
+        return self.server.tables[(schema, name)]
+
+    def _catalog(self, query):
+        tables = self.server.tables.values()
+        if query == QUERY_TABLE_SIZES:
+            return [
+                (t.schema, t.name, t.row_count, self.server.size_bytes(t))
+                for t in tables
+            ]
+        if query == QUERY_COLUMNS:
+            return [
+                (t.schema, t.name, c.name, c.data_type, c.max_length)
+                + (c.precision, c.scale, "YES" if c.nullable else "NO")
+                for t in tables
+                for c in t.columns
+            ]
+        if query == QUERY_PRIMARY_KEYS:
+            return [(t.schema, t.name, t.columns[0].name) for t in tables]
+        if query == QUERY_CLUSTERED_KEYS:
+            return [
+                (t.schema, t.name, t.columns[0].name, t.columns[0].data_type)
+                for t in tables
+            ]
+        if query == QUERY_CHANGE_TRACKING:
+            return []
+        if query == QUERY_WAIT_STATS:
+            # An idle server
+            return [(0, 0, None)]
+        return None
+
+    # Rows [start, stop) of the table selected by a shard condition
+    def _range(self, table, where, params):
+        keys = _KeyIndex(table)
+        if where is None:
+            return 0, table.row_count
+        if _SHARD_BELOW.match(where):
+            return 0, bisect.bisect_left(keys, params[0])
+        if _SHARD_FROM.match(where):
+            return bisect.bisect_left(keys, params[0]), table.row_count
+        if _SHARD_BETWEEN.match(where):
+            return (
+                bisect.bisect_left(keys, params[0]),
+                bisect.bisect_left(keys, params[1]),
+            )
+        raise NotImplementedError(f"Unsupported condition: {where}")
+
+    def execute(self, query, *params):
+        rows = self._catalog(query)
+        if rows is not None:
+            self._rows = iter(rows)
+            return self
+        match = re.match(r"^SELECT MIN\(.*\), MAX\(.*\) FROM (\S+)$", query)
+        if match:
+            table = self._table(match.group(1))
+            self._rows = iter([(_key(table, 0), _key(table, table.row_count - 1))])
+            return self
+        match = re.match(
+            r"^SELECT (.+?) FROM (\S+)(?: WHERE \((.*)\))?$", query, re.DOTALL
+        )
+        if match is None:
+            raise NotImplementedError(f"Unsupported query: {query}")
+        select, source, where = match.groups()
+        table = self._table(source)
+        names = [column.name for column in table.columns]
+        if select == "*":
+            positions = list(range(len(names)))
+        else:
+            positions = [names.index(name.strip("[] ")) for name in select.split(",")]
+        self.description = [
+            (
+                column.name,
+                PYODBC_TYPE_CODES.get(column.data_type, str),
+                None,
+                column.max_length,
+                column.precision,
+                column.scale,
+                column.nullable,
+            )
+            for column in (table.columns[position] for position in positions)
+        ]
+        start, stop = self._range(table, where, params)
+        project = len(positions) < len(names)
+        self._rows = (
+            tuple(row[position] for position in positions) if project else row
+            for row in map(table.make_row, range(start, stop))
+        )
+        return self
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchmany(self, size=None):
+        return list(itertools.islice(self._rows, size or self.arraysize))
+
+    def close(self):
+        pass
+
+
+class FakeSqlConnection:
+    def __init__(self, server):
+        self.server = server
+
+    def cursor(self):
+        return FakeSqlCursor(self.server)
+
+    def close(self):
+        pass
+
+
+# A SQL Server holding FakeTables. connect is a drop-in for pyodbc.connect
+# (see ConnectionPool and ResourceCache). It answers the catalog's bulk
+# queries, the wait stats of adaptive throttling, the MIN/MAX of shard
+# planning and the planned SELECTs, computing rows as they are fetched.
+class FakeSqlServer:
+    def __init__(self, tables):
+        self.tables = {(table.schema, table.name): table for table in tables}
+
+    def connect(self, connection_string=None, **kwargs):
+        return FakeSqlConnection(self)
+
+    # Reserved size of the table, estimated from its first row
+    def size_bytes(self, table):
+        if not table.row_count:
+            return 0
+        sample = table.make_row(0)
+        width = sum(len(str(value)) for value in sample if value is not None)
+        return table.row_count * width
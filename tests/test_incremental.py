@@ -0,0 +1,142 @@
+from google.cloud import bigquery
+
+from migration.catalog import SourceCatalog, TableInfo
+from migration.incremental import (
+    CHANGE_OP_COLUMN,
+    StateStore,
+    merge_statement,
+    merge_steps,
+    plan_incremental_units,
+)
+from migration.loading import run_steps
+from migration.partition import WHOLE_TABLE, Shard
+from migration.schema import ColumnInfo
+from tests.fakes import FakeJob
+
+COLUMNS = [
+    ColumnInfo("id", "int", None, 10, 0, False),
+    ColumnInfo("name", "varchar", 20, None, None, True),
+]
+
+
+def catalog(primary_key=("id",), change_tracking=(10, 3)):
+    return SourceCatalog(
+        [TableInfo("orders", 100, 4096)],
+        columns={"orders": COLUMNS},
+        primary_keys={"orders": list(primary_key)},
+        change_tracking={"orders": change_tracking},
+    )
+
+
+# The units planned for orders and the watermark staged for it
+def plan(tmp_path, watermark=None, existing_tables=None, **catalog_options):
+    state_store = StateStore(str(tmp_path / "state.json"))
+    if watermark is not None:
+        state_store.stage("orders", mode="change_tracking", watermark=watermark)
+        state_store.commit("orders")
+    units = plan_incremental_units(
+        None, catalog(**catalog_options), state_store, existing_tables=existing_tables
+    )
+    return units, state_store.pending("orders")
+
+
+def test_first_sync_exports_the_whole_table(tmp_path):
+    units, pending = plan(tmp_path)
+    assert [unit.shard for unit in units] == [WHOLE_TABLE]
+    assert units[0].query == "SELECT [id], [name] FROM [dbo].[orders]"
+    assert pending == dict(
+        mode="change_tracking", key_columns=["id"], watermark=10, full=True
+    )
+
+
+def test_changes_since_the_last_version_are_sent(tmp_path):
+    units, pending = plan(tmp_path, watermark=5, existing_tables={"orders"})
+    assert [unit.shard for unit in units] == [Shard(None, (5,))]
+    assert "CHANGETABLE(CHANGES [dbo].[orders], ?)" in units[0].query
+    assert (pending["watermark"], pending["full"]) == (10, False)
+
+
+def test_stale_version_or_missing_target_exports_in_full(tmp_path):
+    # Change Tracking no longer holds the changes since version 2
+    units, pending = plan(tmp_path / "stale", watermark=2)
+    assert [unit.shard for unit in units] == [WHOLE_TABLE]
+    assert pending["full"]
+
+    # The target table was dropped, so the changes alone would not do
+    units, pending = plan(tmp_path / "missing", watermark=5, existing_tables=set())
+    assert [unit.shard for unit in units] == [WHOLE_TABLE]
+    assert pending["full"]
+
+
+def test_tables_without_a_primary_key_are_reloaded(tmp_path):
+    units, pending = plan(tmp_path, watermark=5, primary_key=())
+    assert [unit.shard for unit in units] == [WHOLE_TABLE]
+    assert pending == dict(mode="full", full=True)
+
+
+def test_merge_statement_deletes_only_with_change_tracking():
+    statement = merge_statement("p.d.t", "p.d.s", ["id", "name"], ["id"], True)
+    assert statement == (
+        "MERGE `p.d.t` AS T USING `p.d.s` AS S ON T.`id` = S.`id` "
+        f"WHEN MATCHED AND S.`{CHANGE_OP_COLUMN}` = 'D' THEN DELETE "
+        "WHEN MATCHED THEN UPDATE SET `id` = S.`id`, `name` = S.`name` "
+        f"WHEN NOT MATCHED AND S.`{CHANGE_OP_COLUMN}` != 'D' "
+        "THEN INSERT (`id`, `name`) VALUES (S.`id`, S.`name`)"
+    )
+    assert "DELETE" not in merge_statement("t", "s", ["id"], ["id"], False)
+
+
+# Records the jobs of a merge into a target table with the given schema
+class MergeClient:
+    def __init__(self, schema):
+        self.target = bigquery.Table("p.d.orders", schema=schema)
+        self.loads = []
+        self.queries = []
+        self.deleted = []
+
+    def get_table(self, table_ref):
+        return self.target
+
+    def load_table_from_uri(self, uri, table_ref, job_config=None):
+        self.loads.append((table_ref.table_id, job_config))
+        return FakeJob("load")
+
+    def query(self, statement):
+        self.queries.append(statement)
+        return FakeJob("merge")
+
+    def delete_table(self, table_ref, not_found_ok=False):
+        self.deleted.append(table_ref.table_id)
+
+
+def test_merge_keeps_the_change_operation_out_of_the_target():
+    # A target created by loading a delta carries the operation column
+    client = MergeClient(
+        [
+            bigquery.SchemaField(CHANGE_OP_COLUMN, "STRING"),
+            bigquery.SchemaField("id", "INTEGER"),
+            bigquery.SchemaField("name", "STRING"),
+        ]
+    )
+    state = run_steps(
+        merge_steps(
+            client,
+            bigquery.TableReference.from_string("p.d.orders"),
+            "gs://b/orders.csv",
+            {"source_format": "CSV", "skip_leading_rows": 1},
+            ["id"],
+            with_deletes=True,
+        )
+    )
+    assert state == "merged"
+    ((staging_name, job_config),) = client.loads
+    assert staging_name == "orders__delta"
+    assert [field.name for field in job_config.schema] == [
+        CHANGE_OP_COLUMN,
+        "id",
+        "name",
+    ]
+    (statement,) = client.queries
+    assert "INSERT (`id`, `name`)" in statement
+    assert f"`{CHANGE_OP_COLUMN}` = S." not in statement
+    assert client.deleted == ["orders__delta"]
@@ -0,0 +1,138 @@
+from google.api_core import exceptions as api_exceptions
+
+from migration.engine import MigrationConfig, transfer_to_bigquery
+from migration.loading import (
+    MAX_BACKOFF,
+    LoadJobError,
+    LoadScheduler,
+    backoff_delay,
+    load_steps,
+)
+from migration.staging import run_prefix
+from tests.fakes import FakeBigQueryClient, FakeStorageClient
+
+
+# A load job that is done once polled, failing with error_result if given
+class FakeJob:
+    def __init__(self, job_id, error_result=None):
+        self.job_id = job_id
+        self.error_result = error_result
+        self.state = "RUNNING"
+
+    def reload(self):
+        self.state = "DONE"
+
+
+# Submits jobs as scripted: each entry of outcomes is an exception raised by
+# the submission or the error_result of the job (None when it succeeds)
+class ScriptedClient:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.submitted = 0
+
+    def load_table_from_uri(self, uri, table_ref, job_config=None):
+        self.submitted += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeJob(f"job-{self.submitted}", outcome)
+
+
+def run_load(client, max_attempts=5):
+    retries = []
+    scheduler = LoadScheduler(
+        poll_interval=0,
+        max_attempts=max_attempts,
+        backoff=0,
+        on_retry=lambda table_name, source_name, error: retries.append(error),
+        sleep=lambda seconds: None,
+    )
+    scheduler.submit(
+        "orders", "orders/*.csv", load_steps(client, "gs://b/orders", "orders", None)
+    )
+    (outcome,) = scheduler.run()
+    return outcome, retries
+
+
+def test_unavailable_submission_is_retried():
+    client = ScriptedClient([api_exceptions.ServiceUnavailable("down"), None])
+    outcome, retries = run_load(client)
+    assert (outcome.state, outcome.job_id, outcome.error) == ("loaded", "job-2", None)
+    assert len(retries) == 1
+    assert isinstance(retries[0], api_exceptions.ServiceUnavailable)
+
+
+def test_rate_limited_job_is_submitted_again():
+    rate_limited = {"reason": "rateLimitExceeded", "message": "Too many jobs"}
+    client = ScriptedClient([rate_limited, rate_limited, None])
+    outcome, retries = run_load(client)
+    assert (outcome.state, outcome.job_id) == ("loaded", "job-3")
+    assert [str(error) for error in retries] == ["Too many jobs"] * 2
+
+
+def test_permanent_error_fails_at_once():
+    invalid = {"reason": "invalid", "message": "Bad CSV"}
+    client = ScriptedClient([invalid])
+    outcome, retries = run_load(client)
+    assert (outcome.state, outcome.job_id) == ("failed", "job-1")
+    assert isinstance(outcome.error, LoadJobError)
+    assert retries == []
+
+
+def test_transient_errors_give_up_after_max_attempts():
+    client = ScriptedClient([api_exceptions.ServiceUnavailable("down")] * 3)
+    outcome, retries = run_load(client, max_attempts=3)
+    assert outcome.state == "failed"
+    assert client.submitted == 3
+    assert len(retries) == 2
+
+
+def test_backoff_doubles_up_to_the_cap():
+    for attempt, ceiling in ((1, 2.0), (2, 4.0), (3, 8.0), (10, MAX_BACKOFF)):
+        delay = backoff_delay(attempt, backoff=2.0)
+        # Jittered down by at most half
+        assert ceiling / 2 <= delay <= ceiling
+
+
+# Records the write disposition of every load
+class RecordingBigQueryClient(FakeBigQueryClient):
+    def __init__(self, storage_client):
+        super().__init__(storage_client=storage_client)
+        self.dispositions = {}
+
+    def load_table_from_uri(self, uri, table_ref, job_config=None):
+        self.dispositions[table_ref.table_id] = job_config.write_disposition
+        return super().load_table_from_uri(uri, table_ref, job_config)
+
+
+def test_merge_without_a_primary_key_replaces_the_table(tmp_path):
+    config = MigrationConfig(
+        "server",
+        "database",
+        "user",
+        "password",
+        "bucket",
+        "dataset",
+        "project",
+        write_mode="merge",
+        state_path=str(tmp_path / "state.json"),
+    )
+    storage_client = FakeStorageClient()
+    bucket = storage_client.bucket("bucket")
+    prefix = run_prefix(config.staging_prefix, "run-1")
+    for table_name in ("orders", "customers"):
+        bucket.blob(f"{prefix}{table_name}.csv").upload_from_string(b"id\n1\n")
+    bigquery_client = RecordingBigQueryClient(storage_client)
+    bigquery_client.tables["orders"] = b"id\n0\n"
+
+    messages = []
+    # Without a manifest no table has a known primary key
+    transfer_to_bigquery(
+        config, bigquery_client, storage_client, log=messages.append, run_id="run-1"
+    )
+    assert "Table orders has no primary key. Replacing it instead" in messages
+    assert bigquery_client.dispositions == {
+        "orders": "WRITE_TRUNCATE",
+        "customers": "WRITE_TRUNCATE",
+    }
+    assert bigquery_client.tables["orders"] == b"id\n1\n"
@@ -0,0 +1,84 @@
+import datetime
+from decimal import Decimal
+
+from migration.connection import ConnectionPool
+from migration.export import ExportUnit, export_tables
+from migration.manifest import JobManifest
+from migration.partition import WHOLE_TABLE, Shard
+from migration.schema import ColumnInfo
+from tests.fakes import FakeSqlServer, FakeStorageClient, FakeTable
+
+COLUMNS = [
+    ColumnInfo("id", "int", None, 10, 0, False),
+    ColumnInfo("name", "varchar", 20, None, None, True),
+]
+
+
+def test_resumed_plan_keeps_the_types_of_shard_params(tmp_path):
+    units = [
+        ExportUnit("orders", "orders/part-00001.csv", Shard("[id] < ?", (10,)), 5),
+        ExportUnit(
+            "payments",
+            "payments/part-00001.csv",
+            Shard("[amount] >= ? AND [amount] < ?", (Decimal("0.10"), Decimal("2.5"))),
+            5,
+        ),
+        ExportUnit(
+            "events",
+            "events/part-00001.csv",
+            Shard(
+                "[day] >= ? AND [at] < ?",
+                (datetime.date(2024, 1, 1), datetime.datetime(2024, 1, 2, 3, 4, 5)),
+            ),
+            5,
+            "SELECT [day], [at] FROM [dbo].[events]",
+            "bigquery",
+        ),
+        ExportUnit(
+            "changes", "changes.csv", Shard("[version] >= ?", (b"\x00\x01\xff",)), 5
+        ),
+    ]
+    manifest = JobManifest(str(tmp_path / "manifest.db"))
+    assert not manifest.open_run("key")
+    manifest.save_plan(units)
+    manifest.close()
+
+    manifest = JobManifest(str(tmp_path / "manifest.db"))
+    assert manifest.open_run("key")
+    resumed = manifest.load_plan()
+    manifest.close()
+    assert resumed == units
+    assert [type(value) for unit in resumed for value in unit.shard.params] == [
+        int,
+        Decimal,
+        Decimal,
+        datetime.date,
+        datetime.datetime,
+        bytes,
+    ]
+
+
+def test_exported_objects_are_not_exported_again(tmp_path):
+    server = FakeSqlServer(
+        [FakeTable(name, COLUMNS, 3, lambda i: (i, "x")) for name in ("a", "b")]
+    )
+    units = [
+        ExportUnit(name, f"{name}.csv", WHOLE_TABLE, 3, f"SELECT * FROM [dbo].[{name}]")
+        for name in ("a", "b")
+    ]
+    manifest = JobManifest(str(tmp_path / "manifest.db"))
+    manifest.open_run("key")
+    manifest.save_plan(units)
+    manifest.record_export("a.csv", 3, 10, 1)
+
+    bucket = FakeStorageClient().bucket("staging")
+    messages = []
+    pool = ConnectionPool("fake", connect=server.connect)
+    summary = export_tables(pool, bucket, units, log=messages.append, manifest=manifest)
+    pool.close()
+    assert "Skipping 1 objects already exported" in messages
+    assert sorted(bucket.objects) == ["b.csv"]
+    assert summary.rows_written == 3
+    assert manifest.is_exported("b.csv")
+    assert manifest.table_status("a") == manifest.table_status("b") == "exported"
+    manifest.close()
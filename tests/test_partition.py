@@ -0,0 +1,43 @@
+from migration.partition import WHOLE_TABLE, Shard, plan_shards
+
+
+# Answers the MIN/MAX query of plan_shards and keeps what it was asked
+class BoundsCursor:
+    def __init__(self, low, high):
+        self.bounds = (low, high)
+        self.queries = []
+
+    def execute(self, query, *params):
+        self.queries.append(query)
+
+    def fetchone(self):
+        return self.bounds
+
+
+def test_shards_span_the_key_range():
+    cursor = BoundsCursor(0, 99)
+    shards = plan_shards(cursor, "[dbo].[orders]", 4, ("id", "int"))
+    assert cursor.queries == ["SELECT MIN([id]), MAX([id]) FROM [dbo].[orders]"]
+    assert shards == [
+        Shard("[id] < ? OR [id] IS NULL", (25,)),
+        Shard("[id] >= ? AND [id] < ?", (25, 50)),
+        Shard("[id] >= ? AND [id] < ?", (50, 75)),
+        Shard("[id] >= ?", (75,)),
+    ]
+
+
+def test_bounds_of_a_filtered_table_cover_only_selected_rows():
+    cursor = BoundsCursor(1000, 1999)
+    plan_shards(cursor, "[dbo].[orders]", 2, ("id", "int"), "[region] = 'EU'")
+    assert cursor.queries == [
+        "SELECT MIN([id]), MAX([id]) FROM [dbo].[orders] WHERE ([region] = 'EU')"
+    ]
+
+
+def test_small_or_unsplittable_tables_are_exported_whole():
+    cursor = BoundsCursor(5, 5)
+    assert plan_shards(cursor, "[dbo].[t]", 1, ("id", "int")) == [WHOLE_TABLE]
+    assert plan_shards(cursor, "[dbo].[t]", 4, None) == [WHOLE_TABLE]
+    assert cursor.queries == []
+    # A single distinct key value
+    assert plan_shards(cursor, "[dbo].[t]", 4, ("id", "int")) == [WHOLE_TABLE]
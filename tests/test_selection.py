@@ -0,0 +1,85 @@
+import pytest
+
+from migration.schema import ColumnInfo
+from migration.selection import TableFilter, setting_for, target_names
+
+COLUMNS = [
+    ColumnInfo("id", "int", None, 10, 0, False),
+    ColumnInfo("total", "decimal", None, 18, 2, True),
+    ColumnInfo("note", "varchar", 200, None, None, True),
+    ColumnInfo("version", "timestamp", 8, None, None, False),
+]
+
+
+def selected(table_filter):
+    tables = [
+        ("dbo", "orders"),
+        ("dbo", "orders_archive"),
+        ("sales", "orders"),
+        ("sales", "Customers"),
+        ("hr", "people"),
+    ]
+    return [pair for pair in tables if table_filter.selects(*pair)]
+
+
+def test_globs_match_the_table_name_in_any_schema():
+    assert selected(TableFilter(include=["orders*"])) == [
+        ("dbo", "orders"),
+        ("dbo", "orders_archive"),
+        ("sales", "orders"),
+    ]
+    assert selected(TableFilter(include=["orders*"], exclude=["*_archive"])) == [
+        ("dbo", "orders"),
+        ("sales", "orders"),
+    ]
+
+
+def test_dotted_globs_and_regular_expressions_match_schema_and_table():
+    assert selected(TableFilter(include=["sales.*"])) == [
+        ("sales", "orders"),
+        ("sales", "Customers"),
+    ]
+    # Case-insensitive, and matched against the whole name
+    assert selected(TableFilter(include=[r"re:(sales|hr)\.(customers|people)"])) == [
+        ("sales", "Customers"),
+        ("hr", "people"),
+    ]
+    assert selected(TableFilter(exclude=["re:orders"])) == selected(TableFilter())
+
+
+def test_projection_keeps_key_columns_in_table_order():
+    table_filter = TableFilter(columns={"sales.orders": ["note", "ID"]})
+    projected = table_filter.project("sales", "orders", COLUMNS, keep=["version"])
+    assert [column.name for column in projected] == ["id", "note", "version"]
+    # Other tables keep every column
+    assert table_filter.project("dbo", "orders", COLUMNS) == COLUMNS
+
+    with pytest.raises(ValueError, match="Unknown columns for sales.orders: price"):
+        TableFilter(columns={"sales.orders": ["price"]}).project(
+            "sales", "orders", COLUMNS
+        )
+
+
+def test_first_matching_pattern_wins():
+    table_filter = TableFilter(where={"sales.*": "[region] = 'EU'", "*": "1 = 0"})
+    assert table_filter.predicate("sales", "orders") == "[region] = 'EU'"
+    assert table_filter.predicate("dbo", "orders") == "1 = 0"
+    assert setting_for({"orders": "merge"}, "dbo", "people", "truncate") == "truncate"
+
+
+def test_colliding_target_names_get_a_suffix():
+    names = target_names(
+        [
+            ("sales", "orders"),
+            ("dbo", "sales_orders"),
+            ("Sales", "Orders"),
+            ("dbo", "orders"),
+        ]
+    )
+    assert names == {
+        # Tables of dbo are named first, so they keep their name
+        ("dbo", "orders"): "orders",
+        ("dbo", "sales_orders"): "sales_orders",
+        ("Sales", "Orders"): "Sales_Orders_2",
+        ("sales", "orders"): "sales_orders_3",
+    }
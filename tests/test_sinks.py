@@ -0,0 +1,172 @@
+from collections import namedtuple
+
+from migration.engine import MigrationConfig, run_migration
+from migration.export import ExportUnit, export_unit
+from migration.formats import CsvFormat
+from migration.partition import WHOLE_TABLE, Shard
+from migration.resources import ResourceCache
+from migration.schema import ColumnInfo
+from migration.sinks import BigQuerySink, route_small_tables
+from tests.fakes import (
+    FakeBigQueryClient,
+    FakeSqlServer,
+    FakeStorageClient,
+    FakeTable,
+    MemorySink,
+)
+
+COLUMNS = [
+    ColumnInfo("id", "int", None, 10, 0, False),
+    ColumnInfo("name", "varchar", 20, None, None, True),
+]
+
+CatalogTable = namedtuple("CatalogTable", ["name", "size_bytes"])
+
+
+def fake_table(name, row_count):
+    return FakeTable(name, COLUMNS, row_count, lambda index: (index, f"n{index}"))
+
+
+def unit(table_name, shard=WHOLE_TABLE):
+    return ExportUnit(
+        table_name,
+        f"{table_name}.csv",
+        shard,
+        0,
+        f"SELECT [id], [name] FROM [dbo].[{table_name}]",
+    )
+
+
+def test_only_small_whole_tables_of_known_size_go_to_bigquery():
+    units = [
+        unit("small"),
+        unit("big"),
+        unit("unknown"),
+        unit("sharded", Shard("[id] < ? OR [id] IS NULL", (10,))),
+        unit("sharded", Shard("[id] >= ?", (10,))),
+    ]
+    tables = [
+        CatalogTable("small", 1000),
+        CatalogTable("big", 10**9),
+        CatalogTable("unknown", 0),
+        CatalogTable("sharded", 1000),
+    ]
+    routed = route_small_tables(units, tables, max_bytes=1024 * 1024)
+    assert [routed_unit.sink for routed_unit in routed] == [
+        "bigquery",
+        "gcs",
+        "gcs",
+        "gcs",
+        "gcs",
+    ]
+
+
+def test_export_unit_writes_into_any_sink():
+    server = FakeSqlServer([fake_table("people", 3)])
+    sink = MemorySink()
+    result = export_unit(server.connect(), sink, unit("people"))
+    assert result.rows_written == 3
+    assert sink.objects["people.csv"].splitlines()[1:] == [
+        b'0,"n0"',
+        b'1,"n1"',
+        b'2,"n2"',
+    ]
+
+
+def export_direct(bigquery_client, write_mode, existing_tables):
+    server = FakeSqlServer([fake_table("people", 3)])
+    sink = BigQuerySink(
+        bigquery_client,
+        "dataset",
+        existing_tables=existing_tables,
+        write_modes={"people": write_mode},
+    )
+    return export_unit(
+        server.connect(), sink, unit("people")._replace(sink="bigquery"), CsvFormat()
+    )
+
+
+def test_bigquery_sink_follows_the_write_mode_of_existing_tables():
+    bigquery_client = FakeBigQueryClient()
+    result = export_direct(bigquery_client, "truncate", set())
+    assert result.load_state == "loaded"
+    assert bigquery_client.tables["people"].startswith(b"id,name")
+
+    assert export_direct(bigquery_client, "truncate", {"people"}).load_state == (
+        "replaced"
+    )
+    assert export_direct(bigquery_client, "append", {"people"}).load_state == (
+        "appended"
+    )
+
+    bigquery_client.tables["people"] = b"kept"
+    result = export_direct(bigquery_client, "skip", {"people"})
+    assert result.load_state == "skipped"
+    assert bigquery_client.tables["people"] == b"kept"
+
+
+# Migrate the tables and return the names of the objects staged in GCS
+def staged_objects(tmp_path, tables, bigquery_client=None, **options):
+    storage_client = FakeStorageClient()
+    bigquery_client = bigquery_client or FakeBigQueryClient(
+        storage_client=storage_client
+    )
+    bigquery_client.storage_client = storage_client
+    resources = ResourceCache(
+        client_factory=lambda config: (storage_client, bigquery_client),
+        connect=FakeSqlServer(tables).connect,
+    )
+    config = MigrationConfig(
+        "server",
+        "database",
+        "user",
+        "password",
+        "bucket",
+        "dataset",
+        "project",
+        shard_rows=100,
+        manifest_path=str(tmp_path / "manifest.db"),
+        state_path=str(tmp_path / "state.json"),
+        metrics_path=None,
+        report_dir=None,
+        **options,
+    )
+    run_migration(config, log=lambda message: None, resources=resources)
+    resources.close()
+    return [
+        blob.name.rsplit("/", 2)[-2:]
+        for blob in storage_client.bucket("bucket").list_blobs()
+    ]
+
+
+def test_small_tables_skip_gcs_unless_disabled(tmp_path):
+    tables = [fake_table("small", 10), fake_table("sharded", 250)]
+    bigquery_client = FakeBigQueryClient()
+    staged = staged_objects(
+        tmp_path, tables, bigquery_client, direct_max_bytes=1024 * 1024
+    )
+    # Only the sharded table was staged; both were loaded
+    assert {folder for folder, _ in staged} == {"sharded"}
+    assert set(bigquery_client.tables) == {"small", "sharded"}
+
+    staged = staged_objects(tmp_path / "off", tables, direct_max_bytes=0)
+    assert ["small.csv"] in [[name] for _, name in staged]
+
+
+def test_incremental_and_merge_tables_stay_staged(tmp_path):
+    tables = [fake_table("small", 10)]
+    staged = staged_objects(
+        tmp_path, tables, direct_max_bytes=1024 * 1024, sync_mode="incremental"
+    )
+    assert [name for _, name in staged] == ["small.csv"]
+
+    bigquery_client = FakeBigQueryClient()
+    bigquery_client.tables["small"] = b""
+    staged = staged_objects(
+        tmp_path / "merge",
+        tables,
+        bigquery_client,
+        direct_max_bytes=1024 * 1024,
+        write_mode="merge",
+    )
+    assert [name for _, name in staged] == ["small.csv"]
@@ -0,0 +1,142 @@
+import itertools
+import tracemalloc
+
+from migration.pipeline import run_pipeline
+from migration.streaming import BatchSizer, write_csv_stream
+
+# pyodbc description entries: name, type code, display size, internal size
+# (0 for MAX types), precision, scale, nullable
+NARROW_DESCRIPTION = [
+    ("id", int, None, 10, 10, 0, False),
+    ("code", str, None, 20, 20, 0, True),
+    ("amount", float, None, 53, 53, 0, True),
+]
+LOB_DESCRIPTION = [
+    ("id", int, None, 10, 10, 0, False),
+    ("body", str, None, 0, 0, 0, True),
+]
+
+LOB_TEXT = "x" * (128 * 1024)
+
+
+# A cursor whose rows are made as they are fetched, so the only rows in
+# memory are those the export asked for
+class GeneratorCursor:
+    def __init__(self, row_count, description, make_row):
+        self.description = description
+        self.arraysize = 1
+        self.largest_fetch = 0
+        self._rows = (make_row(index) for index in range(row_count))
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        self.largest_fetch = max(self.largest_fetch, size)
+        return list(itertools.islice(self._rows, size))
+
+
+# A file that only counts what is written to it
+class CountingFile:
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return len(data)
+
+
+def narrow_row(index):
+    return (index, f"C{index % 100000:08d}", index / 7.0)
+
+
+def lob_row(index):
+    # A fresh string per row, as pyodbc returns them
+    return (index, LOB_TEXT[: -(index % 1000) - 1] + "y")
+
+
+# Peak bytes allocated by Python while function runs, on every thread
+def peak_allocated(function):
+    tracemalloc.start()
+    try:
+        result = function()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def stream_narrow_rows(row_count):
+    cursor = GeneratorCursor(row_count, NARROW_DESCRIPTION, narrow_row)
+    file = CountingFile()
+    rows = write_csv_stream(cursor, file, batch_size=10000)
+    return rows, cursor, file
+
+
+def test_csv_stream_memory_does_not_grow_with_rows():
+    (rows, cursor, file), peak = peak_allocated(lambda: stream_narrow_rows(500000))
+    assert rows == 500000
+    assert cursor.largest_fetch == 10000
+    # A few batches, far less than the CSV text written
+    assert peak < 8 * 1024 * 1024 < file.written / 2
+
+    # Ten times the rows take no more memory
+    _, small_peak = peak_allocated(lambda: stream_narrow_rows(50000))
+    assert peak < small_peak * 1.5
+
+
+def test_pipeline_sizes_lob_batches_by_bytes():
+    cursor = GeneratorCursor(2000, LOB_DESCRIPTION, lob_row)
+    file = CountingFile()
+
+    def export():
+        return run_pipeline(
+            cursor,
+            file,
+            write_csv_stream,
+            batch_size=10000,
+            queue_depth=2,
+            batch_bytes=2 * 1024 * 1024,
+        )
+
+    rows, peak = peak_allocated(export)
+    assert rows == 2000
+    # About 250 MB of text went through in batches of about 2 MB
+    assert file.written > 200 * 1024 * 1024
+    # Only the first batch, sized from the guessed width of a large object,
+    # goes over the budget
+    assert cursor.largest_fetch <= 2 * 2 * 1024 * 1024 // len(LOB_TEXT)
+    assert peak < 40 * 1024 * 1024
+
+
+def test_batch_sizer_follows_measured_width():
+    sizer = BatchSizer(LOB_DESCRIPTION, batch_size=10000, batch_bytes=1024 * 1024)
+    # Large objects are assumed wide until measured
+    assert sizer.size() < 20
+    # and then settle on the width of the rows fetched
+    for _ in range(20):
+        sizer.measured([(index, "x" * 100) for index in range(1000)])
+    assert sizer.size() > sizer.size(limit=50) == 50
+    # Wider rows shrink the next batch at once
+    sizer.measured([(index, LOB_TEXT) for index in range(10)])
+    assert sizer.size() <= 1024 * 1024 // len(LOB_TEXT)
+
+    narrow = BatchSizer(NARROW_DESCRIPTION, batch_size=10000)
+    assert narrow.size() == 10000
+
+
+def test_pipeline_reports_the_estimated_bytes_fetched():
+    cursor = GeneratorCursor(100000, NARROW_DESCRIPTION, narrow_row)
+    fetched = []
+    rows = run_pipeline(
+        cursor,
+        CountingFile(),
+        write_csv_stream,
+        batch_size=10000,
+        on_fetch=fetched.append,
+    )
+    assert rows == 100000
+    assert len(fetched) == 10
+    # Between the measured width of the rows and their declared width
+    measured = BatchSizer(NARROW_DESCRIPTION)
+    declared = measured.row_width
+    for _ in range(20):
+        measured.measured([narrow_row(index) for index in range(1000)])
+    assert rows * measured.row_width <= sum(fetched) <= rows * declared
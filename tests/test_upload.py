@@ -0,0 +1,68 @@
+import pytest
+from google.api_core import exceptions as api_exceptions
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+from migration.upload import COMPONENT_PREFIX, MAX_COMPOSE_SOURCES, CompositeWriter
+from tests.fakes import FakeStorageClient
+
+PART_SIZE = 1024
+
+# Retries transient errors without the production backoff's waits
+FAST_RETRY = DEFAULT_RETRY.with_delay(initial=0.001, maximum=0.01)
+
+
+def part_data(parts):
+    return bytes(index % 251 for index in range(PART_SIZE * parts + PART_SIZE // 2))
+
+
+def components(bucket):
+    return [name for name in bucket.objects if name.startswith(COMPONENT_PREFIX)]
+
+
+def test_parts_are_retried_and_composed_in_rounds():
+    client = FakeStorageClient(fail_uploads=5)
+    bucket = client.bucket("staging")
+    data = part_data(MAX_COMPOSE_SOURCES + 8)
+
+    with CompositeWriter(
+        bucket.blob("orders.csv"), PART_SIZE, parallelism=4, retry=FAST_RETRY
+    ) as writer:
+        # Writes that do not line up with parts
+        for start in range(0, len(data), 700):
+            writer.write(data[start : start + 700])
+
+    # Every injected failure was retried
+    assert client.fail_uploads == 0
+    assert bucket.objects["orders.csv"][0] == data
+    assert components(bucket) == []
+
+
+def test_small_objects_are_uploaded_in_one_request():
+    bucket = FakeStorageClient().bucket("staging")
+    with CompositeWriter(bucket.blob("small.csv"), PART_SIZE) as writer:
+        writer.write("id,name\n1,a\n")
+    assert bucket.objects["small.csv"][0] == b"id,name\n1,a\n"
+    assert components(bucket) == []
+
+
+def test_aborted_export_composes_nothing():
+    bucket = FakeStorageClient().bucket("staging")
+    with pytest.raises(RuntimeError):
+        with CompositeWriter(bucket.blob("orders.csv"), PART_SIZE) as writer:
+            writer.write(part_data(5))
+            raise RuntimeError("export failed")
+    assert "orders.csv" not in bucket.objects
+    assert components(bucket) == []
+
+
+def test_failed_part_fails_the_object_and_removes_the_parts():
+    client = FakeStorageClient(fail_uploads=1)
+    bucket = client.bucket("staging")
+    # Raised by a later write or by close, whichever sees it first
+    with pytest.raises(api_exceptions.ServiceUnavailable):
+        with CompositeWriter(
+            bucket.blob("orders.csv"), PART_SIZE, retry=None
+        ) as writer:
+            writer.write(part_data(3))
+    assert "orders.csv" not in bucket.objects
+    assert components(bucket) == []
@@ -0,0 +1,94 @@
+import contextlib
+
+from google.cloud import bigquery
+
+from migration.export import ExportUnit
+from migration.partition import WHOLE_TABLE
+from migration.validation import validate_tables
+
+SOURCE_ROWS = {"customers": 10, "orders": 20, "payments": 30}
+
+
+def unit(table_name):
+    return ExportUnit(
+        table_name, f"{table_name}.csv", WHOLE_TABLE, 0, f"SELECT * FROM {table_name}"
+    )
+
+
+# Counts the rows of SQL Server tables, calling on_query after each count
+class CountingPool:
+    def __init__(self, on_query=None):
+        self.on_query = on_query or (lambda: None)
+        self.queries = []
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, *params):
+        self.queries.append(query)
+        self.table_name = query.rsplit(" FROM ", 1)[1].split(")")[0]
+
+    def fetchone(self):
+        self.on_query()
+        return (SOURCE_ROWS[self.table_name],)
+
+    def close(self):
+        pass
+
+
+class CountingJob:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def result(self):
+        return [{"rows": self.rows}]
+
+
+# Answers row count queries with the loaded rows of each table
+class CountingBigQuery:
+    def __init__(self, loaded_rows):
+        self.loaded_rows = loaded_rows
+
+    def query(self, query):
+        return CountingJob(self.loaded_rows[query.rsplit(".", 1)[1].strip("`")])
+
+
+def checks(pool, loaded_rows, should_stop=None):
+    return list(
+        validate_tables(
+            pool,
+            CountingBigQuery(loaded_rows),
+            bigquery.DatasetReference("project", "dataset"),
+            {table_name: [unit(table_name)] for table_name in SOURCE_ROWS},
+            {},
+            dict(SOURCE_ROWS),
+            max_workers=1,
+            should_stop=should_stop,
+        )
+    )
+
+
+def test_row_counts_are_compared_per_table():
+    results = checks(CountingPool(), dict(SOURCE_ROWS, orders=19))
+    assert [(check.table_name, check.status) for check in results] == [
+        ("customers", "match"),
+        ("orders", "mismatch"),
+        ("payments", "match"),
+    ]
+    assert results[1].target_rows == 19
+
+
+def test_tables_not_compared_before_a_stop_are_skipped():
+    stopped = []
+    pool = CountingPool(on_query=lambda: stopped.append(True))
+    results = checks(pool, SOURCE_ROWS, should_stop=lambda: bool(stopped))
+    assert [(check.table_name, check.status) for check in results] == [
+        ("customers", "match"),
+        ("orders", "skipped"),
+        ("payments", "skipped"),
+    ]
+    assert len(pool.queries) == 1